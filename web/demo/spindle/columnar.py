@@ -0,0 +1,86 @@
+"""Streaming, columnar JSON for large collections of model instances.
+
+Django's serializers build a model instance and a dict for every row
+before writing anything.  `serialize' instead reads the rows in
+chunks with values_list(), and writes each chunk as parallel arrays,
+one per field:
+
+  {"model": "spindle.clip",
+   "fields": ["pk", "track", "intime", "outtime", ...],
+   "chunks": [[[1, 2, ...], [7, 7, ...], [0.0, 4.0, ...], ...], ...]}
+
+Memory use does not grow with the size of the collection, and the
+first bytes go out after the first chunk is read.
+"""
+
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+# Rows read per query
+CHUNK_SIZE = 1000
+
+
+def field_columns(model):
+    """Return the names of the columns for `model', primary key
+    first, and the corresponding attribute names."""
+    fields = [model._meta.pk] + [field for field in model._meta.local_fields
+                                 if not field.primary_key]
+    names = ['pk' if field.primary_key else field.name for field in fields]
+    return names, [field.attname for field in fields]
+
+
+def iter_chunks(query_set, attnames, chunk_size=None):
+    """Yield lists of up to `chunk_size' (default CHUNK_SIZE) rows of
+    `query_set', in order of primary key.  The primary key must be the
+    first of `attnames'."""
+    chunk_size = chunk_size or CHUNK_SIZE
+    query_set = query_set.order_by('pk')
+    last = None
+    while True:
+        chunk = query_set if last is None else query_set.filter(pk__gt=last)
+        rows = list(chunk.values_list(*attnames)[:chunk_size])
+        if rows: yield rows
+        if len(rows) < chunk_size: break
+        last = rows[-1][0]
+
+
+def serialize(query_set, chunk_size=None):
+    """Yield the columnar JSON serialization of `query_set', a piece
+    at a time."""
+    names, attnames = field_columns(query_set.model)
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+    yield '{{"model":{},"fields":{},"chunks":['.format(
+        json.dumps(unicode(query_set.model._meta)), encoder.encode(names))
+    for n, rows in enumerate(iter_chunks(query_set, attnames, chunk_size)):
+        yield (',' if n else '') + encoder.encode(zip(*rows))
+    yield ']}'
+
+
+def gzip_stream(pieces, level=6):
+    """Compress an iterable of strings as a gzip stream, flushing
+    after each piece so that it can be sent straight away."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for piece in pieces:
+        yield compressor.compress(piece) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def stream_response(request, pieces):
+    """Streaming JSON response made of the strings `pieces', gzipped
+    if the client accepts it."""
+    gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if gzip: pieces = gzip_stream(pieces)
+
+    response = HttpResponse(pieces, content_type='application/json')
+    response['Vary'] = 'Accept-Encoding'
+    if gzip: response['Content-Encoding'] = 'gzip'
+    return response
+
+def columnar_response(request, query_set):
+    """Streaming response with the columnar serialization of
+    `query_set'."""
+    return stream_response(request, serialize(query_set))
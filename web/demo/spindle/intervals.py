@@ -0,0 +1,96 @@
+"""Fast lookup of the clips of a track by playback time.
+
+Player-synchronised views poll for the clip being played several times
+a second.  Each process keeps the clips of recently used tracks in
+memory, sorted by in time and already serialized, so that a lookup is
+a binary search with no clip query.  The only query is for the track's
+content version and clip count, and a track is reloaded when either
+has changed (see Track.content_changed).
+
+Clips may overlap.  A clip is active at time t if intime <= t <
+outtime, and overlaps the range [start, end) if intime < end and
+outtime > start.
+"""
+
+import bisect
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+
+from spindle.models import Track, Clip
+
+# Number of tracks to keep in memory in each process
+try:
+    CACHE_TRACKS = settings.SPINDLE_INTERVAL_CACHE_TRACKS
+except:
+    CACHE_TRACKS = 50
+
+
+class TrackIntervals(object):
+    """The clips of one track, sorted by in time.
+
+    `intimes', `outtimes': the in and out times of the clips
+    `json': the JSON serialization of each clip, as a string
+    `max_duration': length of the longest clip, which bounds how far
+    back from a time an active clip can start
+    """
+
+    def __init__(self, version, clips):
+        encoder = DjangoJSONEncoder(separators=(',', ':'))
+        self.version = version
+        self.intimes = [clip.intime for clip in clips]
+        self.outtimes = [clip.outtime for clip in clips]
+        self.json = [encoder.encode(obj)
+                     for obj in serializers.serialize('python', clips)]
+        self.max_duration = max([clip.outtime - clip.intime for clip in clips]
+                                or [0.0])
+
+    @classmethod
+    def load(cls, track_id, version):
+        clips = list(Clip.objects.filter(track=track_id).order_by('intime', 'pk'))
+        return cls(version, clips)
+
+    def overlapping(self, start, end):
+        """Indexes of the clips overlapping [start, end), in order."""
+        first = bisect.bisect_left(self.intimes, start - self.max_duration)
+        last = bisect.bisect_left(self.intimes, end)
+        return [n for n in xrange(first, last) if self.outtimes[n] > start]
+
+    def at(self, time):
+        """Indexes of the clips active at `time', in order."""
+        first = bisect.bisect_left(self.intimes, time - self.max_duration)
+        last = bisect.bisect_right(self.intimes, time)
+        return [n for n in xrange(first, last) if self.outtimes[n] > time]
+
+    def serialize(self, indexes):
+        """JSON list of the clips at `indexes'."""
+        return '[' + ','.join(self.json[n] for n in indexes) + ']'
+
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def for_track(track_id):
+    """Return the TrackIntervals for the track with primary key
+    `track_id', loading it if needed.  Raises Track.DoesNotExist."""
+    version = tuple(Track.objects.filter(pk=track_id)
+                    .values_list('content_version', 'clip_count').get())
+    with _lock:
+        intervals = _cache.pop(track_id, None)
+        if intervals is not None and intervals.version == version:
+            _cache[track_id] = intervals
+            return intervals
+
+    intervals = TrackIntervals.load(track_id, version)
+    with _lock:
+        _cache[track_id] = intervals
+        while len(_cache) > CACHE_TRACKS:
+            _cache.popitem(last=False)
+    return intervals
+
+def clear():
+    with _lock:
+        _cache.clear()
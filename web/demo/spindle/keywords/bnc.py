@@ -1,10 +1,149 @@
+"""Word frequency distributions from the spoken part of the British
+National Corpus.
+
+The frequencies are stored as a sorted string table plus a frequency
+array, which are memory-mapped the first time a word is looked up.
+Importing this module costs nothing, and worker processes share the
+same pages of the page cache instead of each unpickling a dictionary.
+
+  bnc_words.bin   words (UTF-8, non stopwords only), grouped by length
+                  in bytes and sorted within each group, without
+                  separators
+  bnc_lengths.npy number of words of each length
+  bnc_freqs.npy   frequency of each word, in the same order
+
+Run this file as a script to regenerate them from the legacy pickle,
+bnc.p.
+"""
+
 import os
+import sys
 import cPickle as pickle
 
-# Read BNC word frequency distributions using cpickle
-# Note: bnc.p contains only non stopwords
-BNCfile = os.path.join(os.path.dirname(__file__), "bnc.p")
-fdistBNC = pickle.load( open( BNCfile, "rb" ) )
+import numpy as np
+
+DIRNAME = os.path.dirname(os.path.abspath(__file__))
+BNCfile = os.path.join(DIRNAME, "bnc.p")
+WORDS_FILE = os.path.join(DIRNAME, "bnc_words.bin")
+LENGTHS_FILE = os.path.join(DIRNAME, "bnc_lengths.npy")
+FREQS_FILE = os.path.join(DIRNAME, "bnc_freqs.npy")
 
 # Total number of words in Spoken BNC
 sumBNC = 11606059
+
+
+def encode(word):
+    return word.encode('utf-8') if isinstance(word, unicode) else word
+
+
+class FrequencyStore(object):
+    """Memory-mapped BNC frequency table."""
+
+    def __init__(self, words_file=WORDS_FILE, lengths_file=LENGTHS_FILE,
+                 freqs_file=FREQS_FILE):
+        self.freqs = np.load(freqs_file, mmap_mode='r')
+        self.lengths = np.load(lengths_file)
+        words = np.memmap(words_file, dtype=np.uint8, mode='r')
+
+        # One fixed-width, sorted array of words for each length
+        self.groups = {}
+        offset = first = 0
+        for length, count in enumerate(self.lengths):
+            if count:
+                size = length * count
+                self.groups[length] = (
+                    first, words[offset:offset + size].view('S%d' % length))
+                offset += size
+                first += count
+
+    def __len__(self):
+        return len(self.freqs)
+
+    def lookup(self, words):
+        """Array of frequencies of `words', with 0 for unknown words."""
+        encoded = [encode(word) for word in words]
+        lengths = np.array([len(word) for word in encoded], dtype=np.int64)
+        result = np.zeros(len(encoded), dtype=np.int64)
+
+        for length in np.unique(lengths):
+            if length not in self.groups: continue
+            first, table = self.groups[length]
+            selected = np.flatnonzero(lengths == length)
+            query = np.array([encoded[i] for i in selected],
+                             dtype='S%d' % length)
+            pos = np.minimum(np.searchsorted(table, query), len(table) - 1)
+            found = table[pos] == query
+            result[selected[found]] = self.freqs[first + pos[found]]
+        return result
+
+    def iterwords(self):
+        for length in sorted(self.groups):
+            for word in self.groups[length][1]:
+                yield word
+
+
+_store = None
+
+def store():
+    """Return the shared FrequencyStore, mapping it on first use."""
+    global _store
+    if _store is None:
+        _store = FrequencyStore()
+    return _store
+
+def frequencies(words):
+    """Array of BNC frequencies of `words', with 0 for unknown words."""
+    return store().lookup(words)
+
+
+class LazyFrequencyDict(object):
+    """Read-only, dict-like view of the BNC frequencies, for code that
+    expects the old unpickled dictionary."""
+
+    def get(self, word, default=None):
+        freq = frequencies([word])[0]
+        return int(freq) if freq else default
+
+    def __getitem__(self, word):
+        freq = self.get(word)
+        if freq is None: raise KeyError(word)
+        return freq
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __len__(self):
+        return len(store())
+
+    def __iter__(self):
+        return store().iterwords()
+
+    def keys(self):
+        return list(self)
+
+fdistBNC = LazyFrequencyDict()
+
+
+def convert(pickle_file=BNCfile, words_file=WORDS_FILE,
+            lengths_file=LENGTHS_FILE, freqs_file=FREQS_FILE):
+    """Write the frequency table files from a pickled dictionary."""
+    with open(pickle_file, 'rb') as infile:
+        fdist = pickle.load(infile)
+
+    words = sorted((encode(word) for word in fdist), key=lambda w: (len(w), w))
+    lengths = np.bincount([len(word) for word in words])
+    freqs = np.array([fdist[word] for word in words], dtype=np.int32)
+
+    with open(words_file, 'wb') as outfile:
+        for word in words: outfile.write(word)
+    np.save(lengths_file, lengths.astype(np.int32))
+    np.save(freqs_file, freqs)
+    return len(words)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        sys.stderr.write("Usage: python %s [bnc.p]\n" % (sys.argv[0],))
+    else:
+        count = convert(*sys.argv[1:])
+        print "Wrote %d words to %s" % (count, WORDS_FILE)
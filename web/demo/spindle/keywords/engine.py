@@ -0,0 +1,206 @@
+"""Vectorized keyword extraction.
+
+Produces the same keywords and bigram phrases as
+`keywords.keywords_and_ngrams`, which is kept as the reference
+implementation.  Instead of scoring each word in a Python loop, the
+text is reduced once to arrays of candidate terms and counts, and all
+log-likelihood scores, thresholds and top-k selections are computed as
+batched NumPy operations.
+
+Keywords with equal scores, and bigrams with equal counts, may come out
+in a different order from the reference implementation: here keyword
+ties are broken alphabetically.  A single unicode string is treated as
+one text, where the reference implementation only accepts `str'.
+"""
+
+import numpy as np
+
+from stopwords import stopwords
+from bnc import frequencies, sumBNC
+
+STOPWORDS = frozenset(stopwords)
+
+
+def is_candidate(word):
+    """True if `word' (lowercased) can be scored as a keyword."""
+    return word not in STOPWORDS and word.isalpha() and len(word) > 2
+
+
+def split_words(input):
+    """Split a string, or a sequence of strings, into lowercased words."""
+    if isinstance(input, basestring):
+        input = [input]
+    return [w.lower() for line in input for w in line.split()]
+
+
+def split_lines(lines):
+    """Split a sequence of strings into lowercased words.
+
+    Returns the list of words and an array giving the index of the
+    line each word came from.
+    """
+    words = []
+    line_ids = []
+    for index, line in enumerate(lines):
+        line_words = line.lower().split()
+        words.extend(line_words)
+        line_ids.extend([index] * len(line_words))
+    return words, np.array(line_ids, dtype=np.int64)
+
+
+class TermCounts(object):
+    """Candidate keyword and bigram counts for a text.
+
+    `terms': sorted array of candidate keywords in the text
+    `term_counts': number of occurrences of each of `terms'
+    `bigrams': (n, 2) array of indices into `terms', one row per
+    distinct pair of adjacent candidate words
+    `bigram_counts': number of occurrences of each bigram
+    `total': number of words in the text, including stopwords
+    """
+
+    def __init__(self, terms, term_counts, bigrams, bigram_counts, total):
+        self.terms = terms
+        self.term_counts = term_counts
+        self.bigrams = bigrams
+        self.bigram_counts = bigram_counts
+        self.total = total
+
+    @classmethod
+    def from_words(cls, words, line_ids=None):
+        """Count a list of words.
+
+        If `line_ids' is given, bigrams are only counted between words
+        from the same line.
+        """
+        if not words:
+            return cls.empty()
+
+        vocab, ids = np.unique(np.array(words), return_inverse=True)
+        counts = np.bincount(ids, minlength=len(vocab))
+        candidate = np.fromiter((is_candidate(w) for w in vocab),
+                                dtype=bool, count=len(vocab))
+
+        # Renumber candidates 0..n-1 and keep only pairs of adjacent
+        # words which are both candidates
+        index = np.cumsum(candidate) - 1
+        n = int(candidate.sum())
+        is_pair = candidate[ids[:-1]] & candidate[ids[1:]]
+        if line_ids is not None:
+            is_pair &= line_ids[:-1] == line_ids[1:]
+        codes = (index[ids[:-1][is_pair]].astype(np.int64) * n
+                 + index[ids[1:][is_pair]])
+        codes, pair_ids = np.unique(codes, return_inverse=True)
+
+        return cls(terms=vocab[candidate],
+                   term_counts=counts[candidate],
+                   bigrams=np.column_stack((codes // n, codes % n)) if n else
+                           np.empty((0, 2), dtype=np.int64),
+                   bigram_counts=np.bincount(pair_ids, minlength=len(codes)),
+                   total=len(words))
+
+    @classmethod
+    def from_text(cls, input):
+        """Count the words of a string or sequence of strings."""
+        return cls.from_words(split_words(input))
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Count a sequence of strings, without bigrams spanning lines."""
+        return cls.from_words(*split_lines(lines))
+
+    @classmethod
+    def from_dicts(cls, terms, bigrams, total):
+        """Inverse of `as_dicts'.
+
+        Bigrams whose words are not both in `terms' are ignored.
+        """
+        if not terms:
+            return cls.empty()
+
+        words = sorted(terms)
+        index = dict((word, i) for i, word in enumerate(words))
+        pairs = [(index[w0], index[w1], count)
+                 for (w0, w1), count in bigrams.iteritems()
+                 if w0 in index and w1 in index]
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 3)
+
+        return cls(terms=np.array(words),
+                   term_counts=np.array([terms[word] for word in words],
+                                        dtype=np.int64),
+                   bigrams=pairs[:, :2],
+                   bigram_counts=pairs[:, 2],
+                   total=total)
+
+    def as_dicts(self):
+        """Return dicts of term counts and of bigram counts, and the total."""
+        terms = self.terms.tolist()
+        return (dict(zip(terms, self.term_counts.tolist())),
+                dict(((terms[w0], terms[w1]), count) for (w0, w1), count
+                     in zip(self.bigrams.tolist(), self.bigram_counts.tolist())),
+                self.total)
+
+    @classmethod
+    def empty(cls):
+        return cls(terms=np.array([], dtype=unicode),
+                   term_counts=np.array([], dtype=np.int64),
+                   bigrams=np.empty((0, 2), dtype=np.int64),
+                   bigram_counts=np.array([], dtype=np.int64),
+                   total=0)
+
+
+def log_likelihood(counts):
+    """Array of log-likelihood scores for `counts.terms' against the BNC."""
+    a = frequencies(counts.terms).astype(np.float64)
+    b = counts.term_counts.astype(np.float64)
+    c = float(sumBNC)
+    d = float(counts.total)
+
+    E1 = c * ((a + b) / (c + d))
+    E2 = d * ((a + b) / (c + d))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logaE1 = np.where(a > 0, np.log(a / E1), 0.0)
+    return 2 * ((a * logaE1) + (b * np.log(b / E2)))
+
+
+def keywords_from_counts(counts, nKeywords=100, thresholdLL=19,
+                         nBigrams=25, thresholdBigrams=2):
+    """Keywords and bigrams from a TermCounts object.
+
+    Returns the same pair of lists as `keywords_and_ngrams'.
+    """
+    if not len(counts.terms):
+        return [], []
+
+    ll = log_likelihood(counts)
+
+    # Keywords above the threshold, best first. Partition first so
+    # that only the top nKeywords (plus any ties) need sorting.
+    selected = np.flatnonzero(ll > thresholdLL)
+    if len(selected) > nKeywords > 0:
+        k = len(selected) - nKeywords
+        kth = np.partition(ll[selected], k)[k]
+        selected = selected[ll[selected] >= kth]
+    order = np.lexsort((counts.terms[selected], -ll[selected]))
+    selected = selected[order][:nKeywords]
+    keywords = zip(counts.terms[selected].tolist(), ll[selected].tolist())
+
+    # Bigrams above the threshold, most frequent first, then in
+    # reverse alphabetical order
+    selected = np.flatnonzero(counts.bigram_counts > thresholdBigrams)
+    pairs = counts.bigrams[selected]
+    order = np.lexsort((-pairs[:, 1], -pairs[:, 0],
+                        -counts.bigram_counts[selected]))
+    selected = selected[order][:nBigrams]
+    words = counts.terms[counts.bigrams[selected]].tolist()
+    bigrams = zip(map(tuple, words), counts.bigram_counts[selected].tolist())
+
+    return keywords, bigrams
+
+
+def keywords_and_ngrams(input, nKeywords=100, thresholdLL=19,
+                        nBigrams=25, thresholdBigrams=2):
+    """Drop-in replacement for `keywords.keywords_and_ngrams'."""
+    return keywords_from_counts(TermCounts.from_text(input),
+                                nKeywords, thresholdLL,
+                                nBigrams, thresholdBigrams)
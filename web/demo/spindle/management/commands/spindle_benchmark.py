@@ -0,0 +1,440 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from collections import defaultdict
+import json
+import random
+import re
+import subprocess
+import sys
+import timeit
+
+from spindle.keywords import keywords as reference
+from spindle.keywords import engine
+from spindle.keywords import bnc
+from spindle.keywords.bnc import fdistBNC
+from spindle.keywords.stopwords import stopwords
+from spindle import versions
+
+
+def sample_transcript(n_words, seed=0):
+    """Return `n_words' of caption lines drawn from the BNC vocabulary.
+
+    Words are chosen with a Zipf-like distribution, mixed with
+    stopwords, so that the text has a realistic number of distinct
+    words and repeated phrases.
+    """
+    rand = random.Random(seed)
+    vocabulary = sorted(fdistBNC.keys())
+    rand.shuffle(vocabulary)
+    vocabulary = vocabulary[:5000]
+
+    lines = []
+    while n_words > 0:
+        length = min(n_words, rand.randint(6, 14))
+        words = []
+        for _ in range(length):
+            if rand.random() < 0.5:
+                words.append(rand.choice(stopwords))
+            else:
+                rank = int(rand.paretovariate(1.1)) - 1
+                words.append(vocabulary[rank % len(vocabulary)])
+        lines.append(u' '.join(words))
+        n_words -= length
+    return lines
+
+
+def sample_item_objects(lines):
+    """Return a version of an item with one track, with a clip for
+    each of `lines', as a list of serialized objects."""
+    objects = [{'model': 'spindle.clip', 'pk': pk,
+                'fields': {'track': 1, 'speaker': None,
+                           'intime': pk * 4.0, 'outtime': pk * 4.0 + 4,
+                           'caption_text': line, 'edited': False}}
+               for pk, line in enumerate(lines, 1)]
+    objects.append({'model': 'spindle.track', 'pk': 1,
+                    'fields': {'item': 1, 'name': 'Transcript',
+                               'kind': 'captions', 'lang': 'en',
+                               'updated': None}})
+    objects.append({'model': 'spindle.item', 'pk': 1,
+                    'fields': {'name': 'Benchmark', 'duration': 4 * len(lines),
+                               'updated': None}})
+    return objects
+
+
+class Command(BaseCommand):
+    help = """Time Spindle's performance-sensitive code paths.
+
+    With argument "keywords", compares the reference keyword
+    extraction in spindle.keywords.keywords with the vectorized engine
+    in spindle.keywords.engine on generated transcripts of 1k, 10k
+    and 100k words.
+
+    With argument "bnc", measures the startup time and peak RSS of a
+    fresh Python process which unpickles the legacy BNC frequency
+    dictionary, compared with one which maps the frequency table and
+    scores a few words.
+
+    With argument "writes", runs a full publish (as "spindle_publish
+    all") against the configured database and reports the number and
+    size of the INSERT, UPDATE and DELETE statements it made, by
+    table, and the number of archived item versions created.  Note
+    that this really publishes.
+
+    With argument "archive", simulates an editing session of 100
+    saves on items with generated transcripts, and compares the
+    storage size and worst-case reconstruction time of archived
+    versions stored in full as JSON with compressed keyframes and
+    deltas.
+
+    With argument "diff", compares the clip-level diff of two
+    versions of an item with the previous implementation, which
+    wrote both versions to temporary files and ran diff -u, on
+    generated transcripts where 1% of the clips were edited, deleted
+    or inserted.
+
+    With argument "columns", creates a temporary track with a clip
+    for every line of a generated transcript, and compares the size
+    and time to first byte of the REST clip collection in Django's
+    JSON serialization and in the streaming columnar format, plain
+    and gzipped.  The track is rolled back afterwards.
+
+    With argument "intervals", creates a temporary track in the same
+    way, and compares the time to look up the clips active at random
+    playback times with a SQL query and with spindle.intervals.
+
+    With argument "exports", writes the exports of every item in the
+    configured database to a temporary directory, once rendering each
+    format in its own pass over the clips and once rendering all
+    formats of a track in a single pass, with the render cache empty,
+    and reports the number of queries and the time taken.  The
+    published files are left untouched.
+    """
+    args = 'keywords | bnc | writes | archive | diff | columns | intervals | exports'
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat',
+            type='int',
+            dest='repeat',
+            default=3,
+            help='Number of timing runs; the best is reported.'),
+        make_option('--sizes',
+            dest='sizes',
+            default='1000,10000,100000',
+            help='Comma-separated transcript lengths in words.'),
+        )
+
+    def handle(self, what='keywords', *args, **options):
+        self.repeat = options['repeat']
+        self.sizes = [int(size) for size in options['sizes'].split(',')]
+
+        try:
+            benchmark = getattr(self, 'benchmark_' + what)
+        except AttributeError:
+            raise CommandError(u"Bad argument {}. Supply one of: {}".format(
+                    what, Command.args))
+        benchmark()
+
+    def best_time(self, proc):
+        return min(timeit.repeat(proc, number=1, repeat=self.repeat))
+
+    def benchmark_keywords(self):
+        self.stdout.write('{:>8} {:>12} {:>12} {:>8}\n'.format(
+                'words', 'reference', 'engine', 'speedup'))
+        for size in self.sizes:
+            text = sample_transcript(size)
+            ref_time = self.best_time(
+                lambda: reference.keywords_and_ngrams(text))
+            engine_time = self.best_time(
+                lambda: engine.keywords_and_ngrams(text))
+            self.stdout.write('{:>8} {:>11.4f}s {:>11.4f}s {:>7.1f}x\n'.format(
+                    size, ref_time, engine_time, ref_time / engine_time))
+
+    def benchmark_bnc(self):
+        # numpy is imported by the keyword engine in every process
+        # anyway, so it is loaded before timing.  Peak RSS is read
+        # from /proc, since ru_maxrss survives exec() on Linux.
+        measure = """
+import re, time
+import numpy
+start = time.time()
+%s
+elapsed = time.time() - start
+status = open('/proc/self/status').read()
+print elapsed, re.search(r'VmHWM:\\s*(\\d+)', status).group(1)
+"""
+        cases = (
+            ('numpy only', 'pass'),
+            ('unpickle bnc.p',
+             'import cPickle; cPickle.load(open(%r, "rb"))' % bnc.BNCfile),
+            ('mapped table',
+             'from spindle.keywords import bnc; '
+             'bnc.frequencies([u"woods", u"quantum", u"fawn"])'),
+            )
+
+        self.stdout.write('{:<20} {:>10} {:>12}\n'.format(
+                'case', 'load time', 'peak RSS'))
+        for name, code in cases:
+            times, rss = [], []
+            for _ in range(self.repeat):
+                output = subprocess.check_output(
+                    [sys.executable, '-c', measure % code])
+                elapsed, hwm = output.split()
+                times.append(float(elapsed))
+                rss.append(int(hwm))
+            self.stdout.write('{:<20} {:>9.4f}s {:>9d} kB\n'.format(
+                    name, min(times), min(rss)))
+
+    def benchmark_writes(self):
+        from django.db import connection
+        from spindle.models import ArchivedItem
+        from spindle.publish import publish_all_items, publish_exports_feed, \
+            publish_fulltext_feed
+
+        versions = ArchivedItem.objects.count()
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+        try:
+            publish_all_items()
+            publish_exports_feed()
+            publish_fulltext_feed()
+            queries = connection.queries[start:]
+        finally:
+            connection.use_debug_cursor = None
+
+        writes = defaultdict(lambda: [0, 0])
+        for query in queries:
+            match = re.match(r'(?:INSERT INTO|UPDATE|DELETE FROM) "?(\w+)"?',
+                             query['sql'])
+            if match:
+                writes[match.group(1)][0] += 1
+                writes[match.group(1)][1] += len(query['sql'])
+
+        self.stdout.write('{:<30} {:>10} {:>14}\n'.format(
+                'table', 'statements', 'bytes of SQL'))
+        for table, (count, size) in sorted(writes.iteritems()):
+            self.stdout.write('{:<30} {:>10d} {:>14d}\n'.format(
+                    table, count, size))
+        self.stdout.write('{} queries in total, {} new archived versions\n'.format(
+                len(queries), ArchivedItem.objects.count() - versions))
+
+    def benchmark_archive(self):
+        from spindle.models import ARCHIVE_KEYFRAME_INTERVAL as interval
+
+        self.stdout.write('{:>8} {:>12} {:>12} {:>12} {:>12}\n'.format(
+                'words', 'json size', 'delta size', 'json load', 'delta load'))
+        for size in self.sizes:
+            rand = random.Random(size)
+            objects = sample_item_objects(sample_transcript(size, seed=size))
+            clips = [obj for obj in objects if obj['model'] == 'spindle.clip']
+
+            # Each save edits a few clips and touches the track
+            history = []
+            for n in range(100):
+                for clip in rand.sample(clips, min(3, len(clips))):
+                    clip['fields'] = dict(clip['fields'], edited=True,
+                                          caption_text=clip['fields']['caption_text'] + u' again')
+                for obj in objects[-2:]:
+                    obj['fields'] = dict(obj['fields'], updated=str(n))
+                history.append(json.loads(json.dumps(objects)))
+
+            full = [json.dumps(version) for version in history]
+            stored = []
+            for n, version in enumerate(history):
+                if n % interval == 0:
+                    stored.append(versions.pack(version))
+                else:
+                    stored.append(versions.pack(
+                            versions.make_delta(history[n - 1], version)))
+
+            def load_delta():
+                objects = versions.unpack(stored[0])
+                for delta in stored[1:interval]:
+                    objects = versions.apply_delta(objects,
+                                                   versions.unpack(delta))
+                return objects
+
+            self.stdout.write('{:>8} {:>11d}B {:>11d}B {:>11.4f}s {:>11.4f}s\n'.format(
+                    size, sum(map(len, full)), sum(map(len, stored)),
+                    self.best_time(lambda: json.loads(full[interval - 1])),
+                    self.best_time(load_delta)))
+
+    def benchmark_diff(self):
+        import copy
+        import tempfile
+        from spindle.models import ArchivedItem
+
+        def subprocess_diff(old, new):
+            with tempfile.NamedTemporaryFile() as old_file, \
+                 tempfile.NamedTemporaryFile() as new_file:
+                old.write_diffable_text(old_file)
+                new.write_diffable_text(new_file)
+                process = subprocess.Popen(
+                    ['diff', '-u', old_file.name, new_file.name],
+                    stdout=subprocess.PIPE)
+                return list(process.communicate()[0].splitlines(True))
+
+        self.stdout.write('{:>8} {:>8} {:>12} {:>12} {:>8}\n'.format(
+                'words', 'clips', 'diff -u', 'in-process', 'speedup'))
+        for size in self.sizes:
+            rand = random.Random(size)
+            old = sample_item_objects(sample_transcript(size, seed=size))
+            new = copy.deepcopy(old)
+            clips = [obj for obj in new if obj['model'] == 'spindle.clip']
+            for clip in rand.sample(clips, len(clips) // 100):
+                clip['fields']['caption_text'] += u' edited'
+            for clip in rand.sample(clips, len(clips) // 100):
+                new.remove(clip)
+            new.extend(dict(clip, pk=clip['pk'] + len(clips),
+                            fields=dict(clip['fields'], intime=clip['fields']['intime'] + 1))
+                       for clip in rand.sample(clips, len(clips) // 100))
+
+            pair = [ArchivedItem(storage='keyframe', json=versions.pack(objects))
+                         for objects in (old, new)]
+            subprocess_time = self.best_time(lambda: subprocess_diff(*pair))
+            diff_time = self.best_time(
+                lambda: list(versions.diff(pair[0].contents(),
+                                           pair[1].contents())))
+            self.stdout.write('{:>8} {:>8} {:>11.4f}s {:>11.4f}s {:>7.1f}x\n'.format(
+                    size, len(clips), subprocess_time, diff_time,
+                    subprocess_time / diff_time))
+
+    def make_track(self, size):
+        """Create a track with a clip for each line of a generated
+        transcript of `size' words, without archiving.  Returns the
+        track and the number of clips."""
+        from django.db import models
+        from django.utils import timezone
+        from spindle.models import Item, Track, Clip, bulk_insert
+
+        # Plain model saves, to avoid archiving
+        item = Item(name='Benchmark', duration=size, published=timezone.now())
+        models.Model.save(item)
+        track = Track(item=item)
+        models.Model.save(track)
+        lines = sample_transcript(size, seed=size)
+        bulk_insert(Clip, [Clip(track=track, intime=n * 4.0,
+                                outtime=n * 4.0 + 4, caption_text=line)
+                           for n, line in enumerate(lines)])
+        return track, len(lines)
+
+    def benchmark_columns(self):
+        from django.db import transaction
+        from django.contrib.auth.models import User
+        from django.test.client import RequestFactory
+        from spindle.rest_api import TrackClipsResource
+
+        view = TrackClipsResource.as_view()
+        factory = RequestFactory()
+
+        def fetch(track, **extra):
+            request = factory.get('/', **extra)
+            request.user = User()
+            start = timeit.default_timer()
+            chunks = iter(view(request, pk=track.id))
+            first = next(chunks, '')
+            first_byte = timeit.default_timer() - start
+            size = len(first) + sum(len(chunk) for chunk in chunks)
+            return size, first_byte, timeit.default_timer() - start
+
+        self.stdout.write('{:>8} {:<16} {:>12} {:>12} {:>12}\n'.format(
+                'clips', 'format', 'size', 'first byte', 'total'))
+        with transaction.commit_manually():
+            try:
+                for size in self.sizes:
+                    track, clips = self.make_track(size)
+
+                    for name, extra in (
+                        ('django json', {}),
+                        ('columns', {'data': {'format': 'columns'}}),
+                        ('columns, gzip', {'data': {'format': 'columns'},
+                                           'HTTP_ACCEPT_ENCODING': 'gzip'})):
+                        results = [fetch(track, **extra)
+                                   for _ in range(self.repeat)]
+                        self.stdout.write(
+                            '{:>8} {:<16} {:>11d}B {:>11.4f}s {:>11.4f}s\n'.format(
+                                clips, name, results[0][0],
+                                min(result[1] for result in results),
+                                min(result[2] for result in results)))
+            finally:
+                transaction.rollback()
+
+    def benchmark_intervals(self):
+        from django.core import serializers
+        from django.db import transaction
+        from spindle import intervals
+        from spindle.models import Clip
+
+        lookups = 1000
+
+        def sql_lookup(track, time):
+            return serializers.serialize('json', Clip.objects.filter(
+                    track=track, intime__lte=time, outtime__gt=time))
+
+        def cached_lookup(track, time):
+            found = intervals.for_track(track.id)
+            return found.serialize(found.at(time))
+
+        self.stdout.write('{:>8} {:>14} {:>14} {:>8}\n'.format(
+                'clips', 'sql lookup', 'cached lookup', 'speedup'))
+        with transaction.commit_manually():
+            try:
+                for size in self.sizes:
+                    track, clips = self.make_track(size)
+                    rand = random.Random(size)
+                    times = [rand.uniform(0, clips * 4.0) for _ in range(lookups)]
+                    cached_lookup(track, 0.0)
+
+                    sql_time, cached_time = [
+                        self.best_time(lambda: [lookup(track, time)
+                                                for time in times]) / lookups
+                        for lookup in (sql_lookup, cached_lookup)]
+                    self.stdout.write('{:>8} {:>12.3f}ms {:>12.3f}ms {:>7.1f}x\n'.format(
+                            clips, sql_time * 1000, cached_time * 1000,
+                            sql_time / cached_time))
+            finally:
+                transaction.rollback()
+
+    def benchmark_exports(self):
+        import shutil
+        import tempfile
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import override_settings
+        from spindle import publish
+        from spindle.models import Item
+
+        def each_format(item):
+            for export in publish.item_exports(item):
+                export.write()
+
+        def count_queries(proc):
+            connection.use_debug_cursor = True
+            start = len(connection.queries)
+            try:
+                proc()
+                return len(connection.queries) - start
+            finally:
+                connection.use_debug_cursor = None
+
+        def publish_all(publish_item):
+            for item in Item.objects.filter(track_count__gt=0):
+                publish_item(item)
+
+        def run(publish_item):
+            def proc():
+                cache.clear()
+                shutil.rmtree(directory, ignore_errors=True)
+                publish_all(publish_item)
+            return count_queries(proc), self.best_time(proc)
+
+        directory = tempfile.mkdtemp()
+        try:
+            with override_settings(SPINDLE_PUBLIC_DIRECTORY=directory):
+                self.stdout.write('{:<20} {:>10} {:>12}\n'.format(
+                        'exporter', 'queries', 'time'))
+                for name, publish_item in (('format by format', each_format),
+                                           ('single pass', publish.publish_item)):
+                    queries, elapsed = run(publish_item)
+                    self.stdout.write('{:<20} {:>10d} {:>11.4f}s\n'.format(
+                            name, queries, elapsed))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -68,6 +68,7 @@ class Command(BaseCommand):
                         clips.append(clip)
 
                 Clip.objects.bulk_create(clips)
+                track.update_clip_counts()
                 item.archive()
                 self.stderr.write('\n\n')
 
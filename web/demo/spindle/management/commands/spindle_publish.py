@@ -2,7 +2,7 @@ from django.core.management.base import BaseCommand, CommandError
 from optparse import make_option
 import logging
 
-from spindle.publish import publish_item, publish_exports_feed, publish_fulltext_feed, publish_all_items
+from spindle.publish import publish_item, publish_exports_feed, publish_fulltext_feed, publish_all_items, publish_queued_tracks, plan_exports, sweep_exports, rebuild_manifest
 from spindle.models import Item
 
 
@@ -11,9 +11,13 @@ class Command(BaseCommand):
     
     With argument "exports", writes out exported file formats
     (plaintext/HTML/VTT) for all tracks that are marked for export and
-    whose associated files are missing or out of date.  See the
-    settings SPINDLE_PUBLIC_URL and SPINDLE_PUBLIC_DIRECTORY for the
-    location of these files.
+    have changed since they were last published.  With --full,
+    instead checks the files of every track, and writes out those
+    which are missing or out of date.  With --parallel, the tracks
+    are written out in chunks by a pool of processes (see
+    SPINDLE_PUBLISH_PROCESSES and SPINDLE_PUBLISH_CHUNK_SIZE).  See the settings
+    SPINDLE_PUBLIC_URL and SPINDLE_PUBLIC_DIRECTORY for the location
+    of these files.
 
     With argument "rss", publishes an RSS feed of all existing export
     files. See setting SPINDLE_EXPORTS_RSS_FILENAME to customize the
@@ -26,21 +30,43 @@ class Command(BaseCommand):
     With argument "all", does all of the above in order. This is also the
     default if no argument is supplied.
 
+    With argument "sweep", removes exported files which were
+    superseded more than SPINDLE_EXPORT_RETENTION seconds ago.  A
+    full publish does this too.
+
+    With argument "manifest", records the exported files found in the
+    public directory in the manifest from which the RSS feeds are
+    built.  Run this after changing the public directory by hand.
+    (An empty manifest, as after upgrading, is filled in this way
+    automatically.)
+
     Otherwise, the argument should be the numeric ID of an item whose
     transcript tracks will be exported.
     """
-    args = 'rss | exports | fulltext | all | <item id>'
+    args = 'rss | exports | fulltext | sweep | manifest | all | <item id>'
     option_list = BaseCommand.option_list + (
         make_option('--debug',
             action='store_true',
             dest='debug',
             default=False,
             help='Only process ten items, for debugging purposes.'),
+        make_option('--full',
+            action='store_true',
+            dest='full',
+            default=False,
+            help='Check the exports of all tracks, not only changed ones.'),
+        make_option('--parallel',
+            action='store_true',
+            dest='parallel',
+            default=False,
+            help='Write out exports in several processes at once.'),
         )
 
     def handle(self, what='all', *args, **options):
         verbosity = int(options['verbosity'])
         debug = options['debug']
+        parallel = options['parallel']
+        publish_exports = publish_all_items if options['full'] else publish_queued_tracks
 
         self.setup_logging(verbosity)
 
@@ -50,13 +76,24 @@ class Command(BaseCommand):
         if what == 'rss':
             publish_exports_feed(debug=debug)
         elif what == 'exports':
-            publish_all_items(debug=debug)
+            publish_exports(debug=debug, parallel=parallel)
         elif what == 'fulltext':
             publish_fulltext_feed(debug=debug)
+        elif what == 'sweep':
+            removed = sweep_exports()
+            self.stderr.write(u'Removed {} superseded files\n'.format(removed))
+        elif what == 'manifest':
+            recorded = rebuild_manifest(debug=debug)
+            self.stderr.write(u'Recorded {} published files\n'.format(recorded))
         elif what == 'all':
-            publish_all_items(debug=debug)
-            publish_exports_feed(debug=debug)
-            publish_fulltext_feed(debug=debug)
+            # The exports and both feeds work from the same plan
+            plan = plan_exports(debug=debug)
+            if options['full']:
+                publish_all_items(debug=debug, plan=plan, parallel=parallel)
+            else:
+                publish_queued_tracks(debug=debug, parallel=parallel)
+            publish_exports_feed(debug=debug, plan=plan)
+            publish_fulltext_feed(debug=debug, plan=plan)
         elif what.isdigit():
             item_id = int(what)
             item = Item.objects.get(pk=item_id)
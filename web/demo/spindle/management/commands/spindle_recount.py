@@ -0,0 +1,43 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from django.db.models import Count
+
+from spindle.models import Item, Track, Clip, update_columns
+
+
+class Command(NoArgsCommand):
+    help = """Rebuild the stored clip and track counters.
+
+    Recomputes Track.clip_count, Track.edited_clip_count and
+    Item.track_count from the database, and corrects any that are
+    wrong.
+    """
+
+    def handle_noargs(self, *args, **options):
+        def counts(query, key):
+            return dict((row[key], row['n'])
+                        for row in query.order_by().values(key)
+                        .annotate(n=Count('id')))
+
+        with transaction.commit_on_success():
+            clip_counts = counts(Clip.objects.all(), 'track')
+            edited_counts = counts(Clip.objects.filter(edited=True), 'track')
+            fixed = 0
+            for track in Track.objects.only('clip_count', 'edited_clip_count'):
+                clip_count = clip_counts.get(track.id, 0)
+                edited_clip_count = edited_counts.get(track.id, 0)
+                if (track.clip_count, track.edited_clip_count) \
+                        != (clip_count, edited_clip_count):
+                    update_columns(track, clip_count=clip_count,
+                                   edited_clip_count=edited_clip_count)
+                    fixed += 1
+            self.stderr.write('Corrected clip counts for {} tracks\n'.format(fixed))
+
+            track_counts = counts(Track.objects.all(), 'item')
+            fixed = 0
+            for item in Item.objects.only('track_count'):
+                track_count = track_counts.get(item.id, 0)
+                if item.track_count != track_count:
+                    update_columns(item, track_count=track_count)
+                    fixed += 1
+            self.stderr.write('Corrected track counts for {} items\n'.format(fixed))
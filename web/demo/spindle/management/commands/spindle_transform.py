@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from spindle import transforms
+from spindle.models import Track
+
+
+class Command(BaseCommand):
+    help = """Transform the clips of a track.
+
+    shift <offset> [<after>]: move all clips starting at or after time
+    <after> (default 0) by <offset> seconds.
+
+    rescale <factor> [<origin>]: multiply clip times by <factor>,
+    keeping time <origin> (default 0) fixed.
+
+    merge <min duration>: merge clips shorter than <min duration>
+    seconds into the clip before them, if it has the same speaker.
+
+    split <max time>: split clips longer than <max time> seconds.
+
+    Each transform is done in one transaction and archived as one new
+    version of the item.
+    """
+    args = '<track id> shift | rescale | merge | split <arguments>'
+
+    def handle(self, track_id=None, operation=None, *args, **options):
+        if track_id is None or operation is None:
+            raise CommandError(u"Usage: {}".format(Command.args))
+        try:
+            track = Track.objects.get(pk=int(track_id))
+        except (ValueError, Track.DoesNotExist):
+            raise CommandError(u"No track with ID {}".format(track_id))
+        if operation not in transforms.OPERATIONS:
+            raise CommandError(u"Bad operation {}. Supply one of: {}".format(
+                    operation, ', '.join(sorted(transforms.OPERATIONS))))
+
+        try:
+            changed = transforms.run(track, operation, *args)
+        except (ValueError, TypeError) as e:
+            raise CommandError(u"Bad arguments for {}: {}".format(operation, e))
+        self.stderr.write(u'Changed {} clips of track {}, "{}"\n'.format(
+                changed, track.id, track.name))
@@ -7,14 +7,15 @@ ArchivedItem -- for versioning items (currently broken)"""
 
 
 import operator
+import json
+import hashlib
 import StringIO
-import tempfile
-import subprocess
-import sys
+from collections import defaultdict
 
-from django.db import models
-from django.db.models import Count
+from django.db import models, transaction
+from django.db.models import F
 from django.core import serializers
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from django.template.loader import render_to_string
 from django.utils import timezone
@@ -23,10 +24,14 @@ from django.conf import settings
 import djcelery
 from celery.result import BaseAsyncResult
 
-import xml.etree.ElementTree as ET
-
 import spindle.transcribe
-from spindle.keywords.keywords import keywords_and_ngrams
+import spindle.writers
+import spindle.writers.plaintext
+import spindle.writers.html
+import spindle.writers.xml
+import spindle.writers.vtt
+from spindle import versions
+from spindle.keywords.engine import TermCounts, keywords_from_counts
 
 # How significant keywords have to be
 try:
@@ -34,6 +39,62 @@ try:
 except:
     LL_THRESHOLD = 40
 
+# Seconds to wait after a track is edited before refreshing its
+# keywords.  Further edits within this time are covered by the same
+# refresh.
+try:
+    KEYWORD_REFRESH_DELAY = settings.SPINDLE_KEYWORD_REFRESH_DELAY
+except:
+    KEYWORD_REFRESH_DELAY = 10
+
+# How archived versions of items are stored: 'delta' for compressed
+# keyframes and deltas, 'json' for the full JSON serialization of
+# every version
+try:
+    ARCHIVE_STORAGE = settings.SPINDLE_ARCHIVE_STORAGE
+except:
+    ARCHIVE_STORAGE = 'delta'
+
+# Maximum number of versions (a keyframe and its deltas) to replay
+# to reconstruct a version
+try:
+    ARCHIVE_KEYFRAME_INTERVAL = settings.SPINDLE_ARCHIVE_KEYFRAME_INTERVAL
+except:
+    ARCHIVE_KEYFRAME_INTERVAL = 20
+
+# Seconds to keep the diff between two versions of an item in the
+# cache
+DIFF_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Seconds to wait after an item is saved before archiving it in the
+# background.  Saves within this time are covered by the same
+# version.  If 0, every save archives a version immediately.
+try:
+    ARCHIVE_DELAY = settings.SPINDLE_ARCHIVE_DELAY
+except:
+    ARCHIVE_DELAY = 30
+
+
+def update_columns(obj, **values):
+    """Write `values' to the database row for model instance `obj'.
+
+    This is the write path for derived and cached fields (keyword
+    caches, counters, timestamps).  Unlike obj.save(), it only touches
+    the given columns, and never archives a new version of an item.
+    Values may be F() expressions, in which case the new values are
+    read back into `obj'.
+    """
+    model = type(obj)
+    model._base_manager.filter(pk=obj.pk).update(**values)
+
+    expressions = [name for name, value in values.iteritems()
+                   if isinstance(value, F)]
+    for name, value in values.iteritems():
+        if name not in expressions: setattr(obj, name, value)
+    if expressions:
+        row = model._base_manager.filter(pk=obj.pk).values(*expressions)[0]
+        for name, value in row.iteritems(): setattr(obj, name, value)
+
 
 #
 # An item represents a single podcast for transcription. It has a
@@ -43,10 +104,6 @@ except:
 
 # The Item manager class
 class ItemManager(models.Manager):
-    def get_query_set(self):
-        return super(ItemManager, self).get_query_set() \
-            .annotate(track_count=Count('track'))
- 
     class ItemHash():
         audio = {}
         video = {}
@@ -90,6 +147,10 @@ class Item(models.Model):
     audio_guid          = models.CharField(max_length=500, blank=True)
     licence_long_string = models.CharField(max_length=200, blank=True)
 
+    # Number of tracks, maintained by Track.save() and revert
+    track_count         = models.IntegerField(default=0, editable=False,
+                                              db_index=True)
+
     # Version tracking
     updated             = models.DateTimeField('Last updated',
                                                auto_now=True,
@@ -101,9 +162,14 @@ class Item(models.Model):
                                                auto_now_add=True,
                                                editable=False)
 
+    derived_fields = ('track_count',)
+
     def __unicode__(self):
         return self.name
 
+    def update_track_count(self):
+        update_columns(self, track_count=self.track_set.count())
+
     # Return the fraction of this item's transcript that has been
     # edited, or None if there are no existing clips at all.
     def edited_fraction(self):
@@ -125,11 +191,34 @@ class Item(models.Model):
 
     # Versioning stuff
     def archive(self, msg=None, commit=True):
-        archive = ArchivedItem(item=self)
-        archive.save()
+        if not ARCHIVE_DELAY:
+            return self.archive_now()
+
+        from spindle.tasks import archive_item
+        if cache.add(Item.archive_key(self.pk), True, ARCHIVE_DELAY + 60):
+            archive_item.apply_async((self.pk,), countdown=ARCHIVE_DELAY)
+
+    @staticmethod
+    def archive_key(item_id):
+        """Cache key set while archiving an item is queued."""
+        return 'spindle_archive_item_{}'.format(item_id)
+
+    def archive_now(self):
+        """Archive the current state of this item, unless it is the
+        same as the latest archived version."""
+        serialized = self.serialize('json')
+        version = ArchivedItem(item=self, content_hash=content_hash(serialized))
+        latest = self.versions.order_by('-id')[:1]
+        if latest and latest[0].content_hash == version.content_hash:
+            return None
+
+        version.encode(serialized)
+        version.save()
+        return version
 
     def serialize(self, method):
-        return serializers.serialize(method, self.serializable_objects())
+        return serializers.serialize(method, self.serializable_objects(),
+                                     fields=archived_field_names())
 
     def serializable_objects(self):
         for track in self.track_set.select_related('speaker', 'clip'):
@@ -141,10 +230,38 @@ class Item(models.Model):
     def save(self, *args, **kwargs):
         super(Item, self).save(*args, **kwargs)
         self.archive()
+        self.queue_publish()
+
+    # Queue the tracks of this item to have their exports published
+    def queue_publish(self):
+        DirtyTrack.add(self.track_set.values_list('id', flat=True))
+
+def archived_field_names():
+    """Names of the fields stored in archived versions of items: all
+    the fields of the archived models except their `derived_fields'."""
+    names = set()
+    for model in (Item, Track, Speaker, Clip):
+        names.update(field.name for field in model._meta.fields
+                     if field.name not in getattr(model, 'derived_fields', ()))
+    return names
+
+def content_hash(serialized):
+    """Hash of a serialized item which ignores the `updated' times
+    of the item and tracks, so that saves which change nothing else
+    hash the same."""
+    objects = json.loads(serialized)
+    for obj in objects:
+        obj['fields'].pop('updated', None)
+    return hashlib.sha1(json.dumps(sorted(objects, key=versions.sort_key),
+                                   sort_keys=True)).hexdigest()
 
 #
 # Archived versions of items
 #
+ARCHIVE_STORAGE_CHOICES = (('json', 'Full JSON'),
+                           ('keyframe', 'Compressed keyframe'),
+                           ('delta', 'Compressed delta'))
+
 class ArchivedItem(models.Model):
     item = models.ForeignKey(Item, related_name='versions')
     updated             = models.DateTimeField('Last updated',
@@ -153,7 +270,19 @@ class ArchivedItem(models.Model):
                                                editable=False)
     updated_by          = models.ForeignKey(User, null=True, blank=True,
                                             editable=False)
+    # The JSON serialization of the item for 'json' storage, or the
+    # compressed keyframe or delta (see spindle.versions)
     json = models.TextField('')
+    storage = models.CharField(max_length=8, choices=ARCHIVE_STORAGE_CHOICES,
+                               default='json', editable=False)
+    # For deltas, the first and the immediately preceding version of
+    # the chain to replay
+    keyframe = models.ForeignKey('self', null=True, blank=True,
+                                 related_name='+', editable=False)
+    previous = models.ForeignKey('self', null=True, blank=True,
+                                 related_name='+', editable=False)
+    # See content_hash()
+    content_hash = models.CharField(max_length=40, blank=True, editable=False)
 
     class Meta:
         ordering = ['-updated']
@@ -162,11 +291,68 @@ class ArchivedItem(models.Model):
         return u'Archive of {}'.format(self.item)
 
     def save(self, *args, **kwargs):
-        self.json = self.item.serialize('json')
+        if self.pk is None and not self.json:
+            self.encode(self.item.serialize('json'))
         super(ArchivedItem, self).save(*args, **kwargs)
 
+    def encode(self, serialized):
+        """Store the serialized item, as a delta from the latest
+        version if possible."""
+        if not self.content_hash:
+            self.content_hash = content_hash(serialized)
+        if ARCHIVE_STORAGE != 'delta':
+            self.storage = 'json'
+            self.json = serialized
+            return
+
+        objects = json.loads(serialized)
+        latest = self.item.versions.order_by('-id')[:1]
+        if latest and latest[0].storage != 'json':
+            chain = latest[0].chain()
+            if len(chain) < ARCHIVE_KEYFRAME_INTERVAL:
+                self.storage = 'delta'
+                self.keyframe = chain[0]
+                self.previous = latest[0]
+                self.json = versions.pack(versions.make_delta(
+                        ArchivedItem.replay(chain), objects))
+                return
+
+        self.storage = 'keyframe'
+        self.json = versions.pack(objects)
+
+    def chain(self):
+        """The versions to replay to reconstruct this one, starting
+        with its keyframe."""
+        if self.storage != 'delta': return [self]
+
+        candidates = dict(
+            (version.id, version) for version in ArchivedItem.objects.filter(
+                models.Q(pk=self.keyframe_id) | models.Q(keyframe=self.keyframe_id),
+                id__lt=self.id))
+        chain = [self]
+        while chain[-1].previous_id is not None:
+            chain.append(candidates[chain[-1].previous_id])
+        chain.reverse()
+        return chain
+
+    @staticmethod
+    def replay(chain):
+        keyframe = chain[0]
+        if keyframe.storage == 'json':
+            objects = json.loads(keyframe.json)
+        else:
+            objects = versions.unpack(keyframe.json)
+        for version in chain[1:]:
+            objects = versions.apply_delta(objects,
+                                           versions.unpack(version.json))
+        return sorted(objects, key=versions.sort_key)
+
+    def contents(self):
+        """The serialized objects of this version, as a list of dicts."""
+        return ArchivedItem.replay(self.chain())
+
     def deserialized(self):
-        return serializers.deserialize('json', self.json)
+        return serializers.deserialize('python', self.contents())
 
     def write_diffable_text(self, outfile):
         # Ensure we can iterate several times over serialized if it's
@@ -180,8 +366,12 @@ class ArchivedItem(models.Model):
         item = extract(Item)[0]
         tracks = sorted(extract(Track),
                         key=operator.attrgetter('id'))
-        all_speakers = extract(Speaker)
-        all_clips = extract(Clip)
+        speakers_by_track = defaultdict(list)
+        for speaker in extract(Speaker):
+            speakers_by_track[speaker.track_id].append(speaker)
+        clips_by_track = defaultdict(list)
+        for clip in extract(Clip):
+            clips_by_track[clip.track_id].append(clip)
 
         def write_fields(obj, include=None, exclude=None):
             fields = include if include else [f.name for f in obj._meta.fields]
@@ -194,10 +384,8 @@ class ArchivedItem(models.Model):
         write_fields(item)
 
         for track in tracks:
-            speakers = filter(lambda s: s.track_id == track.id,
-                              all_speakers)
-            clips = sorted(filter(lambda c: c.track_id == track.id,
-                                  all_clips),
+            speakers = speakers_by_track[track.id]
+            clips = sorted(clips_by_track[track.id],
                            key=operator.attrgetter('intime'))
 
             outfile.write(u'\n\n\nTrack: {}\n'.format(track.name))
@@ -212,7 +400,7 @@ class ArchivedItem(models.Model):
             for clip in clips:
                 outfile.write(u'{:8.2f} {:8.2f} {:6}  {}\n'.format(
                         clip.intime, clip.outtime,
-                        speaker.id if clip.speaker else '',
+                        clip.speaker_id or '',
                         clip.caption_text))
         outfile.flush()
 
@@ -223,48 +411,103 @@ class ArchivedItem(models.Model):
         return outfile.getvalue()
 
 
+    def previous_version(self):
+        """The version archived before this one, or None."""
+        previous_versions = self.item.versions.filter(
+            updated__lt = self.updated).order_by(
+            '-updated')
+        return previous_versions[0] if previous_versions else None
+
     def diff(self, old_version=None):
         """Diff this revision of an item with another revision.
-        If `old_version' is None, diffs with the previous revision."""
+        If `old_version' is None, diffs with the previous revision.
 
+        Returns an iterator over lines of text (see spindle.versions.diff).
+        Versions never change, so the lines are cached for each pair
+        of versions.
+        """
         if old_version is None:
-            # Find previous version and diff with it
-            previous_versions = self.item.versions.filter(
-                updated__lt = self.updated).order_by(
-                '-updated')
+            old_version = self.previous_version()
+
+        key = 'spindle_diff_{}_{}'.format(
+            old_version.id if old_version else 0, self.id)
+        lines = cache.get(key)
+        if lines is not None:
+            return iter(lines)
+        return self._diff_and_cache(old_version, key)
+
+    def _diff_and_cache(self, old_version, key):
+        lines = []
+        old = old_version.contents() if old_version else []
+        for line in versions.diff(old, self.contents()):
+            lines.append(line)
+            yield line
+        cache.set(key, lines, DIFF_CACHE_TIMEOUT)
 
-            if previous_versions:
-                old_version = previous_versions[0]
-
-        with tempfile.NamedTemporaryFile() as tmpfile_1, \
-             tempfile.NamedTemporaryFile() if old_version is not None else open("/dev/null") as tmpfile_2, \
-             tempfile.TemporaryFile() as diff_file, \
-             tempfile.TemporaryFile() as error_file:
-        
-            self.write_diffable_text(tmpfile_1)
+    def revert(self):
+        """Restore the item to this version.
 
-            if old_version is not None:
-                old_version.write_diffable_text(tmpfile_2)
+        The tracks, speakers and clips of the version replace the
+        current ones in a single transaction, with one bulk INSERT
+        per model, keeping their original primary keys.  The result
+        is archived as one new version.
+        """
+        objects = [obj.object for obj in self.deserialized()]
+        def extract(model):
+            return [obj for obj in objects if isinstance(obj, model)]
+        tracks, speakers, clips = extract(Track), extract(Speaker), extract(Clip)
+
+        clip_counts, edited_clip_counts = defaultdict(int), defaultdict(int)
+        for clip in clips:
+            clip_counts[clip.track_id] += 1
+            if clip.edited: edited_clip_counts[clip.track_id] += 1
+
+        with transaction.commit_on_success():
+            content_versions = dict(
+                self.item.track_set.values_list('id', 'content_version'))
+            self.item.track_set.all().delete()
+
+            for item in extract(Item):
+                models.Model.save_base(item, raw=True)
+
+            # Derived fields are not archived, so fill them in here
+            for track in tracks:
+                track.clip_count = clip_counts[track.id]
+                track.edited_clip_count = edited_clip_counts[track.id]
+                track.content_version = content_versions.get(track.id, 0) + 1
+            for model, objs in ((Track, tracks), (Speaker, speakers),
+                                (Clip, clips)):
+                bulk_insert(model, objs)
+
+            update_columns(self.item, track_count=len(tracks))
+            DirtyTrack.add(track.id for track in tracks)
 
-            errcode = subprocess.call(
-                ['diff', '-u', tmpfile_2.name, tmpfile_1.name],
-                stdout=diff_file,
-                stderr=error_file)
+        for track in tracks:
+            track.queue_keyword_refresh()
+        # self.item still has the fields from before the revert
+        Item.objects.get(pk=self.item_id).archive()
 
-            diff_file.seek(0, 0)
-            error_file.seek(0, 0)
+        return None
 
-            for line in error_file: sys.stderr.write(line)
-            return list(diff_file)
 
-    def revert(self):
-        self.item.track_set.all().delete()
+# Writers for the export formats other than HTML, which needs the
+# item (see Track.export_writer)
+EXPORT_WRITERS = {
+    'txt': spindle.writers.plaintext.PlaintextWriter,
+    'xml': spindle.writers.xml.XMLWriter,
+    'vtt': spindle.writers.vtt.VTTWriter,
+    }
 
-        objects = self.deserialized()
-        for obj in objects:
-            obj.save()
+def write_pieces(outfile, pieces):
+    """Write an iterable of unicode strings to `outfile' as UTF-8."""
+    for piece in pieces:
+        outfile.write(piece.encode('utf-8'))
 
-        return None
+def bulk_insert(model, objs, batch_size=100):
+    """bulk_create() in batches, to stay within the limit on the
+    number of query parameters in SQLite."""
+    for start in range(0, len(objs), batch_size):
+        model.objects.bulk_create(objs[start:start + batch_size])
 
 
 # Transcription tasks associated to an item
@@ -302,22 +545,6 @@ class TranscriptionTask(models.Model):
         return self.async_result().result
 
 
-# Aggregate function to sum booleans with type cast in PostgreSQL
-class SumAsIntSQL(models.sql.aggregates.Aggregate):
-    sql_function = 'SUM'
-    sql_template = 'SUM( %(field)s :: int)'
-
-class SumAsInt(models.Aggregate):
-    name = 'SumInt'
-
-    def add_to_query(self, query, alias, col, source, is_summary):
-        aggregate = SumAsIntSQL(col,
-                                source=source,
-                                is_summary=is_summary,
-                                **self.extra)
-        query.aggregates[alias] = aggregate
-
-
 # A track is a collection of clips, and possibly of speaker names.
 from django.conf.global_settings import LANGUAGES
 TRACK_KINDS = (('captions', 'Captions'),   # What's the difference
@@ -332,16 +559,7 @@ PUBLISHED_STATES = (('no', 'No'),
 PUBLISH_STATES = ('hidden', 'public')
 
 
-class TrackManager(models.Manager):
-    # Count # of clips and edited clips
-    def get_query_set(self):
-        return super(TrackManager, self).get_query_set() \
-            .annotate(clip_count=Count('clip')) \
-            .annotate(edited_clip_count=SumAsInt('clip__edited'))
-
 class Track(models.Model):
-    objects = TrackManager()
-
     item = models.ForeignKey(Item)
     name = models.CharField(max_length=1000,
                             blank=True,
@@ -371,16 +589,40 @@ class Track(models.Model):
                                                auto_now_add=True,
                                                editable=False)
 
+    # Number of clips and of edited clips
+    clip_count = models.IntegerField(default=0, editable=False)
+    edited_clip_count = models.IntegerField(default=0, editable=False)
+
+    # Incremented whenever clips or speakers change
+    content_version = models.IntegerField(default=0, editable=False)
+
+    # Keywords and phrases as JSON, and the content version they were
+    # computed from
     keyword_cache = models.TextField(blank=True, editable=False)
     keyword_cache_time = models.DateTimeField(blank=True, null=True, editable=False)
+    keyword_cache_version = models.IntegerField(blank=True, null=True, editable=False)
+
+    # Fields which are computed from other data.  They are written
+    # with update_columns() and left out of archived versions.
+    derived_fields = ('clip_count', 'edited_clip_count',
+                      'content_version', 'keyword_cache',
+                      'keyword_cache_time', 'keyword_cache_version')
 
     def __unicode__(self):
         return u'{} ({}, {})'.format(
             self.item.name, self.kind, self.lang)
 
     def save(self):
+        created = self.pk is None
         super(Track, self).save()
+        if created: self.item.update_track_count()
         self.item.archive()
+        self.queue_publish()
+
+    def delete(self):
+        item = self.item
+        super(Track, self).delete()
+        item.update_track_count()
 
     # Make an empty transcript for this item
     @classmethod
@@ -388,20 +630,36 @@ class Track(models.Model):
         if not item.duration:
             raise Exception(u"Unknown or zero item duration for item {}".format(item))
 
-        track = Track(item=item, **kwargs)
-        intime = 0.0
-        while intime < item.duration:
-            clip = Clip(track=track,
-                        intime=intime,
-                        outtime=intime + cliplength,
-                        caption_text="",
-                        edited=False)
-            clip.save()
-            intime += cliplength
-
-        track.save()
+        with transaction.commit_on_success():
+            # Archive once the clips are in, not on saving the track
+            track = Track(item=item, **kwargs)
+            models.Model.save(track)
+            item.update_track_count()
+
+            clips = []
+            intime = 0.0
+            while intime < item.duration:
+                clips.append(Clip(track=track,
+                                  intime=intime,
+                                  outtime=intime + cliplength,
+                                  caption_text="",
+                                  edited=False))
+                intime += cliplength
+
+            Clip.objects.bulk_create(clips)
+            update_columns(track, clip_count=len(clips), edited_clip_count=0)
+            track.queue_publish()
+
+        item.archive()
         return track
 
+    # Recount clips and edited clips from the database
+    def update_clip_counts(self):
+        clips = Clip.objects.filter(track=self)
+        update_columns(self,
+                       clip_count=clips.count(),
+                       edited_clip_count=clips.filter(edited=True).count())
+
     # Fraction of this transcript that has been edited, or None if
     # there are no existing clips at all.
     def edited_fraction(self):
@@ -409,70 +667,108 @@ class Track(models.Model):
         return float(self.edited_clip_count) / self.clip_count
 
 
-    # Export as plain text
+    # Clips for exporting, with their speakers, read without caching
+    # the whole query set
+    def export_clips(self):
+        return self.clip_set.select_related('speaker').iterator()
+
+    # Writer for exporting this track in `format': 'txt' for plain
+    # text, 'html', 'xml' or 'vtt'
+    def export_writer(self, format):
+        if format == 'html':
+            marker = u'<!-- transcript -->'
+            head, tail = render_to_string('spindle/export-transcript.html', {
+                    'item': self.item,
+                    'transcript': marker,
+                    # When the content last changed, so that
+                    # unchanged transcripts render the same (see
+                    # spindle.publish.Export.install)
+                    'date': max(self.updated, self.item.updated)
+                    }).split(marker, 1)
+            return spindle.writers.html.HTMLWriter(head, tail)
+        return EXPORT_WRITERS[format]()
+
+    # Yield the export in `format' a piece at a time, as unicode
+    def iter_export(self, format):
+        return spindle.writers.generate(self.export_writer(format),
+                                        self.export_clips())
+
+    # Write exports as UTF-8
     def write_plaintext(self, outfile):
-        speaker_id = None
-        for clip in self.clip_set.all():
-            if clip.begin_para:
-                outfile.write('\n\n');
-            if clip.speaker and clip.speaker.id != speaker_id:
-                outfile.write(clip.speaker.name.upper() + ": ")
-                speaker_id = clip.speaker.id
-            outfile.write(clip.caption_text.strip() + " ")
-
-    # Export as HTML
+        write_pieces(outfile, self.iter_export('txt'))
+
     def write_html(self, outfile):
-        transcript = ET.Element('div')
-        speaker_id = None
-
-        for idx, clip in enumerate(self.clip_set.all()):
-            # Begin new paragraph if indicated
-            if idx == 0 or clip.begin_para:
-                para = ET.SubElement(transcript, 'p')
-                para.text = ''
-                speaker_elem = None
-
-            # Speaker change?
-            if clip.speaker and clip.speaker.id != speaker_id:
-                speaker_id = clip.speaker.id
-                speaker_elem = ET.SubElement(para, 'span',
-                                             { 'class': 'speaker' })
-                speaker_elem.text = clip.speaker.name.strip() + ": "
-                speaker_elem.tail = ''
-
-            # Yuck.
-            if speaker_elem is not None:
-                speaker_elem.tail += clip.caption_text.strip() + " "
-            else:
-                para.text += clip.caption_text.strip() + " "
-
-        outfile.write(render_to_string('spindle/export-transcript.html', {
-                'item': self.item,
-                'transcript': ET.tostring(transcript),
-                'date': timezone.now()
-                }))
-
-    # Export as VTT
+        write_pieces(outfile, self.iter_export('html'))
+
+    def write_xml(self, outfile):
+        write_pieces(outfile, self.iter_export('xml'))
+
     def write_vtt(self, outfile):
-        import spindle.writers.vtt
-        spindle.writers.vtt.write(self.clip_set.all(), outfile)
+        write_pieces(outfile, self.iter_export('vtt'))
+
+    # Word and bigram counts for keyword extraction
+    def term_counts(self):
+        return TermIndex.for_track(self).term_counts()
+
+    # Record a change to this track's clips or speakers.  Call this
+    # inside the transaction which makes the change.
+    def content_changed(self):
+        update_columns(self, content_version=F('content_version') + 1)
+        self.queue_keyword_refresh()
+        self.queue_publish()
+
+    # Queue this track to have its exports published
+    def queue_publish(self):
+        DirtyTrack.add([self.pk])
 
+    # Keywords for RSS export: significant keywords, then phrases
     @property
     def keywords(self):
-        if self.keyword_cache_time and self.keyword_cache_time < self.updated:
-            return self.keyword_cache.split(';')
-        else:
-            text = (clip.caption_text for clip in self.clip_set.all())
-            keywords, ngrams = keywords_and_ngrams(text)
-            keywords = map(lambda kw_ll: kw_ll[0],
-                           filter(lambda kw_ll: kw_ll[1] > LL_THRESHOLD, keywords))
-            ngrams = map(lambda ng: u' '.join(ng[0]), ngrams)
+        results = self.keyword_results()
+        keywords = [kw for kw, ll in results['keywords'] if ll > LL_THRESHOLD]
+        keywords.extend(u' '.join(ngram) for ngram, count in results['ngrams'])
+        return keywords
 
-            keywords.extend(ngrams)
-            self.keyword_cache = u';'.join(keywords)
-            self.keyword_cache_time = timezone.now()
-            self.save()
-            return keywords
+    @property
+    def keywords_stale(self):
+        return self.keyword_cache_version != self.content_version
+
+    def keyword_results(self):
+        """Return cached keywords and phrases for this track.
+
+        The result is a dict with keys 'keywords', a list of (keyword,
+        log likelihood) pairs, and 'ngrams', a list of ((word, word),
+        count) pairs.  If the cache is out of date, a refresh is
+        queued and the old results are returned; they are only
+        computed here if there are none at all.
+        """
+        if self.keyword_cache_version is None:
+            self.refresh_keyword_cache()
+        elif self.keywords_stale:
+            self.queue_keyword_refresh()
+        return json.loads(self.keyword_cache)
+
+    def refresh_keyword_cache(self):
+        version = self.content_version
+        keywords, ngrams = keywords_from_counts(self.term_counts())
+
+        update_columns(self,
+                       keyword_cache=json.dumps({ 'keywords': keywords,
+                                                  'ngrams': ngrams }),
+                       keyword_cache_time=timezone.now(),
+                       keyword_cache_version=version)
+
+    @staticmethod
+    def keyword_refresh_key(track_id):
+        """Cache key set while a keyword refresh is queued for a track."""
+        return 'spindle_keyword_refresh_{}'.format(track_id)
+
+    def queue_keyword_refresh(self):
+        from spindle.tasks import refresh_keywords
+        key = Track.keyword_refresh_key(self.pk)
+        if cache.add(key, True, KEYWORD_REFRESH_DELAY + 60):
+            refresh_keywords.apply_async((self.pk,),
+                                         countdown=KEYWORD_REFRESH_DELAY)
 
 
 #
@@ -500,8 +796,169 @@ class Clip(models.Model):
     speaker      = models.ForeignKey(Speaker, null=True, blank=True)
     begin_para   = models.BooleanField()
 
+    # There is also an index on (track, intime), for loading clips
+    # a window at a time (see migration 0012)
     class Meta:
         ordering = ['intime']
 
     def __unicode__(self):
         return self.caption_text
+
+
+#
+# Word and bigram counts for each track, kept up to date as clips are
+# edited so that keywords can be extracted without reading the text of
+# every clip.  Bigrams are only counted within clips, so that each
+# clip's contribution can be added or subtracted on its own.
+#
+class TermIndex(models.Model):
+    track  = models.OneToOneField(Track, related_name='term_index')
+    total  = models.IntegerField(default=0)
+    counts = models.TextField(blank=True)   # JSON: terms and bigrams
+
+    def __unicode__(self):
+        return u'Term index for {}'.format(self.track)
+
+    @classmethod
+    def for_track(cls, track):
+        """Return the index for `track', building it if it doesn't exist."""
+        try:
+            return cls.objects.get(track=track)
+        except cls.DoesNotExist:
+            texts = track.clip_set.values_list('caption_text', flat=True)
+            return cls.build(track, texts)
+
+    @classmethod
+    def build(cls, track, texts):
+        """Create the index for `track' from the text of all its clips."""
+        index = cls(track=track)
+        index.set_counts(*TermCounts.from_lines(texts).as_dicts())
+        index.save()
+        return index
+
+    @classmethod
+    def update(cls, track, added=(), removed=()):
+        """Add the counts for clip texts `added' to the index for `track',
+        and subtract the counts for `removed'.
+
+        Does nothing if the track has no index yet, since it will be
+        built from the clips when it is next needed.
+        """
+        if not added and not removed: return
+        try:
+            index = cls.objects.select_for_update().get(track=track)
+        except cls.DoesNotExist:
+            return
+
+        terms, bigrams, total = index.get_counts()
+        for texts, sign in ((added, 1), (removed, -1)):
+            if not texts: continue
+            delta_terms, delta_bigrams, delta_total = \
+                TermCounts.from_lines(texts).as_dicts()
+            for counts, delta in ((terms, delta_terms),
+                                  (bigrams, delta_bigrams)):
+                for key, count in delta.iteritems():
+                    counts[key] = counts.get(key, 0) + sign * count
+                    if counts[key] <= 0: del counts[key]
+            total += sign * delta_total
+
+        index.set_counts(terms, bigrams, total)
+        index.save()
+
+    def get_counts(self):
+        """Return dicts of term and bigram counts, and the total word count."""
+        data = json.loads(self.counts) if self.counts else {}
+        bigrams = dict((tuple(key.split(' ')), count) for key, count
+                       in data.get('bigrams', {}).iteritems())
+        return data.get('terms', {}), bigrams, self.total
+
+    def set_counts(self, terms, bigrams, total):
+        self.total = total
+        self.counts = json.dumps({
+                'terms': terms,
+                'bigrams': dict((u' '.join(key), count) for key, count
+                                in bigrams.iteritems()) })
+
+    def term_counts(self):
+        return TermCounts.from_dicts(*self.get_counts())
+
+
+#
+# Tracks changed since their exports were last published.  Changes to
+# items, tracks, speakers and clips add a row here, and "spindle_publish
+# exports" writes out only the queued tracks rather than checking the
+# files of every track (see spindle.publish.publish_queued_tracks).
+# Rows are only ever added and deleted, so a track may be queued more
+# than once; a change made while publishing adds a new row, which is
+# kept for the next run.
+#
+class DirtyTrack(models.Model):
+    track  = models.ForeignKey(Track)
+    queued = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'Publish {}'.format(self.track_id)
+
+    @classmethod
+    def add(cls, track_ids):
+        bulk_insert(cls, [cls(track_id=track_id) for track_id in track_ids])
+
+    @classmethod
+    def last_id(cls):
+        """Id of the most recent row, or None if the queue is empty."""
+        latest = cls.objects.order_by('-id').values_list('id', flat=True)[:1]
+        return latest[0] if latest else None
+
+    @classmethod
+    def tracks(cls, last_id):
+        """The tracks queued up to row `last_id', with their items."""
+        return Track.objects.filter(dirtytrack__id__lte=last_id) \
+            .distinct().select_related('item').order_by('id')
+
+    @classmethod
+    def remove(cls, last_id, track_ids=None):
+        """Remove the rows up to `last_id', only for `track_ids' if
+        given."""
+        rows = cls.objects.filter(id__lte=last_id)
+        if track_ids is not None: rows = rows.filter(track__in=track_ids)
+        rows.delete()
+
+
+#
+# Manifest of the exported files written by spindle.publish: one row
+# for the current file of each published format of each track,
+# updated whenever an export is written.  The RSS feeds are built from
+# these rows rather than by looking at the public directory.  Files
+# written before the manifest existed are added when the feeds are
+# first built with an empty manifest (see
+# spindle.publish.refresh_manifest).
+#
+class PublishedFile(models.Model):
+    track    = models.ForeignKey(Track)
+    format   = models.CharField(max_length=16)
+    filename = models.CharField(max_length=1024)
+    size     = models.IntegerField()
+    sha1     = models.CharField(max_length=40)
+    mtime    = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('track', 'format')
+
+    def __unicode__(self):
+        return u'{}/{}'.format(self.track_id, self.filename)
+
+    @classmethod
+    def record(cls, track_id, format, filename, size, sha1):
+        """Record the current file for `format' of track `track_id'."""
+        values = dict(filename=filename, size=size, sha1=sha1,
+                      mtime=timezone.now())
+        if not cls.objects.filter(track=track_id, format=format).update(**values):
+            cls.objects.create(track_id=track_id, format=format, **values)
+
+    @classmethod
+    def by_export(cls, track_ids=None):
+        """Dict of rows by (track id, format), only for `track_ids' if
+        given."""
+        rows = cls.objects.all()
+        if track_ids is not None: rows = rows.filter(track__in=track_ids)
+        return dict(((row.track_id, row.format), row) for row in rows)
@@ -8,13 +8,21 @@ import os.path
 import urlparse
 import logging
 import time
+import itertools
+import multiprocessing
+import hashlib
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
 from django.utils.feedgenerator import Rss201rev2Feed, Enclosure
 from django.utils.timezone import now
 
-from spindle.models import Item, PUBLISH_STATES
+from celery import task
+
+from spindle.models import Item, Track, DirtyTrack, PublishedFile, PUBLISH_STATES
 import spindle.utils
+from spindle.render_cache import write_exports as write_track_exports
 from spindle.single_instance_task import single_instance_task
 
 logger = logging.getLogger(__name__)
@@ -58,7 +66,68 @@ EXPORTS_RSS_URL = urlparse.urljoin(PUBLIC_URL,
                                    settings.SPINDLE_EXPORTS_RSS_FILENAME)
 FULLTEXT_RSS_URL = urlparse.urljoin(PUBLIC_URL,
                                     settings.SPINDLE_FULLTEXT_RSS_FILENAME)
-    
+
+# Whether publishing tasks started without arguments (from the web
+# interface or celerybeat) write exports in parallel
+try:
+    PUBLISH_PARALLEL = settings.SPINDLE_PUBLISH_PARALLEL
+except:
+    PUBLISH_PARALLEL = False
+
+# Number of tracks in each chunk of a parallel publish
+try:
+    PUBLISH_CHUNK_SIZE = settings.SPINDLE_PUBLISH_CHUNK_SIZE
+except:
+    PUBLISH_CHUNK_SIZE = 20
+
+# Number of processes for a parallel publish run outside Celery
+try:
+    PUBLISH_PROCESSES = settings.SPINDLE_PUBLISH_PROCESSES
+except:
+    PUBLISH_PROCESSES = multiprocessing.cpu_count()
+
+# Seconds between checks on the chunks of a parallel publish
+PUBLISH_POLL_INTERVAL = 1
+
+# Seconds to keep exported files after they have been superseded, so
+# that readers of an older copy of the RSS feed can still fetch them
+try:
+    EXPORT_RETENTION = settings.SPINDLE_EXPORT_RETENTION
+except:
+    EXPORT_RETENTION = 24 * 60 * 60
+
+
+# Marker for a value which has not been looked up yet
+NOT_LOADED = object()
+
+class HashingFile(object):
+    """File wrapper which keeps a SHA-1 hash and the size of what is
+    written."""
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.hash = hashlib.sha1()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        self.outfile.write(data)
+
+    def close(self):
+        self.outfile.close()
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+def file_digest(path):
+    """SHA-1 hex digest of the content of the file at 'path'."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(64 * 1024), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
 class Export:
     """An exported transcript for a particular track in a particular format.
 
@@ -74,14 +143,24 @@ class Export:
     consumers of the RSS feed when the content of a transcript
     changes.
 
+    Exports are written to a temporary file first.  If it has the
+    same content as the current timestamped file, it is discarded and
+    the filename and URL stay the same; otherwise it is renamed to a
+    new timestamped filename and the link is swapped over to it.
+    Superseded files are removed later by sweep_exports.
+
+    The current file of each export is recorded in the PublishedFile
+    manifest, from which the RSS feeds are built without looking at
+    the public directory.
+
     """
 
     # Name of the Track model field controlling whether this type of
     # file should be exported
     visibility_field = None
     
-    # Name of the Track model method that writes this type of file
-    write_method = None
+    # Export format, as for Track.export_writer
+    format = None
     
     extension = None
     description = None
@@ -93,17 +172,80 @@ class Export:
     def __init__(self, track):
         self.track = track
 
+    # PublishedFile row for this export: None if there is none, or
+    # NOT_LOADED until it is looked up (see load_published_files)
+    _published_file = NOT_LOADED
+
+    @property
+    def published_file(self):
+        """The manifest entry for the current file of this export, or
+        None if it has not been written."""
+        if self._published_file is NOT_LOADED:
+            load_published_files([self])
+        return self._published_file
+
     def write(self):
-        """Write an exported transcript to disk.  Creates a newly timestamped file
+        """Write an exported transcript to disk, if its content has
+        changed.  Returns True if a newly timestamped file was created.
         """
-        write_method = getattr(self.track, self.write_method)
+        return write_exports([self])[0]
+
+    def open_new_file(self):
+        """Open a temporary file for writing this export, which is
+        put in place by install."""
         if not os.path.isdir(self.dirname):
             spindle.utils.mkdir_p(self.dirname)
-        self.make_new_filename()
-        with open(self.filepath, 'wb') as outfile:
-            write_method(outfile)
-        if os.path.exists(self.linkpath): os.remove(self.linkpath)
-        os.symlink(self.filepath, self.linkpath)
+        return HashingFile(open(self.temppath, 'wb'))
+
+    def install(self, digest, size):
+        """Put the temporary file written by open_new_file in place,
+        given the SHA-1 hex digest and size of its content, and record
+        it in the manifest.  If the current file has the same content,
+        the temporary file is removed instead and the current file
+        marked as up to date.  Returns True if the file was replaced.
+        """
+        try:
+            current = os.readlink(self.linkpath)
+        except OSError:
+            current = None
+        if current is not None and os.path.exists(current) \
+                and self.current_digest(current) == digest:
+            os.remove(self.temppath)
+            os.utime(current, None)
+            self._filename = os.path.basename(current)
+            replaced = False
+        else:
+            self.make_new_filename()
+            os.rename(self.temppath, self.filepath)
+            self.update_link()
+            # Start the retention period of the superseded file
+            if current is not None and current != self.filepath \
+                    and os.path.exists(current):
+                os.utime(current, None)
+            replaced = True
+
+        PublishedFile.record(self.track.id, self.format, self.filename,
+                             size, digest)
+        self._published_file = NOT_LOADED
+        return replaced
+
+    def current_digest(self, current):
+        """SHA-1 hex digest of the current file at path 'current',
+        from the manifest if it has an entry for that file."""
+        published = self.published_file
+        if published is not None \
+                and published.filename == os.path.basename(current):
+            return published.sha1
+        return file_digest(current)
+
+    def update_link(self):
+        """Point the symbolic link at the current timestamped file.
+        The new link is made under a temporary name and renamed over
+        the old one, so the link is never missing."""
+        temp_link = self.temppath + '.link'
+        if os.path.lexists(temp_link): os.remove(temp_link)
+        os.symlink(self.filepath, temp_link)
+        os.rename(temp_link, self.linkpath)
 
     @property
     def file_exists(self):
@@ -116,11 +258,10 @@ class Export:
 
     @property
     def as_enclosure(self):
-        """A Django enclosure object for including this exported format in the RSS feed."""
-        try:
-            return Enclosure(self.href, str(os.path.getsize(self.linkpath)), self.mime_type)
-        except:
-            return None
+        """A Django enclosure object for including this exported format
+        in the RSS feed, with the size from the manifest."""
+        if self.published_file is None: return None
+        return Enclosure(self.href, str(self.published_file.size), self.mime_type)
 
     @property
     def href(self):
@@ -142,6 +283,13 @@ transcript.
         """Absolute filesystem path to the timestamped file for this exported format."""
         return os.path.abspath(os.path.join(self.dirname, self.filename))
 
+    @property
+    def temppath(self):
+        """Absolute filesystem path to the temporary file for a new
+        export by this process."""
+        return os.path.abspath(os.path.join(
+                self.dirname, '.{}.{}.tmp'.format(self.linkname, os.getpid())))
+
     @property
     def linkpath(self):
         """Absolute filesystem path to the symbolic link for this exported format."""
@@ -168,11 +316,15 @@ transcript.
     def filename(self):
         """Timestamped export filename, which changes with each export.
 
-        If a symbolic link already exists for this export, obtain the
-        timestamped filename by reading the link.  Otherwise, generate
-        a new timestamped filename and return that.
+        Taken from the manifest if the export has been written,
+        otherwise by reading the symbolic link if it exists.
+        Otherwise, generate a new timestamped filename and return
+        that.
         """
         if self._filename is not None: return self._filename
+        if self.published_file is not None:
+            self._filename = self.published_file.filename
+            return self._filename
         try: 
             self._filename = os.path.basename(os.readlink(self.linkpath))
         except:
@@ -187,6 +339,14 @@ transcript.
         # timestamp = now().isoformat()
         timestamp = time.strftime('%Y-%m-%dT%H:%M:%S')
         self._filename = self.basename + '__' + timestamp + self.extension
+
+        # A second export within the same second gets a new name too,
+        # so that its URL changes
+        count = 1
+        while os.path.exists(self.filepath):
+            self._filename = u'{}__{}-{}{}'.format(self.basename, timestamp,
+                                                  count, self.extension)
+            count += 1
         
     @property
     def basename(self):
@@ -236,7 +396,7 @@ class TextExport(Export):
     description = 'Plain text transcript'
     mime_type = 'text/plain'
     rel = RSS_TRANSCRIPT_REL
-    write_method = 'write_plaintext'
+    format = 'txt'
 
 class VTTExport(Export):
     """WebVTT/SRT transcript export."""
@@ -245,7 +405,7 @@ class VTTExport(Export):
     description = 'WebVTT captions'
     mime_type = 'text/vtt'
     rel = RSS_CAPTIONS_REL
-    write_method = 'write_vtt'
+    format = 'vtt'
 
 class HTMLExport(Export):
     """HTML transcript export."""
@@ -254,7 +414,7 @@ class HTMLExport(Export):
     description = 'HTML transcript'
     mime_type = 'text/html'
     rel = RSS_TRANSCRIPT_REL
-    write_method = 'write_html'
+    format = 'html'
 
 
 # The types of exports
@@ -267,26 +427,188 @@ EXPORT_TYPES = (TextExport, VTTExport, HTMLExport)
 # particular item
 #
 
+def plan_exports(debug=False):
+    """Plan the exports of all items, for publishing them and for the
+    RSS feeds.
+
+    Returns a list of (item, exports) pairs, most recently updated
+    items first, where 'exports' are Export instances for each
+    published format of each of the item's tracks with clips.  The
+    tracks and items are loaded in a single query, and the manifest
+    in another, so the number of queries does not grow with the
+    number of items.
+    """
+    tracks = Track.objects.filter(clip_count__gt=0).select_related('item') \
+        .order_by('-item__updated', 'item', 'id')
+    plan = []
+    for item_id, item_tracks in itertools.groupby(tracks,
+                                                  lambda track: track.item_id):
+        exports = []
+        for track in item_tracks:
+            exports.extend(track_exports(track))
+        if exports: plan.append((exports[0].track.item, exports))
+    if debug: plan = plan[0:10]
+
+    manifest = PublishedFile.by_export()
+    load_published_files([export for item, exports in plan for export in exports],
+                         manifest)
+    return plan
+
 @single_instance_task(name='spindle.publish.all_items',
                       cache_id='items_task_id',
                       logger=logger)
-def publish_all_items(debug = False):
+def publish_all_items(debug=False, plan=None, parallel=None):
     """Write all exported plain text, HTML, SRT and other exported
     transcripts for all items to disk as static files.
+
+    'plan' is the result of plan_exports, if already made.  With
+    'parallel', the tracks are published in chunks by
+    publish_in_parallel; it defaults to SPINDLE_PUBLISH_PARALLEL.
+    Afterwards, superseded files are removed by sweep_exports.
     """
-    items = Item.objects.filter(track_count__gt=0).select_related()
-    total = items.count()
-    if debug: items = items[0:10]
-    for index, item in enumerate(items):
-        publish_all_items.update_progress(float(index) / total, item.name)
-        publish_item(item)
+    if plan is None: plan = plan_exports(debug)
+    if parallel is None: parallel = PUBLISH_PARALLEL
+    if parallel:
+        track_ids = []
+        for item, exports in plan:
+            for track, track_exports in itertools.groupby(
+                exports, lambda export: export.track):
+                track_ids.append(track.id)
+        publish_in_parallel(publish_all_items, track_ids)
+    else:
+        total = len(plan)
+        for index, (item, exports) in enumerate(plan):
+            publish_all_items.update_progress(float(index) / total, item.name)
+            write_stale_exports(exports)
+
+    if not debug: sweep_exports()
 
 def publish_item(item):
     """Write out all exported transcripts for 'item' as static files."""
-    for export in item_exports(item):
-        if export.needs_export:
-            export.write()
+    write_stale_exports(item_exports(item))
+
+def write_stale_exports(exports):
+    """Write out those of 'exports' which are missing or out of date,
+    a track at a time."""
+    exports = [export for export in exports if export.needs_export]
+    for track, track_exports in itertools.groupby(exports,
+                                                  lambda export: export.track):
+        write_exports(list(track_exports))
+
+def write_exports(exports):
+    """Write out several exports of the same track, rendering all of
+    them in one pass over its clips.  Returns a list of whether each
+    export's file was replaced (see Export.install)."""
+    outfiles = {}
+    try:
+        for export in exports:
+            outfiles[export.format] = export.open_new_file()
+        write_track_exports(exports[0].track, outfiles)
+    except:
+        for export in exports:
+            if os.path.exists(export.temppath): os.remove(export.temppath)
+        raise
+    finally:
+        for outfile in outfiles.itervalues():
+            outfile.close()
+
+    load_published_files(exports)
+    replaced = []
+    for export in exports:
+        outfile = outfiles[export.format]
+        replaced.append(export.install(outfile.hexdigest(), outfile.size))
+        if replaced[-1]:
             logger.info(u'\twrote "%s"', export.filepath)
+        else:
+            logger.info(u'\tunchanged "%s"', export.filepath)
+    return replaced
+
+def sweep_exports(max_age=None):
+    """Remove exported files which were superseded more than 'max_age'
+    seconds ago (default SPINDLE_EXPORT_RETENTION), and temporary
+    files left by exports which failed.  Returns the number of files
+    removed."""
+    if max_age is None: max_age = EXPORT_RETENTION
+    cutoff = time.time() - max_age
+    removed = 0
+    if not os.path.isdir(settings.SPINDLE_PUBLIC_DIRECTORY): return removed
+    for name in os.listdir(settings.SPINDLE_PUBLIC_DIRECTORY):
+        dirname = os.path.join(settings.SPINDLE_PUBLIC_DIRECTORY, name)
+        if not name.isdigit() or not os.path.isdir(dirname): continue
+
+        filenames = os.listdir(dirname)
+        current = set(os.path.basename(os.readlink(os.path.join(dirname, filename)))
+                      for filename in filenames
+                      if os.path.islink(os.path.join(dirname, filename)))
+        for filename in filenames:
+            path = os.path.join(dirname, filename)
+            # Only timestamped and temporary files (see Export)
+            if filename in current or os.path.islink(path): continue
+            if '__' not in filename and not filename.startswith('.'): continue
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                logger.info(u'\tremoved "%s"', path)
+                removed += 1
+    return removed
+
+def load_published_files(exports, manifest=None):
+    """Look up the manifest entries of those of 'exports' not yet
+    looked up, in one query, or in 'manifest' if given (see
+    PublishedFile.by_export)."""
+    exports = [export for export in exports
+               if export._published_file is NOT_LOADED]
+    if not exports: return
+    if manifest is None:
+        manifest = PublishedFile.by_export(
+            set(export.track.id for export in exports))
+    for export in exports:
+        export._published_file = manifest.get((export.track.id, export.format))
+
+def rebuild_manifest(debug=False):
+    """Record the current files of all published exports in the
+    manifest, by looking at the public directory, and remove the
+    entries of exports whose files are missing.  Needed for files
+    changed by hand; files written before the manifest was kept are
+    recorded when the feeds are next built (see refresh_manifest).
+    Returns the number of files recorded."""
+    return record_published_files(plan_exports(debug))
+
+def record_published_files(plan):
+    """Record the current files of the exports in 'plan' in the
+    manifest, as rebuild_manifest.  Returns the number recorded."""
+    recorded = 0
+    for item, exports in plan:
+        for export in exports:
+            try:
+                current = os.readlink(export.linkpath)
+            except OSError:
+                current = None
+            if current is None or not os.path.exists(current):
+                if export.published_file is not None:
+                    export.published_file.delete()
+                continue
+            PublishedFile.record(export.track.id, export.format,
+                                 os.path.basename(current),
+                                 os.path.getsize(current), file_digest(current))
+            recorded += 1
+    return recorded
+
+def refresh_manifest(plan):
+    """Reload the manifest entries of the exports in 'plan', which may
+    have been written since it was made, by other Export instances or
+    processes.  If the manifest is empty, as after upgrading from a
+    version which did not keep one, it is first filled from the public
+    directory."""
+    manifest = PublishedFile.by_export()
+    if not manifest:
+        if record_published_files(plan):
+            manifest = PublishedFile.by_export()
+
+    exports = [export for item, exports in plan for export in exports]
+    for export in exports:
+        export._published_file = NOT_LOADED
+        export._filename = None
+    load_published_files(exports, manifest)
 
 def item_exports(item):
     """Generator, returning Export instances for each exported format
@@ -294,10 +616,156 @@ def item_exports(item):
 
     """
     for track in item.track_set.filter(clip_count__gt=0):
-        for export_type in EXPORT_TYPES:
-            export = export_type(track)
-            if export.is_published: yield export
-
+        for export in track_exports(track):
+            yield export
+
+def track_exports(track):
+    """Generator, returning Export instances for each published format
+    of 'track'."""
+    for export_type in EXPORT_TYPES:
+        export = export_type(track)
+        if export.is_published: yield export
+
+
+@single_instance_task(name='spindle.publish.queued_tracks',
+                      cache_id='queued_tracks_task_id',
+                      logger=logger)
+def publish_queued_tracks(debug=False, parallel=None):
+    """Write out the exported transcripts of the tracks which have
+    changed since they were last published (see DirtyTrack).
+
+    Unlike publish_all_items, this does not look at the files of the
+    other tracks, so exports which were deleted or went missing are
+    only restored by a full publish.  'parallel' is as for
+    publish_all_items.
+    """
+    last_id = DirtyTrack.last_id()
+    if last_id is None: return
+    if parallel is None: parallel = PUBLISH_PARALLEL
+
+    tracks = DirtyTrack.tracks(last_id)
+    if debug: tracks = tracks[0:10]
+    tracks = list(tracks)
+    if parallel:
+        publish_in_parallel(publish_queued_tracks,
+                            [track.id for track in tracks], stale_only=False)
+    else:
+        total = len(tracks)
+        for index, track in enumerate(tracks):
+            publish_queued_tracks.update_progress(float(index) / total,
+                                                  track.item.name)
+            write_track(track, stale_only=False)
+
+    DirtyTrack.remove(last_id,
+                      [track.id for track in tracks] if debug else None)
+
+def write_track(track, stale_only=True):
+    """Write out the published exports of 'track', or with
+    'stale_only' only those which are missing or out of date.
+    Returns the number of files written."""
+    if not track.clip_count: return 0
+    exports = list(track_exports(track))
+    if stale_only:
+        exports = [export for export in exports if export.needs_export]
+    if exports: write_exports(exports)
+    return len(exports)
+
+
+#
+# Publishing in parallel.  The tracks to publish are split into
+# chunks, which are written out by a group of Celery tasks on the
+# 'local' queue, or by a pool of local processes when the publishing
+# task is not itself running in a Celery worker (from the management
+# command, or with CELERY_ALWAYS_EAGER).  Each chunk loads its own
+# tracks, in one query.
+#
+
+def publish_tracks(track_ids, stale_only=True):
+    """Write out the exports of the tracks with primary keys
+    'track_ids', as write_track.  Returns the number of files written."""
+    tracks = Track.objects.filter(pk__in=track_ids).select_related('item') \
+        .order_by('id')
+    return sum(write_track(track, stale_only) for track in tracks)
+
+@task(name='spindle.publish.tracks', queue='local')
+def publish_tracks_task(track_ids, stale_only=True):
+    return publish_tracks(track_ids, stale_only)
+
+def publish_tracks_args(args):
+    # Pool.imap passes a single argument
+    return publish_tracks(*args)
+
+def publish_in_parallel(progress_task, track_ids, stale_only=True):
+    """Publish the tracks with primary keys 'track_ids' in chunks of
+    SPINDLE_PUBLISH_CHUNK_SIZE, reporting the progress of the chunks
+    through 'progress_task', a single_instance_task.  Returns the number of
+    files written.
+
+    In a Celery worker, the chunks are sent as a group of tasks to the
+    'local' queue.  Since the calling task waits for them while
+    holding a worker process, the worker for that queue needs a
+    concurrency of at least two, and a result backend must be
+    configured.
+    """
+    chunks = [track_ids[start:start + PUBLISH_CHUNK_SIZE]
+              for start in xrange(0, len(track_ids), PUBLISH_CHUNK_SIZE)]
+    if not chunks: return 0
+
+    if progress_task.request.called_directly or \
+            getattr(settings, 'CELERY_ALWAYS_EAGER', False):
+        results = publish_chunks_locally(chunks, stale_only)
+    else:
+        results = publish_chunks_in_workers(chunks, stale_only)
+
+    total, written = len(chunks), 0
+    for done, count in enumerate(results, 1):
+        written += count
+        message = u'{} of {} chunks, {} files written'.format(
+            done, total, written)
+        progress_task.update_progress(float(done) / total, message)
+    return written
+
+def publish_chunks_locally(chunks, stale_only):
+    """Generator, publishing 'chunks' in a pool of up to
+    SPINDLE_PUBLISH_PROCESSES processes and returning the number of
+    files written by each chunk as it completes."""
+    processes = min(PUBLISH_PROCESSES, len(chunks))
+    if processes <= 1:
+        for chunk in chunks:
+            yield publish_tracks(chunk, stale_only)
+        return
+
+    # The forked processes must make their own connections to the
+    # database and cache rather than sharing ours
+    connection.close()
+    if hasattr(cache, 'close'): cache.close()
+    pool = multiprocessing.Pool(processes)
+    try:
+        for count in pool.imap_unordered(
+            publish_tracks_args, [(chunk, stale_only) for chunk in chunks]):
+            yield count
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def publish_chunks_in_workers(chunks, stale_only):
+    """Generator, publishing 'chunks' as a group of Celery tasks and
+    returning the number of files written by each chunk as it
+    completes."""
+    from celery import group
+    result = group(publish_tracks_task.s(chunk, stale_only)
+                   for chunk in chunks).apply_async()
+    pending = list(result.results)
+    while pending:
+        finished = [chunk for chunk in pending if chunk.ready()]
+        for chunk in finished:
+            pending.remove(chunk)
+            yield chunk.get()
+        if not finished: time.sleep(PUBLISH_POLL_INTERVAL)
+
 #
 # The RSS feed of exported files and extracted keywords
 #
@@ -352,20 +820,20 @@ class TranscriptFeed(SpindleFeed):
 @single_instance_task(name='spindle.publish.exports_feed',
                       cache_id='export_feed_task_id',
                       logger=logger)
-def publish_exports_feed(debug=False):
+def publish_exports_feed(debug=False, plan=None):
     feed = TranscriptFeed(title = "Spindle transcripts",
                           link = "/",
                           description = "Text, SRT, and HTML transcripts generated by Spindle")
-    items = Item.objects.filter(track_count__gt=0).order_by('-updated')
-    if debug: items = items[0:10]
+    if plan is None: plan = plan_exports(debug)
+    refresh_manifest(plan)
 
     logger.info(u"URL = {}\nPath = {}".format(EXPORTS_RSS_URL, EXPORTS_RSS_FILENAME))
-    total = len(items)
-    for index, item in enumerate(items):
+    total = len(plan)
+    for index, (item, exports) in enumerate(plan):
         publish_exports_feed.update_progress(float(index) / total, item.name)
 
-        for export in item_exports(item):
-            if export.file_exists:
+        for export in exports:
+            if export.published_file is not None:
                 # Force computation of keywords inside this loop if
                 # necessary.  This allows for more accurate progress
                 # updates.
@@ -412,20 +880,21 @@ class FulltextFeed(SpindleFeed):
 @single_instance_task(name='spindle.publish.fulltext_feed',
                       cache_id='export_fulltext_feed_task_id',
                       logger=logger)
-def publish_fulltext_feed(debug=False):
+def publish_fulltext_feed(debug=False, plan=None):
     feed = FulltextFeed(title = "Spindle fulltext transcripts",
                           link = "/",
                           description = "Plain text transcripts generated by Spindle")
-    items = Item.objects.filter(track_count__gt=0).order_by('-updated')
-    if debug: items = items[0:10]
+    if plan is None: plan = plan_exports(debug)
+    refresh_manifest(plan)
 
     logger.info(u"URL = {}\nPath = {}".format(FULLTEXT_RSS_URL, FULLTEXT_RSS_FILENAME))
-    total = len(items)
-    for index, item in enumerate(items):
+    total = len(plan)
+    for index, (item, exports) in enumerate(plan):
         publish_fulltext_feed.update_progress(float(index) / total, item.name)
 
-        for export in item_exports(item):
-            if export.mime_type == 'text/plain' and export.file_exists:
+        for export in exports:
+            if export.mime_type == 'text/plain' \
+                    and export.published_file is not None:
                 # Force computation of keywords inside this loop if
                 # necessary.  This allows for more accurate progress
                 # updates.
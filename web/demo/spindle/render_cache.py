@@ -0,0 +1,128 @@
+"""Cache of rendered transcript exports.
+
+A rendered export is stored in Django's cache under a key made from
+the track id, its content version and the format, so that editing the
+clips or speakers of a track (see Track.content_changed) makes new
+keys and old renders are simply never read again.  The key also
+includes when the track and its item were last saved, since some
+formats show item details, and since a track restored by reverting an
+item starts again from a low content version.
+
+Both the export views and the publisher render through here, so a
+transcript is rendered once per version, however often it is
+downloaded or published.  Renders are streamed as they are made, and
+ones too large for the cache are not kept, so that memory use does
+not grow with the length of the transcript.
+"""
+
+import calendar
+
+from django.conf import settings
+from django.core.cache import cache
+
+import spindle.writers
+
+# Seconds to keep a rendered export in the cache
+try:
+    RENDER_CACHE_TIMEOUT = settings.SPINDLE_RENDER_CACHE_TIMEOUT
+except:
+    RENDER_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+# Largest export to keep in the cache, in bytes.  memcached refuses
+# values over 1MB by default.
+try:
+    RENDER_CACHE_MAX_SIZE = settings.SPINDLE_RENDER_CACHE_MAX_SIZE
+except:
+    RENDER_CACHE_MAX_SIZE = 1000 * 1000
+
+# Bytes to collect before sending on a piece of a render
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def timestamp(value):
+    return calendar.timegm(value.utctimetuple()) * 1000000 + value.microsecond
+
+def render_key(track, format):
+    return 'spindle_render_{}_{}_{}_{}_{}'.format(
+        track.id, track.content_version, format,
+        timestamp(track.updated), timestamp(track.item.updated))
+
+
+def chunked(pieces, chunk_size=STREAM_CHUNK_SIZE):
+    """Join an iterable of unicode strings into UTF-8 strings of at
+    least `chunk_size' bytes, except the last."""
+    buffer, size = [], 0
+    for piece in pieces:
+        piece = piece.encode('utf-8')
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer: yield ''.join(buffer)
+
+
+def stream(track, format):
+    """Yield the export of `track' in `format' (see
+    Track.export_writer) as UTF-8 strings, from the cache if possible.  Otherwise it is
+    rendered and sent a chunk at a time, and cached once complete."""
+    key = render_key(track, format)
+    content = cache.get(key)
+    if content is not None:
+        yield content
+        return
+
+    pieces, size = [], 0
+    for piece in chunked(track.iter_export(format)):
+        if pieces is not None:
+            size += len(piece)
+            if size <= RENDER_CACHE_MAX_SIZE: pieces.append(piece)
+            else: pieces = None
+        yield piece
+    if pieces is not None:
+        cache.set(key, ''.join(pieces), RENDER_CACHE_TIMEOUT)
+
+def render(track, format):
+    """Return the whole export of `track' in `format' as a UTF-8
+    string."""
+    return ''.join(stream(track, format))
+
+
+class CachingOutput(object):
+    """File wrapper which writes unicode strings as UTF-8, and keeps a
+    copy for the cache unless it grows too large."""
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.pieces = []
+        self.size = 0
+
+    def write(self, piece):
+        piece = piece.encode('utf-8')
+        self.outfile.write(piece)
+        if self.pieces is not None:
+            self.size += len(piece)
+            if self.size <= RENDER_CACHE_MAX_SIZE: self.pieces.append(piece)
+            else: self.pieces = None
+
+def write_exports(track, outfiles):
+    """Write the exports of `track' in several formats, given as a dict
+    of files by format.  Cached exports are copied from the cache, and
+    all the others are rendered in one pass over the clips."""
+    outputs = {}
+    for format, outfile in outfiles.iteritems():
+        content = cache.get(render_key(track, format))
+        if content is not None:
+            outfile.write(content)
+        else:
+            outputs[format] = CachingOutput(outfile)
+    if not outputs: return
+
+    spindle.writers.write_many(
+        [(track.export_writer(format), output)
+         for format, output in outputs.iteritems()],
+        track.export_clips())
+    for format, output in outputs.iteritems():
+        if output.pieces is not None:
+            cache.set(render_key(track, format), ''.join(output.pieces),
+                      RENDER_CACHE_TIMEOUT)
@@ -1,18 +1,31 @@
 # Brute simple REST api for the spindle caption editor
 
 import json
+import calendar
+import itertools
+import datetime
+from collections import defaultdict
 from functools import wraps
 
 from django.conf.urls import patterns, include, url
 from django.shortcuts import get_object_or_404, redirect, render
 from django.db import models
 from django.db import transaction
+from django.db.models import F
 from django.core import serializers
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, \
+    HttpResponseNotModified, Http404
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, \
+    quote_etag
 from django.views.generic.base import View
 from django.utils.decorators import method_decorator
 
-from spindle.models import Item, Track, Speaker, Clip
+from spindle import columnar, transforms, intervals
+from spindle.columnar import columnar_response
+from spindle.models import Item, Track, Speaker, Clip, TermIndex, \
+    update_columns, bulk_insert
 
 
 def json_response(objs):
@@ -41,8 +54,46 @@ class SingleResource(View):
         self.object = get_object_or_404(self.model, pk = kwargs['pk'])
         return super(SingleResource, self).dispatch(request, *args, **kwargs)
 
+    # Conditional requests, for models with an `updated' timestamp
+    def etag(self):
+        updated = getattr(self.object, 'updated', None)
+        if updated is None: return None
+        return '{}-{}'.format(self.object.pk, updated.isoformat())
+
+    def add_validators(self, response):
+        etag = self.etag()
+        if etag is not None:
+            response['ETag'] = quote_etag(etag)
+            response['Last-Modified'] = http_date(
+                calendar.timegm(self.object.updated.utctimetuple()))
+        return response
+
+    def not_modified(self, request):
+        etag = self.etag()
+        if etag is None: return False
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return etag in etags or '*' in etags
+
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return (if_modified_since is not None and if_modified_since >=
+                calendar.timegm(self.object.updated.utctimetuple()))
+
+    def precondition_failed(self, request):
+        etag = self.etag()
+        if_match = request.META.get('HTTP_IF_MATCH')
+        if etag is None or not if_match: return False
+
+        etags = parse_etags(if_match)
+        return etag not in etags and '*' not in etags
+
     def get(self, request, *args, **kwargs):
-        return json_response([self.object])
+        if self.not_modified(request):
+            return self.add_validators(HttpResponseNotModified())
+        return self.add_validators(json_response([self.object]))
     
     def field_editable(self, key):
         if key[-3:] == "_id":
@@ -50,17 +101,56 @@ class SingleResource(View):
         else:
             return self.model._meta.get_field_by_name(key)[0].editable
 
+    def field_value(self, key, value):
+        """Return the field for `key' and `value' converted to its type."""
+        name = key[:-3] if key[-3:] == "_id" else key
+        field = self.model._meta.get_field_by_name(name)[0]
+        value = field.to_python(value)
+        if isinstance(value, datetime.datetime) and settings.USE_TZ \
+                and timezone.is_naive(value):
+            value = timezone.make_aware(value, timezone.get_default_timezone())
+        return field, value
+
     def put(self, request, *args, **kwargs):
+        if self.precondition_failed(request):
+            return HttpResponse(json.dumps({ 'status': 'error',
+                                             'error': 'Modified by someone else.' }),
+                                mimetype = 'application/json',
+                                status = 412)
+
         data = json.loads(request.body)
         del data['pk']
 
-        with transaction.commit_on_success():
-            for key, value in data.iteritems():
-                if self.field_editable(key):
-                    setattr(self.object, key, value)
-                    self.object.save()
-
-        return json_response([self.object])
+        # Write only the fields which changed, in a single UPDATE.
+        # update() takes field names (item), the object attnames (item_id)
+        changed = {}
+        for key, value in data.iteritems():
+            if self.field_editable(key):
+                field, value = self.field_value(key, value)
+                if getattr(self.object, field.attname) != value:
+                    changed[field.name] = value
+
+        if changed:
+            for field in self.model._meta.fields:
+                if getattr(field, 'auto_now', False):
+                    changed[field.name] = timezone.now()
+
+            with transaction.commit_on_success():
+                self.model._base_manager.filter(pk=self.object.pk).update(**changed)
+                for name, value in changed.iteritems():
+                    field = self.model._meta.get_field(name)
+                    setattr(self.object, field.attname, value)
+                    # Drop the related object cached for the old key
+                    if field.rel and hasattr(self.object, field.get_cache_name()):
+                        delattr(self.object, field.get_cache_name())
+                self.after_update()
+
+        return self.add_validators(json_response([self.object]))
+
+    def after_update(self):
+        """Called after a PUT changes the object, inside the
+        transaction, in place of the side effects of save()."""
+        pass
     
 class CollectionResource(View):
     model = None
@@ -73,7 +163,11 @@ class CollectionResource(View):
     def get_query_set(self, *args, **kwargs):
         return self.model.objects.all()
 
+    # ?format=columns selects the streaming columnar format (see
+    # spindle.columnar)
     def get(self, request, *args, **kwargs):
+        if request.GET.get('format') == 'columns':
+            return columnar_response(request, self.query_set)
         return json_response(self.query_set)
       
     def put(self, request, *args, **kwargs):
@@ -82,17 +176,32 @@ class CollectionResource(View):
         response = []
 
         with transaction.commit_on_success():
+            old = self.before_replace()
             self.query_set.delete()
 
             for fields in data:
                 obj = model(**fields) 
                 obj.save()
                 response.append(obj)
+            self.after_replace(old, response)
         return json_response(response)
     
     def parse(self, data):
         return data
 
+    # Hooks for keeping derived data up to date when the collection
+    # changes. Called inside the transaction making the change.
+    def before_replace(self):
+        """Called before a PUT replaces the collection. The return
+        value is passed on to `after_replace'."""
+        return None
+
+    def after_replace(self, old, objects):
+        pass
+
+    def after_create(self, obj):
+        pass
+
     def post(self, request, *args, **kwargs):
         data = self.parse(json.loads(request.body))
         for field in ('pk', self.model._meta.pk.name):
@@ -101,6 +210,7 @@ class CollectionResource(View):
         with transaction.commit_on_success():
             self.object = self.model(**data)
             self.object.save()
+            self.after_create(self.object)
 
         return json_response([self.object])
 
@@ -110,8 +220,16 @@ class CollectionResource(View):
 class ItemResource(SingleResource):
     model = Item
 
+    def after_update(self):
+        self.object.archive()
+        self.object.queue_publish()
+
 class TrackResource(SingleResource):
     model = Track
+
+    def after_update(self):
+        self.object.item.archive()
+        self.object.queue_publish()
         
 class TrackSpeakersResource(CollectionResource):
     model = Speaker
@@ -123,16 +241,299 @@ class TrackSpeakersResource(CollectionResource):
         data['track_id'] = self.track.id
         return data
 
+    def put(self, request, *args, **kwargs):
+        """Replace the speakers of the track, updating existing ones in
+        place: deleting a speaker would delete its clips too.  Speakers
+        left out are removed from their clips before being deleted."""
+        data = map(self.parse, json.loads(request.body))
+        response = []
+
+        with transaction.commit_on_success():
+            old = dict((speaker.pk, speaker) for speaker in self.query_set)
+            for fields in data:
+                pk = fields.pop('pk', None)
+                speaker = old.pop(int(pk), None) if pk is not None else None
+                if speaker is None:
+                    speaker = Speaker(**fields)
+                else:
+                    for key, value in fields.iteritems():
+                        setattr(speaker, key, value)
+                speaker.save()
+                response.append(speaker)
+            if old:
+                Clip.objects.filter(speaker__in=old.keys()).update(speaker=None)
+                Speaker.objects.filter(pk__in=old.keys()).delete()
+            self.after_replace(None, response)
+        return json_response(response)
+
+    def after_replace(self, old, speakers):
+        self.track.content_changed()
+
+    def after_create(self, speaker):
+        self.track.content_changed()
+
+def clip_window(clips, params):
+    """Restrict the query set `clips' to a window given by the
+    request parameters `params':
+
+    `from', `to': clips starting at or after `from' and before `to'
+    `after_intime': clips starting after this time
+    `limit': only the first `limit' clips (plus any starting at the
+    same time as the last one)
+
+    All are optional, and are served by the index on (track, intime).
+    Raises ValueError if a parameter is not a number.
+    """
+    if 'from' in params:
+        clips = clips.filter(intime__gte=float(params['from']))
+    if 'to' in params:
+        clips = clips.filter(intime__lt=float(params['to']))
+    if 'after_intime' in params:
+        clips = clips.filter(intime__gt=float(params['after_intime']))
+    if 'limit' in params:
+        limit = int(params['limit'])
+        if limit < 1: raise ValueError('limit must be positive')
+        last = clips.order_by('intime').values_list('intime', flat=True)[limit - 1:limit]
+        if last: clips = clips.filter(intime__lte=last[0])
+    return clips
+
+def bad_window():
+    return HttpResponseBadRequest('Bad clip window parameters',
+                                  content_type='text/plain')
+
 class TrackClipsResource(CollectionResource):
     model = Clip
     def get_query_set(self, request, pk=None):
         self.track = get_object_or_404(Track, pk=pk)
         return self.track.clip_set.all()
 
+    def get(self, request, *args, **kwargs):
+        try:
+            self.query_set = clip_window(self.query_set, request.GET)
+        except ValueError:
+            return bad_window()
+        return super(TrackClipsResource, self).get(request, *args, **kwargs)
+
     def parse(self, data):
         data['track_id'] = self.track.id
         return data
 
+    def before_replace(self):
+        return dict(self.query_set.values_list('pk', 'caption_text'))
+
+    def after_replace(self, old_text, clips):
+        # Only clips whose text changed contribute to the term index
+        unchanged = set(clip.pk for clip in clips
+                        if old_text.get(clip.pk) == clip.caption_text)
+        TermIndex.update(self.track,
+                         added=[clip.caption_text for clip in clips
+                                if clip.pk not in unchanged],
+                         removed=[text for pk, text in old_text.iteritems()
+                                  if pk not in unchanged])
+        update_columns(self.track,
+                       clip_count=len(clips),
+                       edited_clip_count=sum(1 for clip in clips if clip.edited))
+        self.track.content_changed()
+
+    def after_create(self, clip):
+        TermIndex.update(self.track, added=[clip.caption_text])
+        update_columns(self.track,
+                       clip_count=F('clip_count') + 1,
+                       edited_clip_count=F('edited_clip_count') + int(bool(clip.edited)))
+        self.track.content_changed()
+
+class TrackClipsSyncResource(View):
+    """Apply a batch of changes to the clips of a track.
+
+    POST a JSON object with any of the keys `create' (a list of new
+    clips), `update' (a list of changed clips, with their `pk') and
+    `delete' (a list of primary keys).  The changes are made in one
+    transaction.  Returns the created clips, in the order given, the
+    updated clips and the keys of the deleted ones.
+
+    The created clips are inserted in bulk.  Updates which set the
+    same values (a speaker, the edited flag) share one UPDATE; those
+    with their own caption text still take one each, as there is no
+    conditional update in this version of Django.
+    """
+    fields = ('intime', 'outtime', 'caption_text', 'edited', 'speaker_id')
+
+    @method_decorator(json_login_required)
+    def dispatch(self, request, *args, **kwargs):
+        self.track = get_object_or_404(Track, pk=kwargs['pk'])
+        return super(TrackClipsSyncResource, self).dispatch(request, *args, **kwargs)
+
+    def parse(self, data):
+        return dict((key, value) for key, value in data.iteritems()
+                    if key in self.fields)
+
+    # QuerySet.update() takes field names, not attnames like speaker_id
+    def update_args(self, fields):
+        return dict((key[:-3] if key[-3:] == "_id" else key, value)
+                    for key, value in fields.iteritems())
+
+    def grouped_updates(self, updates):
+        """Return the updates as (fields, keys) pairs, one for each
+        distinct set of new values."""
+        groups = defaultdict(list)
+        for pk, fields in updates.iteritems():
+            if fields:
+                groups[tuple(sorted(self.update_args(fields).items()))].append(pk)
+        return [(dict(values), sorted(pks)) for values, pks in groups.iteritems()]
+
+    def create(self, creates):
+        """Insert new clips with the fields in `creates' and return
+        them, in the same order, with their primary keys."""
+        clips = [Clip(track=self.track, **fields) for fields in creates]
+        if not clips: return []
+        for clip in clips:
+            clip.intime, clip.outtime = float(clip.intime), float(clip.outtime)
+        bulk_insert(Clip, clips)
+
+        # bulk_create() does not set primary keys, so read the new rows
+        # back by their times: the newest rows at each time are ours
+        rows = defaultdict(list)
+        for pk, intime, outtime in self.track.clip_set.filter(
+                intime__range=(min(clip.intime for clip in clips),
+                               max(clip.intime for clip in clips))) \
+                .order_by('pk').values_list('pk', 'intime', 'outtime'):
+            rows[intime, outtime].append(pk)
+        for clip in reversed(clips):
+            clip.pk = rows[clip.intime, clip.outtime].pop()
+        return clips
+
+    def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body)
+            creates = [self.parse(fields) for fields in data.get('create', [])]
+            updates = dict((int(fields['pk']), self.parse(fields))
+                           for fields in data.get('update', []))
+            deletes = set(int(pk) for pk in data.get('delete', []))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return HttpResponseBadRequest('Malformed clip changes',
+                                          content_type='text/plain')
+
+        with transaction.commit_on_success():
+            # Only clips belonging to this track can be changed
+            old = dict((pk, (text, edited)) for pk, text, edited in
+                       self.track.clip_set.filter(pk__in=set(updates) | deletes)
+                       .values_list('pk', 'caption_text', 'edited'))
+            deletes.intersection_update(old)
+            updates = dict((pk, fields) for pk, fields in updates.iteritems()
+                           if pk in old and pk not in deletes)
+
+            if deletes:
+                Clip.objects.filter(pk__in=deletes).delete()
+            for fields, pks in self.grouped_updates(updates):
+                for start in range(0, len(pks), 100):
+                    Clip.objects.filter(pk__in=pks[start:start + 100]) \
+                        .update(**fields)
+            created = self.create(creates)
+            updated = list(Clip.objects.filter(pk__in=updates.keys()))
+
+            # Keep the term index and counters in step
+            retexted = [pk for pk, fields in updates.iteritems()
+                        if fields.get('caption_text', old[pk][0]) != old[pk][0]]
+            TermIndex.update(self.track,
+                             added=[clip.caption_text for clip in created] +
+                                   [updates[pk]['caption_text'] for pk in retexted],
+                             removed=[old[pk][0] for pk in list(deletes) + retexted])
+
+            edited = (sum(1 for clip in created if clip.edited)
+                      - sum(1 for pk in deletes if old[pk][1])
+                      + sum(int(bool(fields.get('edited', old[pk][1])))
+                            - int(bool(old[pk][1]))
+                            for pk, fields in updates.iteritems()))
+            if created or deletes or edited:
+                update_columns(self.track,
+                               clip_count=F('clip_count') + len(created) - len(deletes),
+                               edited_clip_count=F('edited_clip_count') + edited)
+            if created or deletes or updates:
+                self.track.content_changed()
+
+        return HttpResponse(
+            '{{"created": {}, "updated": {}, "deleted": {}}}'.format(
+                serializers.serialize('json', created),
+                serializers.serialize('json', updated),
+                json.dumps(sorted(deletes))),
+            content_type='application/json')
+
+class TrackTransformResource(View):
+    """Apply a bulk transform to the clips of a track on the server.
+
+    POST a JSON object with the name of the `operation' (shift,
+    rescale, merge or split) and its parameters, for instance
+    {"operation": "shift", "offset": 2.5, "after": 60}.  See
+    spindle.transforms.  Returns the number of clips changed.
+    """
+    @method_decorator(json_login_required)
+    def dispatch(self, request, *args, **kwargs):
+        self.track = get_object_or_404(Track, pk=kwargs['pk'])
+        return super(TrackTransformResource, self).dispatch(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            params = json.loads(request.body)
+            operation = params.pop('operation')
+            changed = transforms.run(self.track, operation, **params)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return HttpResponseBadRequest('Bad transform',
+                                          content_type='text/plain')
+
+        return HttpResponse(json.dumps({ 'operation': operation,
+                                         'changed': changed }),
+                            content_type='application/json')
+
+class TrackIntervalsResource(View):
+    """Clips of a track by playback time, from spindle.intervals.
+
+    track/<pk>/at/<time>/: the clips active at `time'
+    track/<pk>/range/?from=<start>&to=<end>: the clips overlapping
+    [start, end); both are optional
+    """
+    @method_decorator(json_login_required)
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            self.intervals = intervals.for_track(int(kwargs['pk']))
+        except Track.DoesNotExist:
+            raise Http404
+        return super(TrackIntervalsResource, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, pk, time=None):
+        try:
+            if time is not None:
+                indexes = self.intervals.at(float(time))
+            else:
+                indexes = self.intervals.overlapping(
+                    float(request.GET.get('from', 0)),
+                    float(request.GET.get('to', 'inf')))
+        except ValueError:
+            return bad_window()
+        return HttpResponse(self.intervals.serialize(indexes),
+                            content_type='application/json')
+
+class TrackBootstrapResource(View):
+    """Everything the editor needs to open a track, in one response:
+    the item and the track in Django's JSON serialization, and the
+    speakers and clips in the columnar format.  The clips can be
+    limited to a window with the parameters of `clip_window'."""
+
+    @method_decorator(json_login_required)
+    def get(self, request, pk):
+        track = get_object_or_404(Track.objects.select_related('item'), pk=pk)
+        try:
+            clips = clip_window(track.clip_set.all(), request.GET)
+        except ValueError:
+            return bad_window()
+        return columnar.stream_response(request, itertools.chain(
+                ['{"item":', serializers.serialize('json', [track.item]),
+                 ',"track":', serializers.serialize('json', [track]),
+                 ',"speakers":'],
+                columnar.serialize(track.speaker_set.all()),
+                [',"clips":'],
+                columnar.serialize(clips),
+                ['}']))
+
 # class SpeakerResource(SingleResource):
 #     model = Speaker
     
@@ -146,6 +547,12 @@ api_urls = patterns(
     url(r'^track/(?P<pk>\d+)/$', TrackResource.as_view()),
     url(r'^track/(?P<pk>\d+)/speakers/$', TrackSpeakersResource.as_view()),
     url(r'^track/(?P<pk>\d+)/clips/$', TrackClipsResource.as_view()),
+    url(r'^track/(?P<pk>\d+)/clips/sync/$', TrackClipsSyncResource.as_view()),
+    url(r'^track/(?P<pk>\d+)/transform/$', TrackTransformResource.as_view()),
+    url(r'^track/(?P<pk>\d+)/at/(?P<time>\d+(\.\d*)?)/$',
+        TrackIntervalsResource.as_view()),
+    url(r'^track/(?P<pk>\d+)/range/$', TrackIntervalsResource.as_view()),
+    url(r'^track/(?P<pk>\d+)/bootstrap/$', TrackBootstrapResource.as_view()),
 
     url(r'^item/(?P<pk>\d+)/$', ItemResource.as_view()),
     # url(r'^clip/(?P<pk>\d+)/$', ClipResource.as_view()),
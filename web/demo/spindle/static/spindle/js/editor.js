@@ -32,7 +32,26 @@ SPINDLE.Editor.prototype = {
  
     /* The item we are editing */
     item: undefined,
-    
+
+    /* Clips are kept in memory for a window around focusTime: the
+     * playback position, or the clip in the middle of the caption
+     * list when it is scrolled.  Clips are loaded prefetchMargin
+     * seconds either side of it (forwards pageSize at a time), and
+     * dropped once more than keepMargin seconds away, unless they
+     * have unsaved changes.
+     *
+     * All clips with intimes from loadedFrom to loadedTo are
+     * loaded.  loadedTo is null if none are, and Infinity if the
+     * range reaches the end of the track. */
+    pageSize: 500,
+    prefetchMargin: 120,
+    keepMargin: 600,
+    focusTime: 0,
+    loadedFrom: 0,
+    loadedTo: null,
+    loading: false,
+    allLoaded: false,
+
 
     /**
      * Setup procedures
@@ -49,39 +68,38 @@ SPINDLE.Editor.prototype = {
             .bind("timeupdate", $.proxy(Editor.callbacks.update, self))
             .get(0);
 
-        self.status("fetching item...");
-        item.fetch().success(function () {
-            self.status("fetching track...");
-            self.track.fetch().success(function () {
-                self.status("fetching speakers...");
-                self.track.get('speakers').fetch().success(success);
-                
-                function success () {
-                    self.status("fetching clips...");
-                    self.track.get('clips').fetch().success(success2);
-
-                    function success2 () {
-                        self.status("done!");
-
-                        // Make a default speaker if needed
-                        if(!self.track.get('speakers') || !self.track.get('speakers').length) {
-                            self.track.set('speakers', new SpeakerSet([{
-                                track: self.track,
-                                name: "Speaker 1"
-                            }]));
-                        }
-
-                        // Make empty captions if needed
-                        if(self.track.get('clips').length) {
-                            self.finishInit();
-                        } else {
-                            self.makeEmptyClips();
-                        }
-                    }
+        // Fetch the item, track, speakers and the first page of clips
+        // in one request
+        self.status("fetching transcript...");
+        $.getJSON(self.track.url() + 'bootstrap/', { limit: self.pageSize })
+            .success(function (data) {
+                var speakers = self.track.get('speakers'),
+                    clips = self.track.get('clips');
+
+                item.set(item.parse(data.item));
+                self.track.set(self.track.parse(data.track));
+                speakers.reset(speakers.parse(data.speakers), { parse: true });
+                clips.reset(clips.parse(data.clips), { parse: true });
+                self.setLoaded(0, clips.length < self.pageSize
+                               ? Infinity : clips.last().get('intime'));
+                self.editedCount = self.track.get('edited_clip_count') || 0;
+                self.status("done!");
+
+                // Make a default speaker if needed
+                if(!self.track.get('speakers') || !self.track.get('speakers').length) {
+                    self.track.set('speakers', new SpeakerSet([{
+                        track: self.track,
+                        name: "Speaker 1"
+                    }]));
+                }
+
+                // Make empty captions if needed
+                if(self.track.get('clips').length) {
+                    self.finishInit();
+                } else {
+                    self.makeEmptyClips();
                 }
             });
-            
-        });
     },
     
     makeEmptyClips: function () {
@@ -111,16 +129,15 @@ SPINDLE.Editor.prototype = {
                 });
                 intime += cliplength;
             }
+            self.setLoaded(0, Infinity);
             
             self.finishInit();
         }
     },
     
     finishInit: function () {
-        var Caption = SPINDLE.Caption,
-            Editor = SPINDLE.Editor,
-            self = this,
-            prevSpeaker = null;
+        var Editor = SPINDLE.Editor,
+            self = this;
 
         // Track changes
         self.track.get('speakers').on('change', dirty);
@@ -141,17 +158,9 @@ SPINDLE.Editor.prototype = {
         // Save changes before leaving
         $(window).bind('unload', $.proxy(self.save, self));
 
-        // Create editable caption views
-        this.track.get('clips').each(function(clip, i) {
-            var isSpeakerChange = (i == 0) || clip.get('speaker') !== prevSpeaker,            
-                caption = new Caption(self, clip, false, isSpeakerChange);
-
-            clip.caption = caption;
-            $("#captionList").append(caption.dom);
-            if(clip.get('edited')) self.editedCount++;
-
-            prevSpeaker = clip.get('speaker');
-        });
+        // Create editable caption views, and load more as needed
+        this.insertCaptions(this.track.get('clips').models);
+        $('#captionList').bind('scroll', $.proxy(Editor.callbacks.scroll, this));
 
         // Bind key events, button clicks
         $(document).bind("keydown", $.proxy(Editor.callbacks.keydown, this)); 
@@ -193,6 +202,171 @@ SPINDLE.Editor.prototype = {
         };
     }()),
     
+    /*
+     * Create caption views for `clips', in their places in the list
+     */
+    insertCaptions: function (clips) {
+        var self = this,
+            all = this.track.get('clips');
+
+        // Last first, so that the caption after each one exists
+        _.each(clips.slice().reverse(), function (clip) {
+            var idx = all.indexOf(clip),
+                prev = all.at(idx - 1),
+                next = all.at(idx + 1),
+                isSpeakerChange = !prev || clip.get('speaker') !== prev.get('speaker'),
+                caption = new SPINDLE.Caption(self, clip, false, isSpeakerChange);
+
+            clip.caption = caption;
+            if(next && next.caption) {
+                $(caption.dom).insertBefore(next.caption.dom);
+            } else {
+                $("#captionList").append(caption.dom);
+            }
+        });
+    },
+
+    /*
+     * Record that the clips with intimes from `from' to `to' are
+     * loaded (see loadedFrom)
+     */
+    setLoaded: function (from, to) {
+        this.loadedFrom = from;
+        this.loadedTo = to;
+        this.allLoaded = from <= 0 && to === Infinity;
+    },
+
+    /*
+     * Keep the clips within prefetchMargin seconds of focusTime
+     * loaded, and drop those more than keepMargin seconds away.
+     * Fetches one range at a time, until the window is loaded.
+     */
+    loadMore: function () {
+        var self = this,
+            clips = this.track.get('clips'),
+            start = Math.max(0, this.focusTime - this.prefetchMargin),
+            end = this.focusTime + this.prefetchMargin,
+            params;
+
+        if(this.loading || !clips) return;
+        this.evictFar();
+
+        if(this.loadedTo === null) {
+            params = { from: this.loadedFrom, limit: this.pageSize };
+        } else if(start < this.loadedFrom) {
+            params = { from: start, to: this.loadedFrom };
+        } else if(end > this.loadedTo) {
+            params = { after_intime: this.loadedTo, limit: this.pageSize };
+        } else {
+            return;
+        }
+
+        this.loading = true;
+        $.getJSON(clips.url(), _.extend({ format: 'columns' }, params))
+            .success(function (data) {
+                var objects = clips.parse(data),
+                    last = _.last(objects);
+
+                self.changeClips(function () {
+                    var wasDirty = self.dirty(), added;
+
+                    // Loaded clips are not edits, and clips already
+                    // loaded keep their unsaved changes
+                    clips.add(clips.unloaded(objects), { parse: true });
+                    added = clips.filter(function (clip) { return !clip.caption; });
+                    _.each(added, function (clip) { clip.dirty = false; });
+                    self.dirty(wasDirty);
+                    self.insertCaptions(added);
+                });
+
+                if(params.to !== undefined) {
+                    self.setLoaded(params.from, self.loadedTo);
+                } else {
+                    self.setLoaded(self.loadedFrom, objects.length < self.pageSize
+                                   ? Infinity : last.fields.intime);
+                }
+                self.loading = false;
+                self.updateStats();
+                self.loadMore();
+            })
+            .error(function () {
+                self.loading = false;
+            });
+    },
+
+    /*
+     * Drop the clips more than keepMargin seconds from focusTime,
+     * except those with unsaved changes.  If none of the loaded
+     * range is left, start again from the window around focusTime.
+     */
+    evictFar: function () {
+        var self = this,
+            clips = this.track.get('clips'),
+            keepFrom = this.focusTime - this.keepMargin,
+            keepTo = this.focusTime + this.keepMargin,
+            editing = this.editIdx() !== null && clips.at(this.editIdx()),
+            far;
+
+        if(this.loadedTo === null) return;
+        far = clips.filter(function (clip) {
+            var intime = clip.get('intime');
+            return (intime < keepFrom || intime > keepTo)
+                && !clip.dirty && !clip.isNew() && clip !== editing;
+        });
+
+        if(far.length) {
+            this.changeClips(function () {
+                _.each(far, function (clip) { $(clip.caption.dom).remove(); });
+                clips.evict(far);
+            });
+        }
+
+        if(keepFrom > this.loadedTo || keepTo < this.loadedFrom) {
+            this.setLoaded(Math.max(0, this.focusTime - this.prefetchMargin), null);
+        } else {
+            this.setLoaded(Math.max(this.loadedFrom, keepFrom),
+                           Math.min(this.loadedTo, keepTo));
+        }
+    },
+
+    /*
+     * Add or remove clips by calling `change', keeping the playing
+     * clip and the caption list in place
+     */
+    changeClips: function (change) {
+        var clips = this.track.get('clips'),
+            $list = $('#captionList'),
+            playing = clips.at(this.playIdx),
+            anchor = this.captionInView(),
+            before = anchor && this.captionPosition(anchor),
+            idx;
+
+        change();
+
+        idx = playing ? clips.indexOf(playing) : -1;
+        this.playIdx = idx === -1 ? 0 : idx;
+        this.justSelectedIdx = null;
+        if(anchor && anchor.clip.collection) {
+            $list.scrollTop($list.scrollTop() + this.captionPosition(anchor) - before);
+        }
+    },
+
+    /*
+     * The caption in the middle of the caption list, if any
+     */
+    captionInView: function () {
+        var $list = $('#captionList'),
+            offset = $list.offset(),
+            elem;
+
+        if(!offset) return null;
+        elem = document.elementFromPoint(
+            offset.left + $list.width() / 2 - $(window).scrollLeft(),
+            offset.top + $list.height() / 2 - $(window).scrollTop());
+        return elem && $.contains($list.get(0), elem)
+            ? SPINDLE.Caption.fromDOM(elem) : null;
+    },
+
     /*
      * Functions for manipulating the screen
      */
@@ -245,10 +419,12 @@ SPINDLE.Editor.prototype = {
     },
 
     updateStats: function() {
-        var percentage = 100 * this.editedCount / this.track.get('clips').length;
+        var clips = this.track.get('clips'),
+            total = this.allLoaded ? clips.length
+                : Math.max(clips.length, this.track.get('clip_count') || 0),
+            percentage = 100 * this.editedCount / total;
         $("#stats").html(sprintf("%d%% checked (%d of %d captions)",
-                                 percentage, this.editedCount,
-                                 this.track.get('clips').length));
+                                 percentage, this.editedCount, total));
     },
 
     playPause: function() {
@@ -483,8 +659,11 @@ SPINDLE.Editor.callbacks = {
      */
     update: function (ev) { 
         var playPos = this.player.currentTime,
-            curClip = this.track.get('clips') && this.track.get('clips').at(this.playIdx);
+            curClip;
 
+        this.focusTime = playPos;
+        this.loadMore();
+        curClip = this.track.get('clips') && this.track.get('clips').at(this.playIdx);
         if(!curClip) return;
 
         if(playPos >= curClip.get('intime') &&
@@ -493,7 +672,8 @@ SPINDLE.Editor.callbacks = {
         } else if(playPos > curClip.get('outtime')
                   && this.track.get('clips').at(this.playIdx+1)
                   && playPos > this.track.get('clips').at(this.playIdx+1).get('intime')) {
-            while(playPos > curClip.get('outtime')) {
+            while(playPos > curClip.get('outtime')
+                  && this.track.get('clips').at(this.playIdx+1)) {
                 this.playIdx++;
                 curClip = this.track.get('clips').at(this.playIdx);
             }
@@ -520,6 +700,15 @@ SPINDLE.Editor.callbacks = {
         }
     },
     
+    /*
+     * Caption list scrolled: load the clips around the ones in view
+     */
+    scroll: function (ev) {
+        var caption = this.captionInView();
+        if(caption) this.focusTime = caption.clip.get('intime');
+        this.loadMore();
+    },
+
     keydown: function(ev) {
         if(ev.keyCode == SPINDLE.TAB_KEY) {
             if(ev.shiftKey) {
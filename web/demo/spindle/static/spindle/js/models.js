@@ -92,6 +92,31 @@ var Clip = Backbone.RelationalModel.extend({
 });
 
 var SyncableCollection = Backbone.Collection.extend({
+    // Fetch in the compact columnar format
+    fetchColumns: function (options) {
+        return this.fetch(_.extend({ data: { format: 'columns' } }, options));
+    },
+
+    // Convert the columnar format to the usual list of serialized
+    // objects
+    parse: function (data) {
+        var objects = [];
+        if(!data || !data.chunks) return data;
+
+        _.each(data.chunks, function (columns) {
+            var i, j, fields;
+            for(i = 0; i < columns[0].length; i++) {
+                fields = {};
+                for(j = 1; j < data.fields.length; j++) {
+                    fields[data.fields[j]] = columns[j][i];
+                }
+                objects.push({ model: data.model, pk: columns[0][i],
+                               fields: fields });
+            }
+        });
+        return objects;
+    },
+
     save: function (options) {
         var self = this,
             newObjects = this.filter(function (obj) {
@@ -152,7 +177,93 @@ var ClipSet = SyncableCollection.extend({
     url: function () {
         return this.track && this.track.url() + 'clips/';
     },
-    comparator: function(clip) { return clip.get('intime'); }
+    comparator: function(clip) { return clip.get('intime'); },
+
+    initialize: function () {
+        this.removedIds = [];
+        this.on('remove', function (clip) {
+            if(!clip.isNew() && !this.evicting) this.removedIds.push(clip.id);
+        }, this);
+    },
+
+    // Drop `clips' from memory, without deleting them on the server.
+    // They are unregistered from the store so that they can be
+    // loaded again later.
+    evict: function (clips) {
+        this.evicting = true;
+        this.remove(clips);
+        this.evicting = false;
+        _.each(clips, function (clip) {
+            Backbone.Relational.store.unregister(clip);
+        });
+    },
+
+    // Of the serialized clips `objects', those which are neither
+    // loaded already nor deleted since the last save
+    unloaded: function (objects) {
+        var self = this;
+        return _.filter(objects, function (obj) {
+            return !self.get(obj.pk) && !_.include(self.removedIds, obj.pk);
+        });
+    },
+
+    // Send only the clips which were added, changed (marked `dirty'
+    // by the editor) or removed since the last save
+    save: function (options) {
+        var self = this,
+            created = this.filter(function (clip) {
+                return clip.isNew();
+            }),
+            updated = this.filter(function (clip) {
+                return clip.dirty && !clip.isNew();
+            }),
+            deleted = this.removedIds;
+
+        this.removedIds = [];
+        _.each(created.concat(updated), function (clip) {
+            clip.dirty = false;
+        });
+
+        $.ajax({ type: 'POST',
+                 url: self.url() + 'sync/',
+                 processData: false,
+                 contentType: 'application/json',
+                 data: JSON.stringify({
+                     create: _.invoke(created, 'toJSON'),
+                     update: _.invoke(updated, 'toJSON'),
+                     'delete': deleted
+                 }),
+                 success: success,
+                 error: error
+               });
+
+        function success(result) {
+            _.each(created, function (clip, i) {
+                // Setting the server's fields (the new pk) fires
+                // 'change', which the editor takes as an edit
+                var wasDirty = clip.dirty;
+                clip.set(clip.parse(result.created[i]));
+                clip.dirty = wasDirty;
+            });
+
+            self.trigger('sync');
+            if(options && _.has(options, 'success')
+               && _.isFunction(options.success)) {
+                options.success.call(this);
+            }
+        }
+
+        function error () {
+            self.removedIds = deleted.concat(self.removedIds);
+            _.each(created.concat(updated), function (clip) {
+                clip.dirty = true;
+            });
+            if(options && _.has(options, 'error')
+               && _.isFunction(options.error)) {
+                options.error.call(this);
+            }
+        }
+    }
 });
 
 var SpeakerSet = SyncableCollection.extend({
@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.core.cache import cache
 
 from celery import task, current_task
 from celery.utils.log import get_task_logger
@@ -81,6 +82,28 @@ def scrape():
         for item in newitems:
             item.request_transcription(engine_name=DEFAULT_TRANSCRIPTION_ENGINE)
 
+#
+# Task: Recompute the cached keywords for a track after it is edited
+#
+@task(name='spindle.refresh_keywords', queue='local', ignore_result=True)
+def refresh_keywords(track_id):
+    cache.delete(spindle.models.Track.keyword_refresh_key(track_id))
+    try:
+        track = spindle.models.Track.objects.get(pk=track_id)
+    except spindle.models.Track.DoesNotExist:
+        return
+    if track.keywords_stale:
+        track.refresh_keyword_cache()
+
+@task(name='spindle.archive_item', queue='local', ignore_result=True)
+def archive_item(item_id):
+    cache.delete(spindle.models.Item.archive_key(item_id))
+    try:
+        item = spindle.models.Item.objects.get(pk=item_id)
+    except spindle.models.Item.DoesNotExist:
+        return
+    item.archive_now()
+
 @task
 def ping():
     request = current_task.request
@@ -5,7 +5,37 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import json
+import zlib
+import logging
+import random
+import os
+import glob
+import urlparse
+import StringIO
+import datetime
+import shutil
+import tempfile
+import cPickle as pickle
+import xml.etree.ElementTree as ET
+
 from django.test import TestCase
+from django.utils import unittest
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+
+from spindle import models, versions, tasks, columnar, transforms, intervals, \
+    render_cache, writers, publish
+from spindle.models import Item, Track, Clip, Speaker
+from spindle.transcribe.save import save_transcription
+from spindle.writers import html as html_writer, vtt as vtt_writer
+
+from spindle.keywords import keywords as reference
+from spindle.keywords import engine
+from spindle.keywords import bnc
 
 
 class SimpleTest(TestCase):
@@ -14,3 +44,1023 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+def sample_transcript(n_words, seed=0):
+    """Return a list of caption lines with a skewed word distribution."""
+    rand = random.Random(seed)
+    vocabulary = (['the', 'and', 'of', 'we', 'that', 'is'] * 8 +
+                  ['lecture', 'quantum', 'entanglement', 'photon',
+                   'oxford', 'spectrum', 'measurement', 'qubit',
+                   'decoherence', 'experiment', 'woods', 'river'] * 3 +
+                  ['lecture', 'quantum', 'photon'] * 6 +
+                  ['x-ray', '1920s', 'Quantum', 'PHOTON', 'ab'])
+    lines = []
+    while n_words > 0:
+        length = min(n_words, rand.randint(4, 12))
+        lines.append(u' '.join(rand.choice(vocabulary) for _ in range(length)))
+        n_words -= length
+    return lines
+
+
+class KeywordEngineTest(unittest.TestCase):
+    """The vectorized keyword engine agrees with the reference implementation."""
+
+    def assertEquivalent(self, text, **kwargs):
+        ref_keywords, ref_bigrams = reference.keywords_and_ngrams(text, **kwargs)
+        keywords, bigrams = engine.keywords_and_ngrams(text, **kwargs)
+
+        self.assertEqual(len(keywords), len(ref_keywords))
+        self.assertEqual(dict((k, round(ll, 6)) for k, ll in keywords),
+                         dict((k, round(ll, 6)) for k, ll in ref_keywords))
+        self.assertEqual(bigrams, ref_bigrams)
+
+    def test_equivalence(self):
+        for n_words in (0, 10, 1000, 10000):
+            self.assertEquivalent(sample_transcript(n_words, seed=n_words))
+
+    def test_single_string(self):
+        self.assertEquivalent(str(' '.join(sample_transcript(500))))
+
+    def test_limits_and_thresholds(self):
+        text = sample_transcript(5000, seed=1)
+        self.assertEquivalent(text, nKeywords=3, thresholdLL=0,
+                              nBigrams=4, thresholdBigrams=0)
+        self.assertEquivalent(text, thresholdLL=1e6, thresholdBigrams=1e6)
+
+    def test_line_counts(self):
+        counts = engine.TermCounts.from_lines([u'Quantum photon', u'photon quantum'])
+        terms, bigrams, total = counts.as_dicts()
+        self.assertEqual(terms, {u'quantum': 2, u'photon': 2})
+        self.assertEqual(bigrams, {(u'quantum', u'photon'): 1,
+                                   (u'photon', u'quantum'): 1})
+        self.assertEqual(total, 4)
+
+    def test_counts_round_trip(self):
+        text = sample_transcript(5000, seed=2)
+        counts = engine.TermCounts.from_lines(text)
+        copy = engine.TermCounts.from_dicts(*counts.as_dicts())
+        self.assertEqual(engine.keywords_from_counts(copy),
+                         engine.keywords_from_counts(counts))
+
+    def test_keywords_sorted(self):
+        keywords, bigrams = engine.keywords_and_ngrams(sample_transcript(2000))
+        scores = [ll for _, ll in keywords]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+
+class BNCStoreTest(unittest.TestCase):
+    """The memory-mapped BNC table matches the legacy pickle."""
+
+    def test_matches_pickle(self):
+        with open(bnc.BNCfile, 'rb') as infile:
+            fdist = pickle.load(infile)
+        words = sorted(fdist)
+        self.assertEqual(list(bnc.frequencies(words)),
+                         [fdist[word] for word in words])
+        self.assertEqual(len(bnc.fdistBNC), len(fdist))
+
+    def test_unknown_words(self):
+        self.assertEqual(list(bnc.frequencies([u'woods', u'qwzxq', u'',
+                                               u'x' * 200])),
+                         [110, 0, 0, 0])
+        self.assertEqual(bnc.fdistBNC.get('qwzxq'), None)
+        self.assertFalse('qwzxq' in bnc.fdistBNC)
+        self.assertEqual(bnc.fdistBNC['woods'], 110)
+
+
+def make_item(duration=40):
+    return Item.objects.create(name='Test lecture', duration=duration,
+                               published=timezone.make_aware(
+                                   datetime.datetime(2013, 1, 1), timezone.utc))
+
+
+class ArchiveNowMixin(object):
+    """Archive a version on each save rather than in a Celery task
+    (see ARCHIVE_DELAY), so that tests do not depend on
+    CELERY_ALWAYS_EAGER."""
+
+    def setUp(self):
+        self.archive_delay = models.ARCHIVE_DELAY
+        models.ARCHIVE_DELAY = 0
+        super(ArchiveNowMixin, self).setUp()
+
+    def tearDown(self):
+        models.ARCHIVE_DELAY = self.archive_delay
+        super(ArchiveNowMixin, self).tearDown()
+
+
+class CountersTest(ArchiveNowMixin, TestCase):
+    """The stored clip and track counts follow changes to the data."""
+
+    def setUp(self):
+        super(CountersTest, self).setUp()
+        User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.client.login(username='editor', password='secret')
+        self.item = make_item()
+
+    def reload(self, obj):
+        return type(obj).objects.get(pk=obj.pk)
+
+    def clips_url(self, track):
+        return '/spindle/REST/track/{}/clips/'.format(track.id)
+
+    def test_empty_track(self):
+        track = Track.empty(self.item)
+        track = self.reload(track)
+        self.assertEqual((track.clip_count, track.edited_clip_count), (10, 0))
+        self.assertEqual(self.reload(self.item).track_count, 1)
+        contents = self.item.versions.latest('id').contents()
+        self.assertEqual(len([obj for obj in contents
+                              if obj['model'] == 'spindle.clip']), 10)
+
+    def test_save_transcription(self):
+        clips = [Clip(intime=i, outtime=i + 1, caption_text=u'word',
+                      edited=(i % 2 == 0)) for i in range(5)]
+        save_transcription(self.item, clips,
+                           logger=logging.getLogger(__name__))
+        track = self.item.track_set.get()
+        self.assertEqual((track.clip_count, track.edited_clip_count), (5, 3))
+        self.assertEqual(self.reload(self.item).track_count, 1)
+
+    def test_rest_collection(self):
+        track = Track.empty(self.item)
+        clips = [{'intime': i, 'outtime': i + 1, 'caption_text': u'word',
+                  'edited': i < 2} for i in range(3)]
+        response = self.client.put(self.clips_url(track), json.dumps(clips),
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        track = self.reload(track)
+        self.assertEqual((track.clip_count, track.edited_clip_count), (3, 2))
+
+        response = self.client.post(self.clips_url(track), json.dumps(
+                {'intime': 5, 'outtime': 6, 'caption_text': u'new',
+                 'edited': True}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        track = self.reload(track)
+        self.assertEqual((track.clip_count, track.edited_clip_count), (4, 3))
+
+    def test_revert(self):
+        Track.empty(self.item)
+        self.item.archive()
+        version = self.item.versions.latest('id')
+        Track.empty(self.item)
+        self.assertEqual(self.reload(self.item).track_count, 2)
+        versions_before = self.item.versions.count()
+        version.revert()
+        self.assertEqual(self.item.versions.count(), versions_before + 1)
+        self.assertEqual(self.reload(self.item).track_count, 1)
+        track = self.item.track_set.get()
+        self.assertEqual(track.clip_count, 10)
+
+    def test_recount(self):
+        track = Track.empty(self.item)
+        Track.objects.filter(pk=track.pk).update(clip_count=0, edited_clip_count=7)
+        Item.objects.filter(pk=self.item.pk).update(track_count=0)
+        call_command('spindle_recount')
+        track = self.reload(track)
+        self.assertEqual((track.clip_count, track.edited_clip_count), (10, 0))
+        self.assertEqual(self.reload(self.item).track_count, 1)
+
+
+class ArchiveStorageTest(ArchiveNowMixin, TestCase):
+    """Versions stored as keyframes and deltas reconstruct exactly."""
+
+    def setUp(self):
+        super(ArchiveStorageTest, self).setUp()
+        self.interval = models.ARCHIVE_KEYFRAME_INTERVAL
+        models.ARCHIVE_KEYFRAME_INTERVAL = 3
+
+    def tearDown(self):
+        models.ARCHIVE_KEYFRAME_INTERVAL = self.interval
+        super(ArchiveStorageTest, self).tearDown()
+
+    def snapshot(self, item):
+        return self.without_times(json.loads(item.serialize('json')))
+
+    def without_times(self, objects):
+        for obj in objects:
+            obj['fields'].pop('updated', None)
+        return sorted(objects, key=versions.sort_key)
+
+    def test_delta_round_trip(self):
+        old = [{'model': 'spindle.clip', 'pk': pk,
+                'fields': {'caption_text': u'clip %d' % pk}} for pk in range(5)]
+        new = [dict(obj) for obj in old[1:]]
+        new[0]['fields'] = {'caption_text': u'changed'}
+        new.append({'model': 'spindle.clip', 'pk': 9, 'fields': {}})
+        delta = versions.make_delta(old, new)
+        self.assertEqual(len(delta['changed']), 2)
+        self.assertEqual(delta['deleted'], [['spindle.clip', 0]])
+        self.assertEqual(versions.apply_delta(old, versions.unpack(
+                    versions.pack(delta))), new)
+
+    def test_versions(self):
+        item = make_item()
+        track = Track.empty(item)
+        snapshots = {}
+        for n in range(7):
+            clip = track.clip_set.order_by('intime')[n]
+            clip.caption_text = u'edit %d' % n
+            clip.save()
+            if n == 4: clip.delete()
+            item.archive()
+            snapshots[item.versions.latest('id').id] = self.snapshot(item)
+
+        storage = [version.storage for version in item.versions.order_by('id')]
+        self.assertEqual(storage, ['keyframe', 'delta', 'delta'] * 3)
+        for version in item.versions.all():
+            if version.id in snapshots:
+                self.assertEqual(self.without_times(version.contents()),
+                                 snapshots[version.id])
+
+        # Revert to a delta version
+        version = item.versions.order_by('id')[5]
+        version.revert()
+        self.assertEqual(self.snapshot(item), snapshots[version.id])
+
+    def test_revert_item_fields(self):
+        item = make_item()
+        version = item.versions.latest('id')
+        item.name = 'Renamed'
+        item.save()
+        version.revert()
+        self.assertEqual(Item.objects.get(pk=item.pk).name, 'Test lecture')
+        latest = item.versions.latest('id')
+        self.assertNotEqual(latest.id, version.id)
+        self.assertEqual(self.without_times(latest.contents()),
+                         self.without_times(version.contents()))
+
+
+class ArchiveDebounceTest(TestCase):
+    """Saves are archived in the background, once per burst."""
+
+    def test_unchanged_content(self):
+        delay, models.ARCHIVE_DELAY = models.ARCHIVE_DELAY, 0
+        try:
+            item = make_item()
+            self.assertEqual(item.versions.count(), 1)
+            item.save()
+            self.assertEqual(item.versions.count(), 1)
+            item.name = 'Renamed'
+            item.save()
+            self.assertEqual(item.versions.count(), 2)
+        finally:
+            models.ARCHIVE_DELAY = delay
+
+    def test_burst(self):
+        item = make_item()
+        track = Track.empty(item)
+        versions_before = item.versions.count()
+
+        # While an archive is queued, further saves queue nothing
+        cache.add(Item.archive_key(item.pk), True)
+        for name in ('One', 'Two', 'Three'):
+            track.name = name
+            track.save()
+        self.assertEqual(item.versions.count(), versions_before)
+
+        tasks.archive_item(item.pk)
+        self.assertEqual(item.versions.count(), versions_before + 1)
+        self.assertFalse(cache.get(Item.archive_key(item.pk)))
+        self.assertIn('"Three"', json.dumps(item.versions.latest('id').contents()))
+
+
+class DiffTest(ArchiveNowMixin, TestCase):
+    """Clip-level diffs of item versions."""
+
+    def clip(self, pk, intime, text, track=1):
+        return {'model': 'spindle.clip', 'pk': pk,
+                'fields': {'track': track, 'intime': intime,
+                           'outtime': intime + 4, 'caption_text': text,
+                           'speaker': None, 'edited': False}}
+
+    def test_align_clips(self):
+        track = {'model': 'spindle.track', 'pk': 1,
+                 'fields': {'item': 1, 'name': u'Transcript'}}
+        old = [track, self.clip(1, 0.0, u'one'), self.clip(2, 4.0, u'two'),
+               self.clip(3, 8.0, u'three'), self.clip(4, 12.0, u'four')]
+        # Clip 2 edited, 3 recreated unchanged under a new key, 4
+        # recreated with new text, 5 inserted
+        new = [track, self.clip(1, 0.0, u'one'), self.clip(2, 4.0, u'too'),
+               self.clip(13, 8.0, u'three'), self.clip(14, 12.0, u'for'),
+               self.clip(15, 16.0, u'five')]
+        lines = list(versions.diff(old, new))
+        self.assertEqual([line[0] for line in lines[1:]],
+                         ['-', '+', '-', '+', '+'])
+        self.assertIn(u'too', lines[2])
+        self.assertIn(u'for', lines[4])
+        self.assertIn(u'five', lines[5])
+        self.assertEqual(list(versions.diff(old, old)), [])
+
+    def test_cached(self):
+        item = make_item()
+        track = Track.empty(item)
+        clip = track.clip_set.order_by('intime')[0]
+        clip.caption_text = u'hello'
+        clip.save()
+        item.archive()
+        version = item.versions.latest('id')
+
+        lines = list(version.diff())
+        self.assertTrue(any(u'hello' in line for line in lines))
+        self.assertEqual(list(version.diff()), lines)
+
+        User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.client.login(username='editor', password='secret')
+        response = self.client.get('/item/diff/{}/'.format(version.id))
+        self.assertEqual(response.content, u''.join(lines).encode('utf-8'))
+
+
+class ClipSyncTest(TestCase):
+    """The clip delta sync endpoint applies creates, updates and deletes."""
+
+    def setUp(self):
+        User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.client.login(username='editor', password='secret')
+        self.track = Track.empty(make_item(duration=20))
+
+    def sync(self, changes):
+        return self.client.post(
+            '/spindle/REST/track/{}/clips/sync/'.format(self.track.id),
+            json.dumps(changes), content_type='application/json')
+
+    def test_sync(self):
+        clips = list(self.track.clip_set.order_by('intime'))
+        other = Track.empty(make_item()).clip_set.all()[0]
+        response = self.sync({
+                'create': [{'intime': 20, 'outtime': 24, 'edited': True,
+                            'caption_text': u'new clip', 'pk': None}],
+                'update': [{'pk': clips[0].pk, 'caption_text': u'edited',
+                            'edited': True},
+                           {'pk': other.pk, 'caption_text': u'not mine'}],
+                'delete': [clips[1].pk]})
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertEqual(len(result['created']), 1)
+        self.assertEqual([clip['pk'] for clip in result['updated']], [clips[0].pk])
+        self.assertEqual(result['deleted'], [clips[1].pk])
+
+        track = Track.objects.get(pk=self.track.pk)
+        self.assertEqual((track.clip_count, track.edited_clip_count), (5, 2))
+        self.assertEqual(track.clip_set.get(pk=clips[0].pk).caption_text, u'edited')
+        self.assertFalse(track.clip_set.filter(pk=clips[1].pk).exists())
+        self.assertEqual(Clip.objects.get(pk=other.pk).caption_text, u'')
+        self.assertEqual(track.content_version, self.track.content_version + 1)
+
+    def test_speakers_then_sync(self):
+        # The editor saves the speakers before syncing the clips
+        speakers = [Speaker.objects.create(track=self.track, name=name)
+                    for name in (u'One', u'Two')]
+        self.track.clip_set.update(speaker=speakers[0])
+        self.track.clip_set.filter(intime__gte=10).update(speaker=speakers[1])
+        response = self.client.put(
+            '/spindle/REST/track/{}/speakers/'.format(self.track.id),
+            json.dumps([{'pk': speakers[0].pk, 'name': u'Renamed'},
+                        {'pk': None, 'name': u'Three'}]),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sync({}).status_code, 200)
+
+        track = Track.objects.get(pk=self.track.pk)
+        self.assertEqual(track.clip_set.count(), 5)
+        self.assertEqual(track.clip_count, 5)
+        self.assertEqual(track.clip_set.filter(speaker=speakers[0]).count(), 3)
+        self.assertEqual(track.clip_set.filter(speaker=None).count(), 2)
+        self.assertEqual(sorted(track.speaker_set.values_list('name', flat=True)),
+                         [u'Renamed', u'Three'])
+
+    def test_update_speaker(self):
+        # The editor sends every field of a changed clip, including
+        # the speaker by its key
+        speaker = Speaker.objects.create(track=self.track, name=u'One')
+        clips = list(self.track.clip_set.order_by('intime'))
+        response = self.sync({'update': [
+                    {'pk': clip.pk, 'track': self.track.pk,
+                     'intime': clip.intime, 'outtime': clip.outtime,
+                     'caption_text': u'spoken', 'edited': True,
+                     'speaker_id': speaker_id}
+                    for clip, speaker_id in ((clips[0], speaker.pk),
+                                             (clips[1], None))]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.track.clip_set.get(pk=clips[0].pk).speaker, speaker)
+        self.assertEqual(self.track.clip_set.get(pk=clips[1].pk).speaker, None)
+        self.assertEqual(self.track.clip_set.filter(caption_text=u'spoken').count(), 2)
+
+    def test_bulk(self):
+        clips = list(self.track.clip_set.order_by('intime'))
+        creates = [{'intime': 20 + n, 'outtime': 21 + n, 'edited': False,
+                    'caption_text': u'new %d' % n} for n in range(150)]
+        # Two new clips at the same time come back in the order given
+        creates.append(dict(creates[0], caption_text=u'same time'))
+        connection.use_debug_cursor = True
+        try:
+            start = len(connection.queries)
+            response = self.sync({
+                    'create': creates,
+                    'update': [{'pk': clip.pk, 'edited': True}
+                               for clip in clips]})
+            writes = [query['sql'] for query in connection.queries[start:]
+                      if query['sql'].startswith(('INSERT INTO "spindle_clip"',
+                                                  'UPDATE "spindle_clip"'))]
+        finally:
+            connection.use_debug_cursor = None
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(writes), 3)
+
+        created = json.loads(response.content)['created']
+        self.assertEqual([clip['fields']['caption_text'] for clip in created],
+                         [fields['caption_text'] for fields in creates])
+        for clip in created:
+            self.assertEqual(Clip.objects.get(pk=clip['pk']).caption_text,
+                             clip['fields']['caption_text'])
+        track = Track.objects.get(pk=self.track.pk)
+        self.assertEqual((track.clip_count, track.edited_clip_count), (156, 5))
+
+    def test_malformed(self):
+        response = self.sync({'update': [{'caption_text': u'no key'}]})
+        self.assertEqual(response.status_code, 400)
+
+
+class SingleResourceTest(ArchiveNowMixin, TestCase):
+    """PUTs write changed fields only; GETs and PUTs are conditional."""
+
+    def setUp(self):
+        super(SingleResourceTest, self).setUp()
+        User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.client.login(username='editor', password='secret')
+        self.track = Track.empty(make_item())
+        self.url = '/spindle/REST/track/{}/'.format(self.track.id)
+
+    def put(self, data, **headers):
+        data = dict(data, pk=self.track.pk)
+        return self.client.put(self.url, json.dumps(data),
+                               content_type='application/json', **headers)
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        self.put({'name': 'Renamed'})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_put(self):
+        etag = self.client.get(self.url)['ETag']
+        versions_before = self.track.item.versions.count()
+
+        # Nothing changed: no write, no new version
+        response = self.put({'name': self.track.name, 'lang': 'en'},
+                            HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.track.item.versions.count(), versions_before)
+
+        response = self.put({'name': 'Renamed', 'lang': 'en'},
+                            HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(Track.objects.get(pk=self.track.pk).name, 'Renamed')
+        self.assertEqual(self.track.item.versions.count(), versions_before + 1)
+
+        # Stale ETag
+        response = self.put({'name': 'Again'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(Track.objects.get(pk=self.track.pk).name, 'Renamed')
+
+    def test_put_foreign_key(self):
+        item = make_item()
+        response = self.put({'item_id': item.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)[0]['fields']['item'], item.pk)
+        self.assertEqual(Track.objects.get(pk=self.track.pk).item, item)
+        self.assertIn(['spindle.track', self.track.pk],
+                      [[obj['model'], obj['pk']]
+                       for obj in item.versions.latest('id').contents()])
+
+
+class ColumnarTest(TestCase):
+    """The columnar format holds the same data as Django's serializer."""
+
+    def setUp(self):
+        User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.client.login(username='editor', password='secret')
+        self.track = Track.empty(make_item(duration=40))
+        self.url = '/spindle/REST/track/{}/clips/'.format(self.track.id)
+
+    def rows(self, data):
+        objects = []
+        for columns in data['chunks']:
+            for values in zip(*columns):
+                objects.append({'model': data['model'], 'pk': values[0],
+                                'fields': dict(zip(data['fields'][1:], values[1:]))})
+        return objects
+
+    def test_columns(self):
+        expected = json.loads(self.client.get(self.url).content)
+        self.assertEqual(len(expected), 10)
+
+        data = json.loads(self.client.get(self.url, {'format': 'columns'}).content)
+        self.assertEqual(self.rows(data), expected)
+
+        columnar.CHUNK_SIZE, chunk_size = 3, columnar.CHUNK_SIZE
+        try:
+            response = self.client.get(self.url, {'format': 'columns'},
+                                       HTTP_ACCEPT_ENCODING='gzip, deflate')
+            content = ''.join(response)
+        finally:
+            columnar.CHUNK_SIZE = chunk_size
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = json.loads(zlib.decompress(content, zlib.MAX_WBITS | 16))
+        self.assertEqual(len(data['chunks']), 4)
+        self.assertEqual(self.rows(data), expected)
+
+    def test_window(self):
+        def intimes(**params):
+            response = self.client.get(self.url, params)
+            return [clip['fields']['intime'] for clip in json.loads(response.content)]
+
+        self.assertEqual(intimes(**{'from': 8, 'to': 20}), [8.0, 12.0, 16.0])
+        self.assertEqual(intimes(after_intime=8, limit=2), [12.0, 16.0])
+        self.assertEqual(intimes(after_intime=36, limit=2), [])
+        data = json.loads(self.client.get(
+                self.url, {'format': 'columns', 'limit': 3}).content)
+        self.assertEqual([row['fields']['intime'] for row in self.rows(data)],
+                         [0.0, 4.0, 8.0])
+        self.assertEqual(self.client.get(self.url, {'limit': 'x'}).status_code, 400)
+
+    def test_bootstrap(self):
+        url = '/spindle/REST/track/{}/bootstrap/'.format(self.track.id)
+        # Session, user, track and item, speakers, clips
+        with self.assertNumQueries(5):
+            data = json.loads(self.client.get(url).content)
+        self.assertEqual(data['item'][0]['pk'], self.track.item.pk)
+        self.assertEqual(data['track'][0]['pk'], self.track.pk)
+        self.assertEqual(self.rows(data['speakers']), [])
+        self.assertEqual(self.rows(data['clips']),
+                         json.loads(self.client.get(self.url).content))
+
+
+class TransformTest(ArchiveNowMixin, TestCase):
+    """Bulk clip transforms keep derived data up to date and archive once."""
+
+    def setUp(self):
+        super(TransformTest, self).setUp()
+        self.item = make_item(duration=40)
+        self.track = Track.empty(self.item)
+        clips = list(self.track.clip_set.order_by('intime'))
+        words = u'alpha bravo charlie delta echo foxtrot golf hotel india juliet'
+        for word, clip in zip(words.split(), clips):
+            clip.caption_text = u'{} kilo'.format(word)
+            clip.save()
+        # Clip.save() leaves the term index alone
+        models.TermIndex.objects.filter(track=self.track).delete()
+        self.item.archive_now()
+
+    def times(self):
+        return list(self.track.clip_set.order_by('intime')
+                    .values_list('intime', 'outtime'))
+
+    def reload(self):
+        return Track.objects.get(pk=self.track.pk)
+
+    def test_shift_and_rescale(self):
+        versions_before = self.item.versions.count()
+        self.assertEqual(transforms.run(self.track, 'shift', offset=2, after=28), 3)
+        self.assertEqual(self.times()[-3:], [(30.0, 34.0), (34.0, 38.0), (38.0, 42.0)])
+        self.assertEqual(self.item.versions.count(), versions_before + 1)
+
+        transforms.run(self.track, 'rescale', 0.5, 4)
+        self.assertEqual(self.times()[:3], [(2.0, 4.0), (4.0, 6.0), (6.0, 8.0)])
+        self.assertEqual(self.item.versions.count(), versions_before + 2)
+        self.assertRaises(ValueError, transforms.run, self.track, 'shift', -10)
+
+    def test_merge(self):
+        Clip.objects.filter(track=self.track, intime=4).update(outtime=5)
+        Clip.objects.filter(track=self.track, intime=8).update(intime=5)
+        self.track.term_counts()
+        self.assertEqual(transforms.run(self.track, 'merge', min_duration=2), 2)
+        first = self.track.clip_set.order_by('intime')[0]
+        self.assertEqual((first.intime, first.outtime), (0.0, 5.0))
+        self.assertEqual(first.caption_text, u'alpha kilo bravo kilo')
+        track = self.reload()
+        self.assertEqual(track.clip_count, 9)
+        self.assertEqual(track.term_counts().as_dicts(), models.TermCounts.from_lines(
+                track.clip_set.values_list('caption_text', flat=True)).as_dicts())
+
+    def test_split(self):
+        self.assertEqual(transforms.run(self.track, 'split', max_time=2), 20)
+        self.assertEqual(self.times()[:3], [(0.0, 2.0), (2.0, 4.0), (4.0, 6.0)])
+        texts = self.track.clip_set.order_by('intime').values_list(
+            'caption_text', flat=True)
+        self.assertEqual(list(texts[:2]), [u'alpha', u'kilo'])
+        self.assertEqual(self.reload().clip_count, 20)
+
+    def test_endpoint(self):
+        User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.client.login(username='editor', password='secret')
+        url = '/spindle/REST/track/{}/transform/'.format(self.track.id)
+        response = self.client.post(url, json.dumps(
+                {'operation': 'shift', 'offset': 1}),
+                                    content_type='application/json')
+        self.assertEqual(json.loads(response.content),
+                         {'operation': 'shift', 'changed': 10})
+        for bad in ({'operation': 'rotate'}, {'operation': 'split'},
+                    {'operation': 'shift', 'offset': 'x'}):
+            response = self.client.post(url, json.dumps(bad),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        call_command('spindle_transform', str(self.track.id), 'shift', '-1')
+        self.assertEqual(self.times()[0], (0.0, 4.0))
+
+
+class IntervalsTest(TestCase):
+    """Clips by playback time, from the in-memory interval lookup."""
+
+    def setUp(self):
+        User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.client.login(username='editor', password='secret')
+        self.track = Track.empty(make_item(duration=40))
+        intervals.clear()
+
+    def get(self, path, **params):
+        response = self.client.get('/spindle/REST/track/{}/{}'.format(
+                self.track.id, path), params)
+        return [clip['fields']['intime'] for clip in json.loads(response.content)]
+
+    def test_lookup(self):
+        Clip.objects.create(track=self.track, intime=2, outtime=13,
+                            caption_text=u'long', edited=False, begin_para=False)
+        self.track.content_changed()
+
+        self.assertEqual(self.get('at/0/'), [0.0])
+        self.assertEqual(self.get('at/4/'), [2.0, 4.0])
+        self.assertEqual(self.get('at/12.5/'), [2.0, 12.0])
+        self.assertEqual(self.get('at/99/'), [])
+        self.assertEqual(self.get('range/', **{'from': 13, 'to': 20}),
+                         [12.0, 16.0])
+        self.assertEqual(len(self.get('range/')), 11)
+        self.assertEqual(self.client.get('/spindle/REST/track/{}/range/'.format(
+                    self.track.id), {'to': 'x'}).status_code, 400)
+
+    def test_cached(self):
+        self.get('at/0/')
+        # Track and session queries only
+        with self.assertNumQueries(3):
+            self.get('at/4/')
+
+        self.client.post('/spindle/REST/track/{}/transform/'.format(self.track.id),
+                         json.dumps({'operation': 'shift', 'offset': 1}),
+                         content_type='application/json')
+        self.assertEqual(self.get('at/4/'), [1.0])
+
+
+class RenderCacheTest(TestCase):
+    """Exports are rendered once per version of a track."""
+
+    def setUp(self):
+        User.objects.create_user('editor', 'editor@example.com', 'secret')
+        self.client.login(username='editor', password='secret')
+        self.track = Track.empty(make_item(duration=8))
+        cache.clear()
+
+    def test_export_views(self):
+        url = '/track/{}/text/'.format(self.track.id)
+        clip = self.track.clip_set.all()[0]
+        Clip.objects.filter(pk=clip.pk).update(caption_text=u'caf\xe9')
+        self.assertIn(u'caf\xe9'.encode('utf-8'), self.client.get(url).content)
+
+        # Session, user, and track with item: no clip query
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+        self.client.post(
+            '/spindle/REST/track/{}/clips/sync/'.format(self.track.id),
+            json.dumps({'update': [{'pk': clip.pk, 'caption_text': u'tea'}]}),
+            content_type='application/json')
+        self.assertIn('tea', self.client.get(url).content)
+
+        for format in ('xml', 'vtt', 'html'):
+            response = self.client.get('/track/{}/{}/'.format(self.track.id, format))
+            self.assertEqual(response.status_code, 200)
+
+    def test_item_change(self):
+        track = Track.objects.select_related('item').get(pk=self.track.pk)
+        key = render_cache.render_key(track, 'html')
+        track.item.name = 'Renamed'
+        track.item.save()
+        track = Track.objects.select_related('item').get(pk=self.track.pk)
+        self.assertNotEqual(render_cache.render_key(track, 'html'), key)
+        self.assertIn('Renamed', render_cache.render(track, 'html'))
+
+
+class ExportWritersTest(TestCase):
+    """Export writers stream from one query over the clips."""
+
+    def setUp(self):
+        self.track = Track.empty(make_item(duration=12))
+        alice = self.track.speaker_set.create(name=u'Alice')
+        bob = self.track.speaker_set.create(name=u'Bob')
+        for clip, speaker, text, begin_para in zip(
+                self.track.clip_set.order_by('intime'), (alice, alice, bob),
+                (u'Hello', u'fish & chips', u'caf\xe9'), (False, False, True)):
+            Clip.objects.filter(pk=clip.pk).update(
+                speaker=speaker, caption_text=text, begin_para=begin_para)
+
+    def test_plaintext(self):
+        with self.assertNumQueries(1):
+            text = u''.join(self.track.iter_export('txt'))
+        self.assertEqual(text, u'ALICE: Hello fish & chips \n\nBOB: caf\xe9 ')
+
+    def test_html(self):
+        with self.assertNumQueries(1):
+            body = u''.join(writers.generate(html_writer.HTMLWriter(),
+                                             self.track.export_clips()))
+        self.assertEqual(body, u'<div><p><span class="speaker">Alice: </span>'
+                         u'Hello fish &amp; chips </p><p><span class="speaker">'
+                         u'Bob: </span>caf\xe9 </p></div>')
+        self.assertIn(body, u''.join(self.track.iter_export('html')))
+
+    def test_xml_and_vtt(self):
+        root = ET.fromstring(u''.join(self.track.iter_export('xml')).encode('utf-8'))
+        self.assertEqual([len(para) for para in root], [2, 1])
+        self.assertEqual(root[0][1].text, u'fish & chips')
+
+        vtt = u''.join(self.track.iter_export('vtt'))
+        self.assertIn(u'3\n00:00:08.000 --> 00:00:12.000\ncaf\xe9\n', vtt)
+
+    def test_seconds_to_vtt(self):
+        self.assertEqual(vtt_writer.secondsToVTT(0), '00:00:00.000')
+        self.assertEqual(vtt_writer.secondsToVTT(4.1), '00:00:04.100')
+        self.assertEqual(vtt_writer.secondsToVTT(3725.5), '01:02:05.500')
+
+    def test_publish_single_pass(self):
+        Track.objects.filter(pk=self.track.pk).update(
+            publish_text='public', publish_vtt='public',
+            publish_transcript='public')
+        item = Item.objects.get(pk=self.track.item_id)
+        directory = tempfile.mkdtemp()
+        try:
+            with self.settings(SPINDLE_PUBLIC_DIRECTORY=directory):
+                exports = list(publish.item_exports(item))
+                cache.clear()
+                # Tracks, item, one query over the clips for all
+                # three formats, then the manifest lookup and a new
+                # manifest entry (update, then insert) for each format
+                with self.assertNumQueries(10):
+                    publish.publish_item(item)
+                for export in exports:
+                    with open(export.linkpath) as exported:
+                        self.assertEqual(exported.read(), render_cache.render(
+                                export.track, export.format))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_html_stable(self):
+        track = Track.objects.select_related('item').get(pk=self.track.pk)
+        html = u''.join(track.iter_export('html'))
+        now = timezone.now
+        timezone.now = lambda: now() + datetime.timedelta(days=1)
+        try:
+            self.assertEqual(u''.join(track.iter_export('html')), html)
+        finally:
+            timezone.now = now
+
+    def test_unchanged_exports(self):
+        Track.objects.filter(pk=self.track.pk).update(publish_text='public')
+        track = Track.objects.get(pk=self.track.pk)
+        directory = tempfile.mkdtemp()
+        try:
+            with self.settings(SPINDLE_PUBLIC_DIRECTORY=directory):
+                self.assertTrue(publish.TextExport(track).write())
+                href = publish.TextExport(track).href
+                files = os.listdir(publish.TextExport(track).dirname)
+
+                # Same content: same file and URL
+                self.assertFalse(publish.TextExport(track).write())
+                self.assertEqual(publish.TextExport(track).href, href)
+                self.assertEqual(os.listdir(publish.TextExport(track).dirname), files)
+
+                clip = track.clip_set.all()[0]
+                clip.caption_text = u'changed'
+                clip.save()
+                track.content_changed()
+                export = publish.TextExport(Track.objects.get(pk=track.pk))
+                self.assertTrue(export.write())
+                self.assertNotEqual(export.href, href)
+                with open(export.linkpath) as exported:
+                    self.assertIn('changed', exported.read())
+
+                # The superseded file is kept until it is old enough
+                self.assertEqual(publish.sweep_exports(), 0)
+                self.assertEqual(len(os.listdir(export.dirname)), 3)
+                self.assertEqual(publish.sweep_exports(max_age=-10), 1)
+                self.assertEqual(sorted(os.listdir(export.dirname)),
+                                 sorted([export.filename, export.linkname]))
+        finally:
+            shutil.rmtree(directory)
+
+
+class DirtyQueueTest(TestCase):
+    """Only tracks changed since the last publish are published."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tracks = [Track.empty(make_item(duration=8), publish_text='public')
+                       for n in range(2)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def published(self):
+        with self.settings(SPINDLE_PUBLIC_DIRECTORY=self.directory):
+            publish.publish_queued_tracks()
+        return sorted(int(name) for name in os.listdir(self.directory))
+
+    def test_queue(self):
+        self.assertEqual(self.published(), [track.id for track in self.tracks])
+        self.assertFalse(models.DirtyTrack.objects.exists())
+        shutil.rmtree(self.directory)
+        os.mkdir(self.directory)
+
+        self.tracks[1].content_changed()
+        self.assertEqual(self.published(), [self.tracks[1].id])
+        self.assertEqual(self.published(), [self.tracks[1].id])
+
+        item = self.tracks[0].item
+        item.name = 'Renamed'
+        item.save()
+        self.assertEqual(self.published(), [track.id for track in self.tracks])
+
+
+class PublishPlanTest(TestCase):
+    """A full publish makes the same number of queries for any number
+    of items."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.feeds = publish.EXPORTS_RSS_FILENAME, publish.FULLTEXT_RSS_FILENAME
+        publish.EXPORTS_RSS_FILENAME = os.path.join(self.directory, 'exports.rss')
+        publish.FULLTEXT_RSS_FILENAME = os.path.join(self.directory, 'fulltext.rss')
+
+    def tearDown(self):
+        publish.EXPORTS_RSS_FILENAME, publish.FULLTEXT_RSS_FILENAME = self.feeds
+        shutil.rmtree(self.directory)
+
+    def add_items(self, count):
+        for n in range(count):
+            track = Track.empty(make_item(duration=8), publish_text='public',
+                                publish_vtt='public')
+            Track.objects.get(pk=track.pk).refresh_keyword_cache()
+
+    def publish_queries(self):
+        with self.settings(SPINDLE_PUBLIC_DIRECTORY=self.directory):
+            publish.publish_all_items()
+            connection.use_debug_cursor = True
+            start = len(connection.queries)
+            try:
+                publish.publish_all_items()
+                publish.publish_exports_feed()
+                publish.publish_fulltext_feed()
+                return len(connection.queries) - start
+            finally:
+                connection.use_debug_cursor = None
+
+    def test_constant_queries(self):
+        self.add_items(2)
+        queries = self.publish_queries()
+        self.add_items(3)
+        self.assertEqual(self.publish_queries(), queries)
+        with open(publish.EXPORTS_RSS_FILENAME) as feed:
+            self.assertEqual(feed.read().count('<item>'), 10)
+
+        plan = publish.plan_exports()
+        self.assertEqual(len(plan), 5)
+        self.assertEqual([export.format for export in plan[0][1]], ['txt', 'vtt'])
+
+    def test_feeds_from_manifest(self):
+        self.add_items(2)
+        with self.settings(SPINDLE_PUBLIC_DIRECTORY=self.directory):
+            publish.publish_all_items()
+            sizes = sorted(os.path.getsize(export.linkpath)
+                           for item, exports in publish.plan_exports()
+                           for export in exports)
+
+            def no_files(*args):
+                raise AssertionError('public directory used')
+            saved = os.readlink, os.path.exists, os.path.getsize
+            os.readlink = os.path.exists = os.path.getsize = no_files
+            try:
+                publish.publish_exports_feed()
+            finally:
+                os.readlink, os.path.exists, os.path.getsize = saved
+
+        with open(publish.EXPORTS_RSS_FILENAME) as feed:
+            enclosures = ET.parse(feed).findall('channel/item/enclosure')
+        self.assertEqual(sorted(int(enclosure.get('length'))
+                                for enclosure in enclosures), sizes)
+
+        # An empty manifest, as after upgrading, is filled from the
+        # public directory
+        models.PublishedFile.objects.all().delete()
+        with self.settings(SPINDLE_PUBLIC_DIRECTORY=self.directory):
+            publish.publish_exports_feed()
+        self.assertEqual(models.PublishedFile.objects.count(), 4)
+        with open(publish.EXPORTS_RSS_FILENAME) as feed:
+            self.assertEqual(len(ET.parse(feed).findall('channel/item')), 4)
+
+        with self.settings(SPINDLE_PUBLIC_DIRECTORY=self.directory):
+            self.assertEqual(publish.rebuild_manifest(), 4)
+
+    def test_command_all(self):
+        def publish_all():
+            with self.settings(SPINDLE_PUBLIC_DIRECTORY=self.directory):
+                call_command('spindle_publish', 'all', stderr=StringIO.StringIO())
+            with open(publish.EXPORTS_RSS_FILENAME) as feed:
+                return [enclosure.get('url') for enclosure
+                        in ET.parse(feed).findall('channel/item/enclosure')]
+
+        def current_urls():
+            with self.settings(SPINDLE_PUBLIC_DIRECTORY=self.directory):
+                return sorted(urlparse.urljoin(export.url_dirname,
+                                               os.path.basename(os.readlink(export.linkpath)))
+                              for item, exports in publish.plan_exports()
+                              for export in exports)
+
+        # A newly published track is in the feed from the first run
+        self.add_items(1)
+        self.assertEqual(sorted(publish_all()), current_urls())
+
+        # After an edit, the feed links to the new files
+        track = Track.objects.get()
+        clip = track.clip_set.all()[0]
+        clip.caption_text = u'changed'
+        clip.save()
+        track.content_changed()
+        urls = publish_all()
+        self.assertEqual(sorted(urls), current_urls())
+        self.assertEqual(len(urls), 2)
+
+    def test_parallel(self):
+        # Pool processes would not see the test's transaction, so the
+        # chunks are published in this process
+        self.add_items(5)
+        links = lambda: filter(os.path.islink,
+                               glob.glob(os.path.join(self.directory, '*', '*.vtt')))
+        chunk_size, processes = publish.PUBLISH_CHUNK_SIZE, publish.PUBLISH_PROCESSES
+        publish.PUBLISH_CHUNK_SIZE, publish.PUBLISH_PROCESSES = 2, 1
+        try:
+            with self.settings(SPINDLE_PUBLIC_DIRECTORY=self.directory):
+                publish.publish_all_items(parallel=True)
+                self.assertEqual(len(links()), 5)
+                self.assertEqual(models.PublishedFile.objects.count(), 10)
+                self.assertFalse(any(export.needs_export
+                                     for item, exports in publish.plan_exports()
+                                     for export in exports))
+
+                track = Track.objects.latest('id')
+                shutil.rmtree(os.path.join(self.directory, str(track.id)))
+                publish.publish_queued_tracks(parallel=True)
+                self.assertEqual(len(links()), 5)
+                self.assertEqual(models.DirtyTrack.objects.count(), 0)
+                published = models.PublishedFile.objects.get(track=track, format='vtt')
+                self.assertEqual(published.filename, os.path.basename(
+                        os.readlink(publish.VTTExport(track).linkpath)))
+        finally:
+            publish.PUBLISH_CHUNK_SIZE, publish.PUBLISH_PROCESSES = chunk_size, processes
+
+    def test_parallel_progress(self):
+        class Request(object):
+            called_directly = True
+
+        class ProgressTask(object):
+            request = Request()
+            def __init__(self):
+                self.progress = []
+            def update_progress(self, progress, message):
+                self.progress.append(progress)
+
+        chunks = []
+        def publish_tracks(track_ids, stale_only=True):
+            chunks.append(track_ids)
+            return len(track_ids)
+
+        saved = (publish.publish_tracks, publish.PUBLISH_CHUNK_SIZE,
+                 publish.PUBLISH_PROCESSES)
+        publish.publish_tracks = publish_tracks
+        publish.PUBLISH_CHUNK_SIZE, publish.PUBLISH_PROCESSES = 2, 1
+        try:
+            task = ProgressTask()
+            self.assertEqual(publish.publish_in_parallel(task, range(5)), 5)
+            self.assertEqual(publish.publish_in_parallel(task, []), 0)
+        finally:
+            (publish.publish_tracks, publish.PUBLISH_CHUNK_SIZE,
+             publish.PUBLISH_PROCESSES) = saved
+        self.assertEqual(chunks, [[0, 1], [2, 3], [4]])
+        self.assertEqual(task.progress, [1.0 / 3, 2.0 / 3, 1.0])
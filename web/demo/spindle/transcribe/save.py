@@ -8,7 +8,7 @@ unpredictable.
 
 import logging
 from django.db import transaction
-from spindle.models import Item, Track, Clip, Speaker
+from spindle.models import Item, Track, Clip, Speaker, TermIndex, update_columns
 
 def save_transcription(item, clips, speakers=None, engine=None, raw_files=None,
                        logger=None):
@@ -47,3 +47,8 @@ def save_transcription(item, clips, speakers=None, engine=None, raw_files=None,
             clip.track = track
 
         Clip.objects.bulk_create(clips)
+        update_columns(track,
+                       clip_count=len(clips),
+                       edited_clip_count=sum(1 for clip in clips if clip.edited))
+        TermIndex.build(track, [clip.caption_text for clip in clips])
+        track.queue_keyword_refresh()
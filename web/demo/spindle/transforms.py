@@ -0,0 +1,154 @@
+"""Bulk transformations of the clips of a track, done on the server.
+
+  shift    move clips starting after a given time by an offset
+  rescale  multiply clip times by a factor, e.g. after a re-encode
+  merge    merge clips shorter than a minimum duration into the
+           clip before
+  split    split clips longer than a maximum duration
+
+Shifting and rescaling are single UPDATE statements; merging and
+splitting read the clips once and write the changes in batches.  Use
+`run', which applies a transform in one transaction, keeps the
+derived data of the track up to date and archives one new version of
+the item.
+"""
+
+import math
+
+from django.db import transaction
+from django.db.models import F, Min
+
+from spindle.models import Clip, TermIndex, bulk_insert
+
+# Number of primary keys per DELETE
+BATCH_SIZE = 500
+
+
+def shift(track, offset, after=0.0):
+    """Move the clips of `track' starting at or after `after' by
+    `offset' seconds.  Returns the number of clips changed."""
+    clips = track.clip_set.filter(intime__gte=after)
+    first = clips.aggregate(first=Min('intime'))['first']
+    if first is not None and first + offset < 0:
+        raise ValueError('Cannot shift clips to before the start')
+    return clips.update(intime=F('intime') + offset,
+                        outtime=F('outtime') + offset)
+
+
+def rescale(track, factor, origin=0.0):
+    """Scale the times of the clips of `track' by `factor', keeping
+    time `origin' fixed.  Returns the number of clips changed."""
+    if factor <= 0:
+        raise ValueError('Scale factor must be positive')
+    return track.clip_set.update(
+        intime=F('intime') * factor + origin * (1 - factor),
+        outtime=F('outtime') * factor + origin * (1 - factor))
+
+
+def clip_rows(track):
+    return [list(row) for row in track.clip_set.order_by('intime').values_list(
+            'id', 'intime', 'outtime', 'caption_text', 'edited', 'speaker_id')]
+
+def join_text(*texts):
+    return u' '.join(text.strip() for text in texts if text.strip())
+
+
+def merge(track, min_duration):
+    """Merge each clip of `track' shorter than `min_duration' seconds
+    into the clip before it, if that has the same speaker.  Returns
+    the number of clips changed or deleted."""
+    kept, changed, deleted, removed_texts = [], {}, [], []
+    for row in clip_rows(track):
+        pk, intime, outtime, text, edited, speaker_id = row
+        previous = kept[-1] if kept else None
+        if (outtime - intime >= min_duration or previous is None
+            or previous[5] != speaker_id):
+            kept.append(row)
+            continue
+
+        if previous[0] not in changed:
+            removed_texts.append(previous[3])
+        previous[2] = max(previous[2], outtime)
+        previous[3] = join_text(previous[3], text)
+        previous[4] = previous[4] or edited
+        changed[previous[0]] = previous
+        deleted.append(pk)
+        removed_texts.append(text)
+
+    for pk, intime, outtime, text, edited, speaker_id in changed.itervalues():
+        Clip.objects.filter(pk=pk).update(outtime=outtime, caption_text=text,
+                                          edited=edited)
+    for start in range(0, len(deleted), BATCH_SIZE):
+        Clip.objects.filter(pk__in=deleted[start:start + BATCH_SIZE]).delete()
+
+    TermIndex.update(track, added=[row[3] for row in changed.itervalues()],
+                     removed=removed_texts)
+    return len(changed) + len(deleted)
+
+
+def split(track, max_time):
+    """Split each clip of `track' longer than `max_time' seconds into
+    equal parts, dividing its words between them.  Returns the number
+    of clips changed or created."""
+    if max_time <= 0:
+        raise ValueError('Maximum clip length must be positive')
+
+    changed, created = 0, []
+    added_texts, removed_texts = [], []
+    for pk, intime, outtime, text, edited, speaker_id in clip_rows(track):
+        if outtime - intime <= max_time: continue
+
+        parts = int(math.ceil((outtime - intime) / max_time))
+        step = (outtime - intime) / parts
+        words = text.split()
+        texts = [u' '.join(words[n * len(words) // parts:
+                                 (n + 1) * len(words) // parts])
+                 for n in range(parts)]
+
+        Clip.objects.filter(pk=pk).update(outtime=intime + step,
+                                          caption_text=texts[0])
+        for n in range(1, parts):
+            created.append(Clip(track=track, intime=intime + n * step,
+                                outtime=outtime if n == parts - 1
+                                        else intime + (n + 1) * step,
+                                caption_text=texts[n], edited=edited,
+                                speaker_id=speaker_id, begin_para=False))
+        changed += 1
+        added_texts.extend(texts)
+        removed_texts.append(text)
+
+    bulk_insert(Clip, created)
+    TermIndex.update(track, added=added_texts, removed=removed_texts)
+    return changed + len(created)
+
+
+OPERATIONS = {
+    'shift': shift,
+    'rescale': rescale,
+    'merge': merge,
+    'split': split,
+    }
+
+
+def run(track, operation, *args, **params):
+    """Apply the transform named `operation' to `track', with numeric
+    arguments `args' and `params', and archive the item if anything
+    changed.  Returns the number of clips changed.
+
+    Raises KeyError for an unknown operation, and TypeError or
+    ValueError for bad parameters.
+    """
+    function = OPERATIONS[operation]
+    args = [float(value) for value in args]
+    params = dict((str(name), float(value)) for name, value in params.iteritems())
+
+    with transaction.commit_on_success():
+        changed = function(track, *args, **params)
+        if changed:
+            if operation in ('merge', 'split'):
+                track.update_clip_counts()
+            track.content_changed()
+
+    if changed:
+        track.item.archive()
+    return changed
@@ -0,0 +1,212 @@
+"""Compact storage for archived versions of items.
+
+A version of an item is the list of objects making up the item and its
+tracks, speakers and clips, as decoded from Django's "json"
+serialization.  Successive versions usually differ by a handful of
+clips, so instead of storing each version in full, ArchivedItem stores
+a full "keyframe" every few versions and, in between, deltas holding
+only the objects which were added, changed or deleted since the
+version before.  Both are compressed with zlib.
+
+`diff' compares two versions clip by clip, for displaying the changes
+made in a revision.
+"""
+
+import json
+import zlib
+import base64
+
+# Order of the objects in a reconstructed version
+MODEL_ORDER = ('spindle.speaker', 'spindle.clip', 'spindle.track',
+               'spindle.item')
+
+
+def object_key(obj):
+    return (obj['model'], obj['pk'])
+
+def sort_key(obj):
+    try:
+        rank = MODEL_ORDER.index(obj['model'])
+    except ValueError:
+        rank = len(MODEL_ORDER)
+    return (rank, obj['pk'])
+
+
+def pack(data):
+    """Encode JSON-serializable `data' as compressed, base64 text."""
+    return base64.b64encode(
+        zlib.compress(json.dumps(data, separators=(',', ':')), 9))
+
+def unpack(text):
+    """Inverse of `pack'."""
+    return json.loads(zlib.decompress(base64.b64decode(text)))
+
+
+def make_delta(old, new):
+    """Return the delta which turns the list of objects `old' into
+    `new'.
+
+    The delta is a dict with keys `changed', the objects of `new' which
+    are not in `old' or differ from it, and `deleted', the [model, pk]
+    keys of the objects of `old' which are not in `new'.
+    """
+    old_objects = dict((object_key(obj), obj) for obj in old)
+    new_keys = set()
+    changed = []
+    for obj in new:
+        key = object_key(obj)
+        new_keys.add(key)
+        if old_objects.get(key) != obj:
+            changed.append(obj)
+
+    deleted = [list(key) for key in old_objects if key not in new_keys]
+    return { 'changed': changed, 'deleted': deleted }
+
+def apply_delta(objects, delta):
+    """Apply a delta made by `make_delta' to a list of objects,
+    returning a new list."""
+    result = dict((object_key(obj), obj) for obj in objects)
+    for model, pk in delta['deleted']:
+        result.pop((model, pk), None)
+    for obj in delta['changed']:
+        result[object_key(obj)] = obj
+    return sorted(result.itervalues(), key=sort_key)
+
+
+#
+# Comparing versions
+#
+
+# Fields which change on every save, left out of diffs
+IGNORED_FIELDS = ('updated',)
+
+
+def split_objects(objects):
+    """Split a version into the item (or None), and dicts of tracks,
+    speakers by track and clips by track, indexed by primary key."""
+    item = None
+    tracks, speakers, clips = {}, {}, {}
+    for obj in objects:
+        model = obj['model']
+        if model == 'spindle.item':
+            item = obj
+        elif model == 'spindle.track':
+            tracks[obj['pk']] = obj
+        elif model == 'spindle.speaker':
+            speakers.setdefault(obj['fields']['track'], {})[obj['pk']] = obj
+        elif model == 'spindle.clip':
+            clips.setdefault(obj['fields']['track'], {})[obj['pk']] = obj
+    return item, tracks, speakers, clips
+
+
+def clip_times(clip):
+    return (clip['fields']['intime'], clip['fields']['outtime'])
+
+def clip_content(clip):
+    fields = clip['fields']
+    return (fields['intime'], fields['outtime'], fields['caption_text'],
+            fields.get('speaker'), fields.get('edited'))
+
+def align_clips(old, new):
+    """Match up the clips of two versions of a track.
+
+    `old' and `new' are dicts of clips by primary key.  Clips are
+    matched by primary key and then, since saving from the editor
+    recreates clips under new keys, by in and out times.  Returns a
+    list of (old clip, new clip) pairs, with None for inserted or
+    deleted clips, ordered by time; unchanged clips are left out.
+    """
+    pairs = []
+    old_unmatched = {}
+    new_unmatched = dict((pk, clip) for pk, clip in new.iteritems()
+                         if pk not in old)
+    for pk, clip in old.iteritems():
+        if pk in new:
+            pairs.append((clip, new[pk]))
+        else:
+            old_unmatched.setdefault(clip_times(clip), []).append(clip)
+
+    for pk in sorted(new_unmatched):
+        clip = new_unmatched[pk]
+        candidates = old_unmatched.get(clip_times(clip))
+        if candidates:
+            pairs.append((candidates.pop(0), clip))
+        else:
+            pairs.append((None, clip))
+    for candidates in old_unmatched.itervalues():
+        pairs.extend((clip, None) for clip in candidates)
+
+    changed = [(old_clip, new_clip) for old_clip, new_clip in pairs
+               if old_clip is None or new_clip is None
+               or clip_content(old_clip) != clip_content(new_clip)]
+    changed.sort(key=lambda (old_clip, new_clip): (
+            clip_times(new_clip or old_clip), new_clip is not None))
+    return changed
+
+
+def format_clip(clip):
+    fields = clip['fields']
+    return u'{:8.2f} {:8.2f} {:6}  {}\n'.format(
+        fields['intime'], fields['outtime'],
+        fields.get('speaker') or '', fields['caption_text'])
+
+def field_lines(old, new, exclude=()):
+    """Lines for the fields which differ between two objects (either
+    of which may be None)."""
+    old_fields = old['fields'] if old else {}
+    new_fields = new['fields'] if new else {}
+    for field in sorted(set(old_fields) | set(new_fields)):
+        if field in IGNORED_FIELDS or field in exclude: continue
+        if old_fields.get(field) == new_fields.get(field): continue
+        if field in old_fields:
+            yield u'-{}: {}\n'.format(field, old_fields[field])
+        if field in new_fields:
+            yield u'+{}: {}\n'.format(field, new_fields[field])
+
+def speaker_lines(old, new):
+    for pk in sorted(set(old) | set(new)):
+        old_name = old[pk]['fields']['name'] if pk in old else None
+        new_name = new[pk]['fields']['name'] if pk in new else None
+        if old_name == new_name: continue
+        if old_name is not None:
+            yield u'-Speaker {}: {}\n'.format(pk, old_name)
+        if new_name is not None:
+            yield u'+Speaker {}: {}\n'.format(pk, new_name)
+
+def clip_lines(old, new):
+    for old_clip, new_clip in align_clips(old, new):
+        if old_clip is not None: yield u'-' + format_clip(old_clip)
+        if new_clip is not None: yield u'+' + format_clip(new_clip)
+
+
+def diff(old, new):
+    """Compare two versions of an item, given as lists of objects.
+
+    Yields the lines of a unified-diff-like description of the
+    changes: item fields, then for each changed track its fields,
+    speakers, and the inserted, deleted and modified clips in time
+    order.
+    """
+    old_item, old_tracks, old_speakers, old_clips = split_objects(old)
+    new_item, new_tracks, new_speakers, new_clips = split_objects(new)
+
+    lines = list(field_lines(old_item, new_item))
+    if lines:
+        yield u' Item: {}\n'.format((new_item or old_item)['fields']['name'])
+        for line in lines: yield line
+
+    for pk in sorted(set(old_tracks) | set(new_tracks)):
+        old_track, new_track = old_tracks.get(pk), new_tracks.get(pk)
+        lines = []
+        lines.extend(field_lines(old_track, new_track, exclude=('item',)))
+        lines.extend(speaker_lines(old_speakers.get(pk, {}),
+                                   new_speakers.get(pk, {})))
+        lines.extend(clip_lines(old_clips.get(pk, {}), new_clips.get(pk, {})))
+        if not lines: continue
+
+        if old_track is None: prefix = u'+'
+        elif new_track is None: prefix = u'-'
+        else: prefix = u' '
+        yield u'\n{}Track {}: {}\n'.format(
+            prefix, pk, (new_track or old_track)['fields']['name'])
+        for line in lines: yield line
@@ -21,7 +21,6 @@ import celery.task.base
 
 from spindle.models import Item, ArchivedItem, Track, TranscriptionTask
 from spindle.readers import vtt, xmp
-from spindle.keywords.keywords import keywords_and_ngrams
 import spindle.transcribe
 import spindle.tasks
 import spindle.publish
@@ -274,6 +273,7 @@ def item_add_track(request, item_id):
                 # correctly. Sigh.
                 clip.speaker = clip.speaker
                 clip.save()
+            track.update_clip_counts()
 
         return redirect(edit_track, track_id=track.id)
     elif 'request_transcript' in request.POST:
@@ -310,10 +310,7 @@ def revert_item(request, version_id):
 def diff_item(request, version_id):
     version = get_object_or_404(ArchivedItem, pk=version_id)
 
-    diff_file = version.diff()
-    resp = HttpResponse('', content_type='text/plain')
-    for line in diff_file: resp.write(line)
-    return resp
+    return HttpResponse(version.diff(), content_type='text/plain')
 
 
 # Track-level operations
@@ -372,8 +369,9 @@ class TrackMetaView(UpdateView):
 def keywords(request, track_id):
     track = get_object_or_404(Track, pk=track_id)
     item = track.item
-    text = (clip.caption_text for clip in track.clip_set.all())
-    kw, ngrams = keywords_and_ngrams(text)
+    # Show cached results, even if they're being refreshed
+    results = track.keyword_results()
+    kw, ngrams = results['keywords'], results['ngrams']
 
     def keyword_html(sorted_x):
         tags = ""
@@ -403,6 +401,7 @@ def keywords(request, track_id):
             'track': track,
             'keywordblock': keyword_html(kw),
             'ngramblock': ngram_html(ngrams),
+            'refreshing': track.keywords_stale,
             'oxitems_keywords': item.keywords
             })
 
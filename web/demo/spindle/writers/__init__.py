@@ -0,0 +1,38 @@
+"""Transcript export formats.
+
+Each format is a Writer, which turns a sequence of clips into text a
+piece at a time: `head' before the first clip, `clip' for each clip
+and `tail' after the last.  Writers keep whatever state they need from
+one clip to the next, so that several formats can be written in a
+single pass over the clips (see `write_many').
+"""
+
+
+class Writer(object):
+    def head(self):
+        return u''
+
+    def clip(self, clip):
+        raise NotImplementedError
+
+    def tail(self):
+        return u''
+
+
+def generate(writer, clips):
+    """Yield the output of `writer' for `clips', as unicode strings."""
+    yield writer.head()
+    for clip in clips:
+        yield writer.clip(clip)
+    yield writer.tail()
+
+def write_many(outputs, clips):
+    """Write `clips' in several formats in one pass.  `outputs' is a
+    list of (writer, file) pairs; each file is given unicode strings."""
+    for writer, outfile in outputs:
+        outfile.write(writer.head())
+    for clip in clips:
+        for writer, outfile in outputs:
+            outfile.write(writer.clip(clip))
+    for writer, outfile in outputs:
+        outfile.write(writer.tail())
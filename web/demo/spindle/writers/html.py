@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+
+from django.utils.html import escape
+
+from spindle.writers import Writer
+
+
+class HTMLWriter(Writer):
+    """HTML transcript: a <div> with a <p> for each paragraph, and
+    changes of speaker marked by <span class="speaker">, between the
+    strings `head' and `tail'.
+    """
+    def __init__(self, head=u'', tail=u''):
+        self.page_head = head
+        self.page_tail = tail
+        self.speaker_id = None
+        self.para_open = False
+
+    def head(self):
+        return self.page_head + u'<div>'
+
+    def clip(self, clip):
+        # Begin new paragraph if indicated
+        if not self.para_open:
+            text = u'<p>'
+            self.para_open = True
+        elif clip.begin_para:
+            text = u'</p><p>'
+        else:
+            text = u''
+
+        # Speaker change?
+        if clip.speaker_id and clip.speaker_id != self.speaker_id:
+            self.speaker_id = clip.speaker_id
+            text += u'<span class="speaker">{}: </span>'.format(
+                escape(clip.speaker.name.strip()))
+
+        return text + escape(clip.caption_text.strip()) + u' '
+
+    def tail(self):
+        return (u'</p>' if self.para_open else u'') + u'</div>' + self.page_tail
@@ -0,0 +1,18 @@
+from spindle.writers import Writer
+
+
+class PlaintextWriter(Writer):
+    """Plain text transcript.
+
+    Paragraphs are separated by blank lines, and each change of
+    speaker is marked with the speaker's name in capitals.
+    """
+    def __init__(self):
+        self.speaker_id = None
+
+    def clip(self, clip):
+        text = u'\n\n' if clip.begin_para else u''
+        if clip.speaker_id and clip.speaker_id != self.speaker_id:
+            text += clip.speaker.name.upper() + u': '
+            self.speaker_id = clip.speaker_id
+        return text + clip.caption_text.strip() + u' '
@@ -1,36 +1,50 @@
 
-from math import floor
+from spindle.writers import Writer, generate
 
-def secondsToVTT(secs):
-    milli = int(1000 * (secs - floor(secs)))
-    secs = floor(secs)
-
-    minutes = int(floor(secs/60))
-    secs = int(secs - 60*minutes)
-
-    hours = int(floor(minutes/60))
-    minutes = int(minutes - 60*hours)
 
-    return "{:02d}:{:02d}:{:02d}.{:03d}".format(hours, minutes, secs, milli)
+def secondsToVTT(secs):
+    """Format a time in seconds as a WebVTT timestamp, to the nearest
+    millisecond."""
+    milli = int(secs * 1000 + 0.5)
+    secs = milli // 1000
+    return "%02d:%02d:%02d.%03d" % (secs // 3600, secs // 60 % 60, secs % 60,
+                                    milli % 1000)
+
+
+class VTTWriter(Writer):
+    """WebVTT captions, a cue for each clip."""
+    def __init__(self):
+        self.count = 0
+        # Clips usually start when the one before ends, so the last
+        # timestamp is kept for reuse
+        self.last_time = None
+        self.last_timestamp = None
+
+    def timestamp(self, secs):
+        if secs != self.last_time:
+            self.last_time = secs
+            self.last_timestamp = secondsToVTT(secs)
+        return self.last_timestamp
+
+    def head(self):
+        return u"WEBVTT FILE\n\n"
+
+    def clip(self, clip):
+        self.count += 1
+        intime = self.timestamp(clip.intime)
+        return u"%d\n%s --> %s\n%s\n\n" % (
+            self.count, intime, self.timestamp(clip.outtime), clip.caption_text)
 
 
 def write(clips, file_or_name):
-    if isinstance(file_or_name, str):
-        output = open(output, 'w')
+    if isinstance(file_or_name, basestring):
+        output = open(file_or_name, 'w')
         close = True
     else:
         output = file_or_name
         close = False
 
-    output.write("WEBVTT FILE\n\n")
-
-    count = 1
-    for clip in clips:
-        output.write("{:d}\n".format(count))
-        output.write("{} --> {}\n".format(
-                secondsToVTT(clip.intime),
-                secondsToVTT(clip.outtime)))
-        output.write("{}\n\n".format(clip.caption_text))
-        count += 1
+    for piece in generate(VTTWriter(), clips):
+        output.write(piece.encode('utf-8'))
 
     if close: output.close()
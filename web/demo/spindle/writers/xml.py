@@ -0,0 +1,25 @@
+from __future__ import absolute_import
+
+from xml.sax.saxutils import escape, quoteattr
+
+from spindle.writers import Writer
+
+
+class XMLWriter(Writer):
+    """XML transcript: a <transcript> of <p> paragraphs, each holding
+    the <clip> elements of the paragraph with their times, edited flag
+    and id.
+    """
+    def head(self):
+        return u'<transcript><p>'
+
+    def clip(self, clip):
+        # Begin new paragraph if indicated
+        return u'{}<clip edited={} id={} intime={} outtime={}>{}</clip>'.format(
+            u'</p><p>' if clip.begin_para else u'',
+            quoteattr(str(clip.edited)), quoteattr(str(clip.id)),
+            quoteattr(str(clip.intime)), quoteattr(str(clip.outtime)),
+            escape(clip.caption_text))
+
+    def tail(self):
+        return u'</p></transcript>'